@@ -0,0 +1,182 @@
+# coding=utf-8
+
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Dict, List, NamedTuple, Tuple
+from uuid import UUID
+
+import numpy as np
+import numpy.typing as npt
+from eventsourcing.application import Application
+from eventsourcing.utils import get_topic
+
+from banking import partitions
+from banking.domainmodel import Account
+from banking.transcoding import stored_topics
+
+CREDITED, DEBITED, OVERDRAFT_SET = range(3)
+KINDS = {
+    topic: kind
+    for kind, cls in enumerate([Account.Credited, Account.Debited, Account.OverdraftSet])  # type: ignore
+    for topic in stored_topics(get_topic(cls))
+}
+# Overdrafts are bucketed by how much of the limit they use: up to 25%,
+# 50%, 75%, 100%, and over it (including overdrawn with no limit).
+UTILIZATION_BINS = np.array([0.25, 0.5, 0.75, 1.0])
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECONDS = timedelta(microseconds=1)
+DAY = 86400 * 10 ** 6  # in microseconds
+DTYPES = (np.int32, np.int8, np.int64, np.int64)
+
+
+class LedgerColumns(NamedTuple):
+    account: npt.NDArray[np.int32]  # index into LedgerAnalytics.account_ids
+    kind: npt.NDArray[np.int8]  # CREDITED, DEBITED or OVERDRAFT_SET
+    amount: npt.NDArray[np.int64]  # cents
+    timestamp: npt.NDArray[np.int64]  # microseconds since the epoch, UTC
+
+
+class DailyAggregates(NamedTuple):
+    days: npt.NDArray[np.datetime64]  # in days, every day from the first event to the last
+    credits: npt.NDArray[np.int64]  # cents credited on the day
+    debits: npt.NDArray[np.int64]  # cents debited on the day
+    net_flow: npt.NDArray[np.int64]  # credits less debits
+    accounts_in_overdraft: npt.NDArray[np.int64]  # at the end of the day
+    utilization: npt.NDArray[np.int64]  # accounts in overdraft by UTILIZATION_BINS bucket, one row per day
+
+
+class LedgerAnalytics:
+    """
+    Bank-wide daily aggregates, computed from the Credited, Debited
+    and OverdraftSet events in the application's notification log.
+    The events are loaded, a chunk at a time, into columns of account
+    index, kind, amount and timestamp, and the aggregates are group-bys
+    over those columns, so nothing is computed one account at a time.
+    Like the TransactionHistory, it catches up before each query.
+    """
+
+    page_size = 1000
+    chunk_size = 100000
+    topics = list(KINDS)
+
+    def __init__(self, app: Application):
+        self.app = app
+        self.position = 0
+        self.account_ids: List[UUID] = []
+        self.account_indexes: Dict[UUID, int] = {}
+        self.chunks: List[LedgerColumns] = []
+        self.decoder = partitions.StateDecoder.from_mapper(app.mapper)
+        self.lock = Lock()
+
+    def columns(self) -> LedgerColumns:
+        """All the events loaded so far, as one set of columns."""
+        self.catch_up()
+        with self.lock:
+            if len(self.chunks) > 1:
+                self.chunks = [LedgerColumns(*map(np.concatenate, zip(*self.chunks)))]
+            return self.chunks[0] if self.chunks else self.empty_chunk()
+
+    def catch_up(self) -> None:
+        with self.lock:
+            rows: Tuple[List[int], List[int], List[int], List[int]] = ([], [], [], [])
+            position = self.position
+            # The position only moves past rows once they are in a chunk, so
+            # if reading fails part way, the rows it drops are read again.
+            for notifications, position in partitions.pages(self.app, self.topics, self.position, self.page_size):
+                for notification in notifications:
+                    self.load(notification.originator_id, notification.topic, notification.state, rows)
+                if len(rows[0]) >= self.chunk_size:
+                    self.add_chunk(rows)
+                    self.position = position
+                    rows = ([], [], [], [])
+            if rows[0]:
+                self.add_chunk(rows)
+            self.position = position
+
+    def load(
+            self,
+            account_id: UUID,
+            topic: str,
+            state: bytes,
+            rows: Tuple[List[int], List[int], List[int], List[int]],
+    ) -> None:
+        index = self.account_indexes.get(account_id)
+        if index is None:
+            index = self.account_indexes[account_id] = len(self.account_ids)
+            self.account_ids.append(account_id)
+        decoded = self.decoder.decode(state)
+        rows[0].append(index)
+        rows[1].append(KINDS[topic])
+        rows[2].append(decoded["amount_in_cents"])
+        rows[3].append((decoded["timestamp"] - EPOCH) // MICROSECONDS)
+
+    def add_chunk(self, rows: Tuple[List[int], List[int], List[int], List[int]]) -> None:
+        self.chunks.append(LedgerColumns(*(np.array(column, dtype) for column, dtype in zip(rows, DTYPES))))
+
+    @staticmethod
+    def empty_chunk() -> LedgerColumns:
+        return LedgerColumns(*(np.empty(0, dtype) for dtype in DTYPES))
+
+    def daily(self) -> DailyAggregates:
+        columns = self.columns()
+        if not len(columns.account):
+            empty = np.empty(0, np.int64)
+            return DailyAggregates(
+                np.empty(0, "datetime64[D]"), empty, empty, empty, empty,
+                np.empty((0, len(UTILIZATION_BINS) + 1), np.int64),
+            )
+        day = columns.timestamp // DAY
+        first_day = int(day.min())
+        day -= first_day
+        days = int(day.max()) + 1
+
+        credited = columns.kind == CREDITED
+        debited = columns.kind == DEBITED
+        credits = np.zeros(days, np.int64)
+        debits = np.zeros(days, np.int64)
+        np.add.at(credits, day[credited], columns.amount[credited])
+        np.add.at(debits, day[debited], columns.amount[debited])
+
+        # Each account's rows together, in the order they were recorded.
+        order = np.argsort(columns.account, kind="stable")
+        account = columns.account[order]
+        day = day[order]
+        kind = columns.kind[order]
+        amount = columns.amount[order]
+        row = np.arange(len(account))
+        starts = np.r_[True, account[1:] != account[:-1]]
+        start = np.maximum.accumulate(np.where(starts, row, 0))
+
+        # Running balance and latest overdraft limit of each account, after each row.
+        flow = np.where(kind == CREDITED, amount, np.where(kind == DEBITED, -amount, 0))
+        running = np.cumsum(flow)
+        balance = running - (running - flow)[start]
+        last_set = np.maximum.accumulate(np.where(kind == OVERDRAFT_SET, row, -1))
+        limit = np.where(last_set >= start, amount[np.maximum(last_set, 0)], 0)
+
+        # Where each account stood at the end of each day it had events:
+        # not overdrawn (-1), or the bucket of how much of its limit it used.
+        ends = np.r_[(account[1:] != account[:-1]) | (day[1:] != day[:-1]), True]
+        end_account, end_day, end_balance = account[ends], day[ends], balance[ends]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            used = -end_balance / limit[ends]
+        bucket = np.where(end_balance < 0, np.digitize(used, UTILIZATION_BINS, right=True), -1)
+        previous = np.r_[-1, bucket[:-1]]
+        previous[np.r_[True, end_account[1:] != end_account[:-1]]] = -1
+
+        # Count each change of bucket on its day, then carry the counts forward.
+        changes = np.zeros((days, len(UTILIZATION_BINS) + 1), np.int64)
+        left = (previous != bucket) & (previous >= 0)
+        entered = (previous != bucket) & (bucket >= 0)
+        np.add.at(changes, (end_day[left], previous[left]), -1)
+        np.add.at(changes, (end_day[entered], bucket[entered]), 1)
+        utilization = np.cumsum(changes, axis=0)
+
+        return DailyAggregates(
+            days=np.arange(first_day, first_day + days).astype("datetime64[D]"),
+            credits=credits,
+            debits=debits,
+            net_flow=credits - debits,
+            accounts_in_overdraft=utilization.sum(axis=1),
+            utilization=utilization,
+        )
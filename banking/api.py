@@ -1,16 +1,44 @@
 # coding=utf-8
 # flake8: noqa E402
+import json
+import os
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
 from uuid import UUID
-from eventsourcing.application import AggregateNotFound
-from flask import Flask, request, jsonify
-from flask_jwt import JWT, jwt_required, _default_jwt_encode_handler, current_identity  # type: ignore
-from banking.domainmodel import AccountNotFoundError, InsufficientFundsError
+from flask import Flask, Request, Response, current_app, g, request, jsonify, stream_with_context
+from flask_jwt import JWT, JWTError, _default_jwt_decode_handler, _default_jwt_encode_handler  # type: ignore
+from jwt import InvalidTokenError
+from werkzeug.local import LocalProxy
+from banking import metrics
+from banking.domainmodel import (
+    AccountClosedError, AccountNotFoundError, BadCredentials, InsufficientFundsError, TransactionError,
+)
 from banking.applicationmodel import Bank
+from banking.idempotency import IdempotencyStore, digest
+from banking.tokens import VerifiedTokens
+
+
+class TimedRequest(Request):
+    def get_json(self, *args: Any, **kwargs: Any) -> Any:
+        with metrics.phase("json"):
+            return super().get_json(*args, **kwargs)
+
 
 app = Flask(__name__)
+app.request_class = TimedRequest
 app.config["SECRET_KEY"] = "super-secret"
+app.config["BATCH_STREAM_CHUNK_SIZE"] = 500
+app.config["TRANSACTIONS_PAGE_SIZE"] = 50
+app.config["TRANSACTIONS_MAX_PAGE_SIZE"] = 500
+# Time spent parsing JSON, decoding the token, in the Bank and in the
+# event store, as a Server-Timing header on every response.
+app.config["SERVER_TIMING"] = os.getenv("SERVER_TIMING", "") not in ("", "0", "false")
 
 bank_instance = Bank()
+idempotency_keys = IdempotencyStore.from_env(os.environ)
 
 
 # Utility to get the bank instance
@@ -25,13 +53,11 @@ class User:
 # Authenticate user function for JWT
 def authenticate(email, password):
     try:
-        account_id = bank().get_account_id_by_email(email)
-        account = bank().get_account(account_id)
-        if account and account.check_password(password):
-            user_instance = User()
-            user_instance.id = str(account.id)
-            return user_instance
-    except (AccountNotFoundError, AggregateNotFound):
+        account_id = bank().authenticate(email, password)
+        user_instance = User()
+        user_instance.id = str(account_id)
+        return user_instance
+    except (AccountNotFoundError, BadCredentials):
         return None
 
 
@@ -43,6 +69,74 @@ def identity(payload):
 
 
 jwt = JWT(app, authenticate, identity)
+verified_tokens = VerifiedTokens.from_env(_default_jwt_decode_handler, identity, os.environ)
+current_identity: User = LocalProxy(lambda: g.identity)  # type: ignore
+
+
+def authenticate_header(auth_header_value: Optional[str]) -> User:
+    """
+    Same checks and errors as flask_jwt's jwt_required(), except that a
+    token already verified is looked up rather than decoded again, and
+    the account it names must still be open.
+    """
+    with metrics.phase("jwt"):
+        if not auth_header_value:
+            raise JWTError(
+                'Authorization Required', 'Request does not contain an access token',
+                headers={'WWW-Authenticate': 'JWT realm="%s"' % current_app.config['JWT_DEFAULT_REALM']},
+            )
+        parts = auth_header_value.split()
+        if parts[0].lower() != current_app.config['JWT_AUTH_HEADER_PREFIX'].lower():
+            raise JWTError('Invalid JWT header', 'Unsupported authorization type')
+        elif len(parts) == 1:
+            raise JWTError('Invalid JWT header', 'Token missing')
+        elif len(parts) > 2:
+            raise JWTError('Invalid JWT header', 'Token contains spaces')
+        try:
+            user = verified_tokens.identity(parts[1])
+        except InvalidTokenError as e:
+            raise JWTError('Invalid token', str(e))
+        try:
+            closed = bank().is_account_closed(UUID(user.id))
+        except (AccountNotFoundError, ValueError):
+            raise JWTError('Invalid JWT', 'User does not exist')
+        if closed:
+            raise JWTError('Invalid JWT', 'Account is closed')
+        return user
+
+
+def jwt_required() -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """View decorator setting current_identity from the request's token, or answering 401."""
+    def wrapper(view: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(view)
+        def decorator(*args: Any, **kwargs: Any) -> Any:
+            g.identity = authenticate_header(request.headers.get('Authorization'))
+            return view(*args, **kwargs)
+        return decorator
+    return wrapper
+
+
+@app.before_request
+def begin_request() -> None:
+    g.request_started = time.perf_counter()
+    metrics.begin_request()
+
+
+@app.after_request
+def end_request(response: Response) -> Response:
+    seconds = time.perf_counter() - g.request_started
+    sample = metrics.end_request()
+    # Streamed responses are timed to when they start.
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    bank().metrics.record_request(route, request.method, response.status_code, seconds, sample)
+    if app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = sample.server_timing(seconds)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics() -> Response:
+    return Response(bank().metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.route('/api/v1/signup', methods=['POST'])
@@ -65,15 +159,14 @@ def login():
     password = request.json.get('password', None)
 
     try:
-        account_id = bank().get_account_id_by_email(email_address)
-        account = bank().get_account(account_id)
-
-        if not account or not account.check_password(password):
+        try:
+            account_id = bank().authenticate(email_address, password)
+        except BadCredentials:
             return jsonify({"msg": "Bad username or password"}), 401
 
         # Generate the JWT token
         user = User()
-        user.id = str(account.id)
+        user.id = str(account_id)
         token = _default_jwt_encode_handler(user)
 
         # Decode token if it's in bytes format
@@ -88,8 +181,73 @@ def login():
         return jsonify({"error": "An error occurred: {}".format(str(e))}), 400
 
 
+def _idempotency_scope(identity: str, path: str, key: str) -> str:
+    # The same key used by another user, or on another endpoint, is another request.
+    return f"{identity}\0{path}\0{key}"
+
+
+def _replay(scope: str, fingerprint: bytes) -> Optional[Tuple[str, int, Dict[str, str]]]:
+    """
+    Reserves the key and returns None for a new request, or the body,
+    status and headers to answer a request that has been seen before.
+    """
+    stored = idempotency_keys.begin(scope, fingerprint)
+    if stored is None:
+        return None
+    if stored.fingerprint != fingerprint:
+        return json.dumps({"error": "Idempotency-Key was already used with a different request"}), 409, {}
+    if not stored.status:
+        return json.dumps({"error": "A request with this Idempotency-Key is still in progress"}), 409, {}
+    return stored.body, stored.status, {"Idempotent-Replayed": "true"}
+
+
+# Rejections a request gets again however often it is retried, so its
+# Idempotency-Key keeps them as it keeps a success. Other failures, such
+# as a conflict that outlasted the command's retries, release the key.
+REJECTIONS = (
+    ValueError, TypeError, AccountClosedError, AccountNotFoundError, InsufficientFundsError, TransactionError,
+)
+
+
+def _failed(e: Exception) -> Tuple[Response, int]:
+    """The 400 for an error a view doesn't handle itself."""
+    if not isinstance(e, REJECTIONS):
+        g.retryable = True
+    return jsonify({"msg": str(e)}), 400
+
+
+def idempotent(view: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Answers a retried request with the response to the first, without
+    running it again, if the first succeeded or was rejected.
+    """
+    @wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        scope = _idempotency_scope(str(current_identity.id), request.path, key)
+        fingerprint = digest(request.get_data())
+        replay = _replay(scope, fingerprint)
+        if replay is not None:
+            body, status, headers = replay
+            return Response(body, status, headers, mimetype='application/json')
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_keys.cancel(scope)
+            raise
+        if g.get("retryable") or response.status_code >= 500:
+            idempotency_keys.cancel(scope)
+        else:
+            idempotency_keys.finish(scope, fingerprint, response.status_code, response.get_data(as_text=True))
+        return response
+    return wrapper
+
+
 @app.route('/api/v1/deposit', methods=['POST'])
 @jwt_required()
+@idempotent
 def deposit():
     account_id = UUID(request.json.get('account_id', ''))
     amount = request.json.get('amount', None)
@@ -100,11 +258,12 @@ def deposit():
     except ValueError as ve:  # Handle the invalid deposit amount error
         return jsonify({"error": str(ve)}), 400
     except Exception as e:
-        return jsonify({"msg": str(e)}), 400
+        return _failed(e)
 
 
 @app.route('/api/v1/withdraw', methods=['POST'])
 @jwt_required()
+@idempotent
 def withdraw():
     account_id = UUID(request.json.get('account_id', ''))
     amount = request.json.get('amount', None)
@@ -113,25 +272,32 @@ def withdraw():
         bank().withdraw(account_id, amount)
         return jsonify({"msg": "Amount withdrawn successfully"}), 200
     except Exception as e:
-        return jsonify({"msg": str(e)}), 400
+        return _failed(e)
 
 
 @app.route('/api/v1/transfer', methods=['POST'])
 @jwt_required()
+@idempotent
 def transfer():
     source_account_id = UUID(request.json.get('source_account_id', ''))
     target_account_id = UUID(request.json.get('target_account_id', ''))
     amount = request.json.get('amount', None)
+    # Retrying with the same Idempotency-Key makes the transfer at most once,
+    # even once the key's response is no longer in idempotency_keys.
+    idempotency_key = request.headers.get('Idempotency-Key')
+    transfer_id = bank().get_transfer_id_by_key(source_account_id, idempotency_key) if idempotency_key else None
 
     try:
-        bank().transfer(source_account_id, target_account_id, amount)
-        return jsonify({"msg": "Amount transferred successfully"}), 200
+        transfer_id = bank().transfer(source_account_id, target_account_id, amount, transfer_id)
+        return jsonify({"msg": "Amount transferred successfully", "transfer_id": str(transfer_id)}), 200
     except AccountNotFoundError:
         return jsonify({"error": "Account not found: {}".format(str(target_account_id))}), 404
     except InsufficientFundsError:  # Handle the insufficient funds error
         return jsonify({"error": "Insufficient funds"}), 400
+    except TransactionError as te:
+        return jsonify({"error": str(te)}), 409
     except Exception as e:
-        return jsonify({"msg": str(e)}), 400
+        return _failed(e)
 
 
 @app.route('/api/v1/account', methods=['GET'])
@@ -139,10 +305,150 @@ def transfer():
 def get_account_details():
     user_id = str(current_identity.id)  # This retrieves the user's identity from the JWT token
     try:
-        account = bank().get_account(UUID(user_id))
+        balance = bank().get_balance(UUID(user_id))
         return jsonify({
-            "balance": str(account.balance),
+            "balance": str(balance),
             "identity": user_id
         }), 200
     except Exception as e:
         return jsonify({"msg": str(e)}), 400
+
+
+def _parse_timestamp(value: str) -> datetime:
+    timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def _transactions_page(account_id: UUID, args: Mapping[str, str]) -> Tuple[Dict[str, Any], int]:
+    """Body and status for a page of the account's transactions, given the query args."""
+    max_limit = app.config["TRANSACTIONS_MAX_PAGE_SIZE"]
+    try:
+        limit = int(args.get("limit", app.config["TRANSACTIONS_PAGE_SIZE"]))
+        before: Optional[int] = int(args["cursor"]) if args.get("cursor") else None
+        since = _parse_timestamp(args["since"]) if args.get("since") else None
+        until = _parse_timestamp(args["until"]) if args.get("until") else None
+    except ValueError:
+        return {"error": "limit and cursor must be integers, since and until ISO 8601 timestamps"}, 400
+    if not 1 <= limit <= max_limit:
+        return {"error": f"limit must be between 1 and {max_limit}"}, 400
+    if before is not None and before < 0:
+        return {"error": "Invalid cursor"}, 400
+
+    movements, cursor = bank().get_transactions(account_id, limit, before, since, until)
+    return {
+        "transactions": [
+            {
+                "timestamp": movement.timestamp.isoformat(),
+                "type": movement.type,
+                "amount": movement.amount,
+                "balance": movement.balance,
+                "counterparty_id": str(movement.counterparty_id) if movement.counterparty_id else None,
+                "transfer_id": str(movement.transfer_id) if movement.transfer_id else None,
+            }
+            for movement in movements
+        ],
+        "next_cursor": str(cursor) if cursor is not None else None,
+    }, 200
+
+
+def _balance_at(account_id: UUID, args: Mapping[str, str]) -> Tuple[Dict[str, Any], int]:
+    """Body and status for the account's balance as of the ``at`` time or the ``version`` in the query args."""
+    try:
+        if bool(args.get("at")) == bool(args.get("version")):
+            raise ValueError
+        at: Union[int, datetime] = _parse_timestamp(args["at"]) if args.get("at") else int(args["version"])
+    except ValueError:
+        return {"error": "Give either at, an ISO 8601 timestamp, or version, an integer"}, 400
+    try:
+        balance = bank().get_balance_at(account_id, at)
+    except AccountNotFoundError as e:
+        return {"error": str(e)}, 404
+    body: Dict[str, Any] = {"balance": str(balance), "identity": str(account_id)}
+    if isinstance(at, datetime):
+        body["at"] = at.isoformat()
+    else:
+        body["version"] = at
+    return body, 200
+
+
+@app.route('/api/v1/account/balance', methods=['GET'])
+@jwt_required()
+def get_account_balance_at() -> Tuple[Response, int]:
+    user_id = str(current_identity.id)
+    try:
+        body, status = _balance_at(UUID(user_id), request.args)
+        return jsonify(body), status
+    except Exception as e:
+        return jsonify({"msg": str(e)}), 400
+
+
+@app.route('/api/v1/account/transactions', methods=['GET'])
+@jwt_required()
+def get_account_transactions() -> Tuple[Response, int]:
+    user_id = str(current_identity.id)
+    try:
+        body, status = _transactions_page(UUID(user_id), request.args)
+        return jsonify(body), status
+    except Exception as e:
+        return jsonify({"msg": str(e)}), 400
+
+
+@app.route('/api/v1/batch', methods=['POST'])
+@jwt_required()
+def batch() -> Tuple[Response, int]:
+    postings = request.json.get('postings', None)
+
+    if not isinstance(postings, list) or not all(isinstance(posting, dict) for posting in postings):
+        return jsonify({"error": "postings must be a list of objects"}), 400
+
+    try:
+        results = bank().apply_batch(postings)
+        return jsonify({"msg": "Batch applied", "results": results}), 200
+    except Exception as e:
+        return jsonify({"msg": str(e)}), 400
+
+
+def _parse_ndjson(lines: Iterable[bytes]) -> Iterator[Tuple[int, Any]]:
+    """Yield (line number, posting or parse error) for each non-blank line."""
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            posting = json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+            continue
+        if not isinstance(posting, dict):
+            yield line_number, ValueError("posting must be an object")
+            continue
+        yield line_number, posting
+
+
+def _apply_ndjson_chunks(parsed: Iterator[Tuple[int, Any]], chunk_size: int) -> Iterator[str]:
+    """Apply postings a chunk at a time, yielding one result line per input line."""
+    while True:
+        chunk = list(islice(parsed, chunk_size))
+        if not chunk:
+            return
+        postings: List[Dict[str, Any]] = [posting for _, posting in chunk if isinstance(posting, dict)]
+        try:
+            batch_results = bank().apply_batch(postings) if postings else []
+        except Exception as e:
+            batch_results = [{"status": "error", "error": str(e)}] * len(postings)
+        results = iter(batch_results)
+        for line_number, posting in chunk:
+            if isinstance(posting, dict):
+                result = next(results)
+            else:
+                result = {"status": "error", "error": str(posting)}
+            yield json.dumps(dict(result, line=line_number)) + "\n"
+
+
+@app.route('/api/v1/batch/stream', methods=['POST'])
+@jwt_required()
+def batch_stream() -> Response:
+    # Postings are read, applied and answered one chunk at a time, so
+    # the next chunk is only read once the client has taken the results.
+    chunk_size = app.config["BATCH_STREAM_CHUNK_SIZE"]
+    results = _apply_ndjson_chunks(_parse_ndjson(request.stream), chunk_size)
+    return Response(stream_with_context(results), mimetype='application/x-ndjson')
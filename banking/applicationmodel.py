@@ -1,22 +1,155 @@
 # coding=utf-8
 
-from uuid import UUID, uuid5, NAMESPACE_URL
+import logging
+from copy import deepcopy
+from datetime import datetime
+from threading import Thread
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from uuid import UUID, uuid4, uuid5, NAMESPACE_URL
 
-from eventsourcing.application import AggregateNotFound, Application
+from eventsourcing.application import (
+    AggregateNotFound, Application, LRUCache, ProcessingEvent, ProjectorFunction, Repository, project_aggregate,
+)
+from eventsourcing.persistence import (
+    ApplicationRecorder, EventStore, IntegrityError, Mapper, Recording, Transcoder,
+)
+from eventsourcing.sqlite import Factory as SQLiteFactory
+from eventsourcing.utils import EnvType, resolve_topic
 
-from banking.domainmodel import Account, BadCredentials, AccountClosedError, AccountNotFoundError
+from banking.analytics import DailyAggregates, LedgerAnalytics
+from banking.balances import Balances
+from banking.cache import AccountCache
+from banking.credentials import CredentialsIndex
+from banking.eventstore import PagedEventStore
+from banking.groupcommit import GroupCommitRecorder
+from banking.history import Movement, TransactionHistory
+from banking.metrics import Metrics, instrumented
+from banking.passwords import PasswordHasher
+from banking.retries import RecordingConflict, RetryPolicy, retry_on_conflict
+from banking.transcoding import CompactMapper, CompactTranscoder
+from banking.writers import AccountWriter
+from banking.domainmodel import (
+    Account,
+    AccountClosedError,
+    AccountNotFoundError,
+    BadCredentials,
+    TransactionError,
+    Transfer,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class Bank(Application):
+    SNAPSHOTTING_INTERVAL = "SNAPSHOTTING_INTERVAL"
+    SINGLE_WRITER_SHARDS = "SINGLE_WRITER_SHARDS"
+    EVENTS_PAGE_SIZE = "EVENTS_PAGE_SIZE"
+
+    env = {"AGGREGATE_CACHE_MAXSIZE": "10000"}
+    snapshotting_intervals = {Account: 100}
+    compaction_page_size = 1000
+    log_section_size = 1000
+
+    def __init__(self, env: Optional[EnvType] = None) -> None:
+        super().__init__(env)
+        # Snapshot every N account events, or never if N is zero.
+        interval = int(self.env.get(self.SNAPSHOTTING_INTERVAL, "100"))
+        self.snapshotting_intervals = {Account: interval} if interval > 0 else {}
+        self.compaction_position = 0
+        self.metrics = Metrics()
+        self.retry_policy = RetryPolicy.from_env(self.env)
+        self.credentials = CredentialsIndex.from_env(self, self.env)
+        self.history = TransactionHistory.from_env(self, self.env)
+        self.analytics = LedgerAnalytics(self)
+        self.passwords = PasswordHasher.from_env(self.env)
+        self.balances = Balances(env=self.env)
+        self.balances.follow(self.name, self.notification_log)
+        # Apply deposits, withdrawals and transfers on one writer thread per shard of accounts.
+        shards = int(self.env.get(self.SINGLE_WRITER_SHARDS, "0"))
+        self.writer = AccountWriter(self._apply_postings, shards) if shards > 0 else None
+
+    def construct_transcoder(self) -> Transcoder:
+        # JSON unless EVENT_TRANSCODER=compact, and either is read.
+        transcoder = CompactTranscoder.from_env(self.env)
+        self.register_transcodings(transcoder)
+        return transcoder
+
+    def construct_mapper(self) -> Mapper:
+        transcoder = self.construct_transcoder()
+        mapper_class = CompactMapper if transcoder.compact else Mapper
+        return self.factory.mapper(transcoder=transcoder, mapper_class=mapper_class)
+
+    def construct_recorder(self) -> ApplicationRecorder:
+        # Saves from concurrent requests are committed together in SQLite if a window is set.
+        if isinstance(self.factory, SQLiteFactory) and self.env.get(GroupCommitRecorder.SQLITE_GROUP_COMMIT_WINDOW):
+            recorder = GroupCommitRecorder.from_env(self.factory.datastore, self.env)
+            if self.factory.env_create_table():
+                recorder.create_table()
+            return recorder
+        return super().construct_recorder()
+
+    def construct_event_store(self) -> EventStore:
+        # Accounts are folded from their events a page at a time, or all at once if zero.
+        page_size = int(self.env.get(self.EVENTS_PAGE_SIZE, "1000"))
+        return PagedEventStore(mapper=self.mapper, recorder=self.recorder, page_size=page_size)
+
+    def construct_repository(self) -> Repository:
+        repository = super().construct_repository()
+        if isinstance(repository.cache, LRUCache):
+            repository.cache = AccountCache(repository.cache.maxsize)
+        return repository
+
+    def save(self, *objs: Any, **kwargs: Any) -> List[Recording]:
+        recordings = super().save(*objs, **kwargs)
+        # Cache what was just written, so the next get() only has to check
+        # the store for events written since then by other processes.
+        if self.repository.cache is not None and self.repository.fastforward:
+            for obj in objs:
+                if isinstance(obj, Account):
+                    self.repository.cache.put(obj.id, deepcopy(obj))
+        return recordings
+
+    def _record(self, processing_event: ProcessingEvent) -> List[Recording]:
+        try:
+            return super()._record(processing_event)
+        except IntegrityError as e:
+            # Nothing was recorded, so the command can run again.
+            raise RecordingConflict(*e.args) from e
+
+    def take_snapshot(
+            self,
+            aggregate_id: UUID,
+            version: Optional[int] = None,
+            projector_func: ProjectorFunction[Any, Any] = project_aggregate,
+    ) -> None:
+        try:
+            super().take_snapshot(aggregate_id, version, projector_func)
+        except IntegrityError:
+            # Another worker, or the compaction pass, took it first.
+            return
+
+    def aggregate_cache_stats(self) -> Dict[str, int]:
+        cache = self.repository.cache
+        if isinstance(cache, AccountCache):
+            return cache.stats()
+        return {}
+
+    def command_retry_stats(self) -> Dict[str, float]:
+        return self.retry_policy.stats()
 
     def get_account_id_by_email(self, email_address: str) -> UUID:
         """Generate a deterministic UUID based on the email."""
         return uuid5(NAMESPACE_URL, email_address)
 
+    def get_transfer_id_by_key(self, debit_account_id: UUID, idempotency_key: str) -> UUID:
+        """Generate a deterministic transfer id from a client's idempotency key."""
+        return uuid5(NAMESPACE_URL, f"transfer/{debit_account_id}/{idempotency_key}")
+
+    @instrumented
     def open_account(self, full_name: str, email_address: str, password: str) -> UUID:
         account_id = self.get_account_id_by_email(email_address)
         # Hash the password before using it with the aggregate
-        hashed_password = Account.hash_password(password)
+        hashed_password = self.passwords.hash(password)
         try:
             existing_account = self.repository.get(account_id)
             if existing_account:
@@ -25,56 +158,258 @@ class Bank(Application):
             pass
 
         account = Account(account_id, full_name=full_name, email_address=email_address, password=hashed_password)
-        print(account.password)
         self.save(account)
         return account.id
 
+    @instrumented
+    @retry_on_conflict
     def deposit(self, credit_account_id: UUID, amount_in_cents: int) -> None:
         if amount_in_cents <= 0:
             raise ValueError("Invalid deposit amount")
+        if self.writer is not None:
+            posting = {"type": "deposit", "account_id": credit_account_id, "amount": amount_in_cents}
+            return self.writer.submit(credit_account_id, posting).result()
         account = self.get_account(credit_account_id)
         if account.closed:
             raise AccountClosedError
         account.credit(amount_in_cents)
         self.save(account)
 
+    @instrumented
+    @retry_on_conflict
     def withdraw(self, debit_account_id: UUID, amount_in_cents: int) -> None:
         if amount_in_cents <= 0:
             raise ValueError("Invalid withdraw amount")
+        if self.writer is not None:
+            posting = {"type": "withdraw", "account_id": debit_account_id, "amount": amount_in_cents}
+            return self.writer.submit(debit_account_id, posting).result()
         account = self.get_account(debit_account_id)
         if account.closed:
             raise AccountClosedError
         account.debit(amount_in_cents)
         self.save(account)
 
-    def transfer(self, debit_account_id: UUID, credit_account_id: UUID, amount_in_cents: int) -> None:
+    @instrumented
+    @retry_on_conflict
+    def transfer(
+            self,
+            debit_account_id: UUID,
+            credit_account_id: UUID,
+            amount_in_cents: int,
+            transfer_id: Optional[UUID] = None,
+    ) -> UUID:
+        """
+        Move money between accounts, returning the transfer id. Making
+        a transfer again with the same id does nothing.
+        """
+        if self.writer is not None:
+            posting: Dict[str, Any] = {
+                "type": "transfer",
+                "source_account_id": debit_account_id,
+                "target_account_id": credit_account_id,
+                "amount": amount_in_cents,
+                "transfer_id": transfer_id or uuid4(),
+            }
+            self.writer.submit(debit_account_id, posting).result()
+            return posting["transfer_id"]
+        if transfer_id is None:
+            transfer_id = uuid4()
+        elif self._is_made(transfer_id, debit_account_id, credit_account_id, amount_in_cents, {}):
+            return transfer_id
         source_account = self.get_account(debit_account_id)
         target_account = self.get_account(credit_account_id)
         if source_account.closed or target_account.closed:
             raise AccountClosedError
-        source_account.debit(amount_in_cents)
-        target_account.credit(amount_in_cents)
-        self.save(source_account, target_account)
+        source_account.debit(amount_in_cents, counterparty_id=target_account.id, transfer_id=transfer_id)
+        target_account.credit(amount_in_cents, counterparty_id=source_account.id, transfer_id=transfer_id)
+        transfer = Transfer(transfer_id, source_account.id, target_account.id, amount_in_cents)
+        self.save(source_account, target_account, transfer)
+        return transfer_id
+
+    def _is_made(
+            self,
+            transfer_id: UUID,
+            debit_account_id: Any,
+            credit_account_id: Any,
+            amount_in_cents: Any,
+            pending: Dict[UUID, Transfer],
+    ) -> bool:
+        """Whether the transfer has been made already, with the same details."""
+        try:
+            transfer = pending.get(transfer_id) or self.repository.get(transfer_id)
+        except AggregateNotFound:
+            return False
+        if not isinstance(transfer, Transfer) or (
+            transfer.debit_account_id, transfer.credit_account_id, transfer.amount_in_cents
+        ) != (UUID(str(debit_account_id)), UUID(str(credit_account_id)), amount_in_cents):
+            raise TransactionError(f"Transfer {transfer_id} was already made with different details")
+        return True
+
+    @instrumented
+    @retry_on_conflict
+    def apply_batch(self, postings: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Apply deposit, withdraw and transfer postings in order, loading
+        each account once and saving all of them together. A posting that
+        fails leaves the others alone. Returns one result per posting.
+        """
+        results = []
+        for error in self._apply_postings(postings):
+            if error is None:
+                results.append({"status": "ok"})
+            else:
+                results.append({"status": "error", "error": str(error) or type(error).__name__})
+        return results
 
+    def _apply_postings(self, postings: Sequence[Dict[str, Any]]) -> List[Optional[Exception]]:
+        accounts: Dict[UUID, Account] = {}
+
+        def load(account_id: Any) -> Account:
+            account_id = UUID(str(account_id))
+            if account_id not in accounts:
+                accounts[account_id] = self.get_account(account_id)
+            return accounts[account_id]
+
+        transfers: Dict[UUID, Transfer] = {}
+        errors: List[Optional[Exception]] = []
+        for posting in postings:
+            try:
+                self._apply_posting(posting, load, transfers)
+            except Exception as e:
+                errors.append(e)
+            else:
+                errors.append(None)
+        self.save(*accounts.values(), *transfers.values())
+        return errors
+
+    def _apply_posting(
+            self,
+            posting: Dict[str, Any],
+            load: Callable[[Any], Account],
+            transfers: Dict[UUID, Transfer],
+    ) -> None:
+        posting_type = posting.get("type")
+        amount_in_cents: Any = posting.get("amount")
+        if posting_type == "deposit":
+            if amount_in_cents <= 0:
+                raise ValueError("Invalid deposit amount")
+            account = load(posting.get("account_id"))
+            if account.closed:
+                raise AccountClosedError
+            account.credit(amount_in_cents)
+        elif posting_type == "withdraw":
+            if amount_in_cents <= 0:
+                raise ValueError("Invalid withdraw amount")
+            account = load(posting.get("account_id"))
+            if account.closed:
+                raise AccountClosedError
+            account.debit(amount_in_cents)
+        elif posting_type == "transfer":
+            if posting.get("transfer_id"):
+                transfer_id = UUID(str(posting["transfer_id"]))
+                debit_account_id, credit_account_id = posting.get("source_account_id"), posting.get("target_account_id")
+                if self._is_made(transfer_id, debit_account_id, credit_account_id, amount_in_cents, transfers):
+                    return
+            else:
+                transfer_id = uuid4()
+            source_account = load(posting.get("source_account_id"))
+            target_account = load(posting.get("target_account_id"))
+            if source_account.closed or target_account.closed:
+                raise AccountClosedError
+            source_account.debit(amount_in_cents, counterparty_id=target_account.id, transfer_id=transfer_id)
+            target_account.credit(amount_in_cents, counterparty_id=source_account.id, transfer_id=transfer_id)
+            transfers[transfer_id] = Transfer(transfer_id, source_account.id, target_account.id, amount_in_cents)
+        else:
+            raise ValueError(f"Unknown posting type: {posting_type}")
+
+    @instrumented
+    @retry_on_conflict
     def close_account(self, account_id: UUID) -> None:
         account = self.get_account(account_id)
         account.close()
         self.save(account)
 
+    @instrumented
     def get_balance(self, account_id: UUID) -> int:
-        account = self.get_account(account_id)
+        return self.balances.get(account_id).balance
+
+    @instrumented
+    def get_balance_at(self, account_id: UUID, at: Union[int, datetime]) -> int:
+        """
+        The account's balance as of a version, or as of a (timezone-aware)
+        time. A time is looked up in the history's timestamp index to find
+        the version after the last movement by then, and the account is
+        loaded at that version from its nearest snapshot before it, so the
+        query doesn't replay the account's events from when it was opened.
+        """
+        if isinstance(at, datetime):
+            account = self.get_account(account_id, version=self.history.version_at(account_id, at) or 1)
+            if account.created_on > at:
+                raise AccountNotFoundError(f"Account {account_id} was not open at {at.isoformat()}")
+        else:
+            account = self.get_account(account_id, version=at)
         return account.balance
 
+    @instrumented
+    def get_transactions(
+            self,
+            account_id: UUID,
+            limit: int = 50,
+            before: Optional[int] = None,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+    ) -> Tuple[List[Movement], Optional[int]]:
+        """A page of an account's movements, newest first, and the cursor for the next page."""
+        return self.history.page(account_id, limit, before, since, until)
+
+    @instrumented
+    def get_daily_aggregates(self) -> DailyAggregates:
+        """Bank-wide credits, debits and overdrafts for each day, from the first event to the last."""
+        return self.analytics.daily()
+
+    @instrumented
+    def authenticate(self, email_address: str, password: str) -> UUID:
+        """Check a login against the credentials read model, without loading the account."""
+        credentials = self.credentials.get(self.get_account_id_by_email(email_address))
+        if credentials.closed or not self.passwords.verify(password, credentials.password):
+            raise BadCredentials
+        if self.passwords.needs_rehash(credentials.password):
+            try:
+                self._rehash_password(credentials.account_id, credentials.password, password)
+            except RecordingConflict:
+                # Only an upgrade, so the login still succeeds, and the next one tries again.
+                logger.warning("Couldn't rehash the password of account %s", credentials.account_id)
+        return credentials.account_id
+
+    @retry_on_conflict
+    def _rehash_password(self, account_id: UUID, password_hash: str, password: str) -> None:
+        """Upgrade a legacy or outdated hash while we have the password."""
+        account = self.get_account(account_id)
+        # Unless another login upgraded it first, or the password was changed.
+        if account.password == password_hash:
+            account.set_password_hash(self.passwords.hash(password))
+            self.save(account)
+
+    def is_account_closed(self, account_id: UUID) -> bool:
+        """From the credentials read model, without loading the account."""
+        return self.credentials.get(account_id).closed
+
     def validate_password(self, account_id: UUID, password: str) -> None:
         account = self.get_account(account_id)
-        if not account.check_password(password):
+        if not self.passwords.verify(password, account.password):
             raise BadCredentials
 
+    @instrumented
+    @retry_on_conflict
     def change_password(self, account_id: UUID, old_password: str, new_password: str) -> None:
         account = self.get_account(account_id)
-        account.change_password(old_password, new_password)
+        if not self.passwords.verify(old_password, account.password):
+            raise BadCredentials
+        account.set_password_hash(self.passwords.hash(new_password))
         self.save(account)
 
+    @instrumented
+    @retry_on_conflict
     def set_overdraft_limit(self, account_id: UUID, amount_in_cents: int) -> None:
         if amount_in_cents < 0:
             raise AssertionError("Overdraft limit cannot be negative.")
@@ -84,12 +419,72 @@ class Bank(Application):
         account.set_overdraft_limit(amount_in_cents)
         self.save(account)
 
+    @instrumented
     def get_overdraft_limit(self, account_id: UUID) -> int:
-        account = self.get_account(account_id)
-        return account.overdraft_limit
+        return self.balances.get(account_id).overdraft_limit
 
-    def get_account(self, account_id: UUID) -> Account:
+    @instrumented
+    def get_account(self, account_id: UUID, version: Optional[int] = None) -> Account:
         try:
-            return self.repository.get(account_id)
+            return self.repository.get(account_id, version=version)
         except AggregateNotFound:
             raise AccountNotFoundError(f"No account found with ID: {account_id}")
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        if isinstance(self.recorder, GroupCommitRecorder):
+            self.recorder.close()
+        super().close()
+        self.balances.close()
+        self.credentials.close()
+        self.history.close()
+        self.passwords.close()
+
+    def compact_snapshots(self, min_events: int = 1) -> int:
+        """
+        Snapshot accounts that have at least ``min_events`` events
+        since their last snapshot, looking only at accounts touched
+        since the previous compaction pass. Returns snapshots taken.
+        """
+        assert self.snapshots is not None
+        latest_versions: Dict[UUID, int] = {}
+        position = self.compaction_position
+        while True:
+            notifications = self.recorder.select_notifications(
+                start=position + 1,
+                limit=self.compaction_page_size,
+            )
+            if not notifications:
+                break
+            for notification in notifications:
+                if issubclass(resolve_topic(notification.topic), Account.Event):
+                    latest_versions[notification.originator_id] = notification.originator_version
+            position = notifications[-1].id
+
+        taken = 0
+        for account_id, version in latest_versions.items():
+            snapshots = list(self.snapshots.get(account_id, desc=True, limit=1))
+            snapshot_version = snapshots[0].originator_version if snapshots else 0
+            if version - snapshot_version >= min_events:
+                self.take_snapshot(account_id, version=version)
+                taken += 1
+        # Only once they're all taken, so a pass that fails is done again.
+        self.compaction_position = position
+        return taken
+
+    def run_snapshot_compaction(self, period: float, min_events: int = 1) -> Thread:
+        """
+        Run compact_snapshots() every ``period`` seconds until the bank is
+        closed. A pass that fails is logged, and tried again next period.
+        """
+        def compact_until_closed() -> None:
+            while not self.closing.wait(period):
+                try:
+                    self.compact_snapshots(min_events)
+                except Exception:
+                    logger.exception("Snapshot compaction failed")
+
+        thread = Thread(target=compact_until_closed, name="snapshot-compaction", daemon=True)
+        thread.start()
+        return thread
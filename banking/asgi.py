@@ -0,0 +1,399 @@
+# coding=utf-8
+"""
+Asyncio (ASGI) variant of the banking API. It serves the same
+/api/v1/* routes and JSON contracts as banking.api, against the
+same Bank, and accepts the same JWT tokens. Each request only
+holds a thread while it is inside the Bank: Bank calls are run
+on a bounded executor, so any ASGI server can keep many thousands
+of connections open on one event loop, e.g.
+
+    uvicorn banking.asgi:app
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+from uuid import UUID
+
+from flask_jwt import JWTError, _default_jwt_encode_handler  # type: ignore
+
+from banking import api, metrics
+from banking.domainmodel import AccountNotFoundError, BadCredentials, InsufficientFundsError, TransactionError
+from banking.idempotency import digest
+
+Scope = Dict[str, Any]
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+Handler = Callable[["Request"], Awaitable["Response"]]
+
+ASGI_BANK_WORKERS = int(os.getenv("ASGI_BANK_WORKERS", "32"))
+
+executor = ThreadPoolExecutor(max_workers=ASGI_BANK_WORKERS, thread_name_prefix="asgi-bank")
+routes: Dict[Tuple[str, str], Handler] = {}
+
+
+class Request:
+    def __init__(self, scope: Scope, receive: Receive):
+        self.scope = scope
+        self.receive = receive
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        self.query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        self.identity: Optional[str] = None
+
+    async def body_chunks(self) -> AsyncIterator[bytes]:
+        more_body = True
+        while more_body:
+            message = await self.receive()
+            yield message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+    async def json(self) -> Dict[str, Any]:
+        body = b"".join([chunk async for chunk in self.body_chunks()])
+        try:
+            with metrics.phase("json"):
+                data = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, {"msg": "Failed to decode JSON object"})
+        if not isinstance(data, dict):
+            raise HTTPError(400, {"msg": "Failed to decode JSON object"})
+        return data
+
+
+class Response:
+    def __init__(self, body: Any, status: int = 200, headers: Optional[Dict[str, str]] = None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.retryable = False
+
+    async def __call__(self, send: Send) -> None:
+        body = json.dumps(self.body).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        headers += [(k.lower().encode(), v.encode()) for k, v in self.headers.items()]
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+class StreamingResponse(Response):
+    def __init__(self, chunks: AsyncIterator[str], media_type: str):
+        super().__init__(None)
+        self.chunks = chunks
+        self.media_type = media_type
+
+    async def __call__(self, send: Send) -> None:
+        headers = [(b"content-type", self.media_type.encode())]
+        headers += [(k.lower().encode(), v.encode()) for k, v in self.headers.items()]
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        # Python 3.9 numbers the end of an async for loop as the last line of
+        # its body, so coverage never sees the loop exit to the next line.
+        async for chunk in self.chunks:  # pragma: no branch
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+
+class TextResponse(Response):
+    def __init__(self, body: str, content_type: str):
+        super().__init__(body, headers={"content-type": content_type})
+
+    async def __call__(self, send: Send) -> None:
+        body = self.body.encode()
+        headers = [(b"content-length", str(len(body)).encode())]
+        headers += [(k.lower().encode(), v.encode()) for k, v in self.headers.items()]
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None):
+        self.response = Response(body, status, headers)
+
+
+async def run_in_bank(func: Callable[..., Any], *args: Any) -> Any:
+    # In this request's context, so what the Bank does is counted against it.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(context.run, func, *args))
+
+
+def route(path: str, method: str) -> Callable[[Handler], Handler]:
+    def register(handler: Handler) -> Handler:
+        routes[(method, path)] = handler
+        return handler
+    return register
+
+
+def jwt_required(handler: Handler) -> Handler:
+    """Same checks and error bodies as flask_jwt's jwt_required()."""
+    @wraps(handler)
+    async def wrapper(request: Request) -> Response:
+        try:
+            # Off the event loop, as it may have to read the store.
+            request.identity = await run_in_bank(decode_identity, request.headers.get("authorization"))
+        except JWTError as e:
+            raise HTTPError(
+                e.status_code,
+                {"status_code": e.status_code, "error": e.error, "description": e.description},
+                e.headers,
+            )
+        return await handler(request)
+    return wrapper
+
+
+def idempotent(handler: Handler) -> Handler:
+    """Same as banking.api.idempotent(), for handlers of a request with an identity."""
+    @wraps(handler)
+    async def wrapper(request: Request) -> Response:
+        key = request.headers.get("idempotency-key")
+        if not key:
+            return await handler(request)
+        body = b"".join([chunk async for chunk in request.body_chunks()])
+        scope = api._idempotency_scope(str(request.identity), request.scope["path"], key)
+        fingerprint = digest(body)
+        replay = await run_in_bank(api._replay, scope, fingerprint)
+        if replay is not None:
+            stored_body, status, headers = replay
+            return Response(json.loads(stored_body), status, headers)
+        # The handler reads the body again.
+        request.receive = partial(_receive_body, body)
+        try:
+            response = await handler(request)
+        except Exception:
+            await run_in_bank(api.idempotency_keys.cancel, scope)
+            raise
+        if response.retryable or response.status >= 500:
+            await run_in_bank(api.idempotency_keys.cancel, scope)
+        else:
+            await run_in_bank(
+                api.idempotency_keys.finish, scope, fingerprint, response.status, json.dumps(response.body),
+            )
+        return response
+    return wrapper
+
+
+def failed(e: Exception) -> Response:
+    """Same as banking.api._failed()."""
+    response = Response({"msg": str(e)}, 400)
+    response.retryable = not isinstance(e, api.REJECTIONS)
+    return response
+
+
+async def _receive_body(body: bytes) -> Message:
+    return {"type": "http.request", "body": body, "more_body": False}
+
+
+def decode_identity(auth_header_value: Optional[str]) -> str:
+    with api.app.app_context():
+        return str(api.authenticate_header(auth_header_value).id)
+
+
+def encode_token(account_id: UUID) -> str:
+    user = api.User()
+    user.id = str(account_id)
+    with api.app.app_context():
+        token = _default_jwt_encode_handler(user)
+    return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+@route('/metrics', 'GET')
+async def get_metrics(request: Request) -> Response:
+    return TextResponse(api.bank().metrics.render(), metrics.CONTENT_TYPE)
+
+
+@route('/api/v1/signup', 'POST')
+async def signup(request: Request) -> Response:
+    data = await request.json()
+    account_id = await run_in_bank(
+        api.bank().open_account, data.get('full_name'), data.get('email_address'), data.get('password')
+    )
+    if not account_id:
+        return Response({"msg": "Account creation failed"}, 400)
+    return Response({"msg": "Account created successfully", "account_id": str(account_id)})
+
+
+@route('/api/v1/login', 'POST')
+async def login(request: Request) -> Response:
+    data = await request.json()
+    try:
+        try:
+            account_id = await run_in_bank(api.bank().authenticate, data.get('email_address'), data.get('password'))
+        except BadCredentials:
+            return Response({"msg": "Bad username or password"}, 401)
+        return Response({"msg": "Logged in successfully", "access_token": encode_token(account_id)})
+    except AccountNotFoundError:
+        return Response({"error": "Invalid credentials"}, 401)
+    except Exception as e:
+        return Response({"error": "An error occurred: {}".format(str(e))}, 400)
+
+
+@route('/api/v1/deposit', 'POST')
+@jwt_required
+@idempotent
+async def deposit(request: Request) -> Response:
+    data = await request.json()
+    account_id = UUID(data.get('account_id', ''))
+    amount = data.get('amount', None)
+    try:
+        await run_in_bank(api.bank().deposit, account_id, amount)
+        return Response({"msg": "Amount deposited successfully", "data": amount})
+    except ValueError as ve:
+        return Response({"error": str(ve)}, 400)
+    except Exception as e:
+        return failed(e)
+
+
+@route('/api/v1/withdraw', 'POST')
+@jwt_required
+@idempotent
+async def withdraw(request: Request) -> Response:
+    data = await request.json()
+    account_id = UUID(data.get('account_id', ''))
+    amount = data.get('amount', None)
+    try:
+        await run_in_bank(api.bank().withdraw, account_id, amount)
+        return Response({"msg": "Amount withdrawn successfully"})
+    except Exception as e:
+        return failed(e)
+
+
+@route('/api/v1/transfer', 'POST')
+@jwt_required
+@idempotent
+async def transfer(request: Request) -> Response:
+    data = await request.json()
+    source_account_id = UUID(data.get('source_account_id', ''))
+    target_account_id = UUID(data.get('target_account_id', ''))
+    amount = data.get('amount', None)
+    idempotency_key = request.headers.get('idempotency-key')
+    transfer_id = api.bank().get_transfer_id_by_key(source_account_id, idempotency_key) if idempotency_key else None
+    try:
+        transfer_id = await run_in_bank(api.bank().transfer, source_account_id, target_account_id, amount, transfer_id)
+        return Response({"msg": "Amount transferred successfully", "transfer_id": str(transfer_id)})
+    except AccountNotFoundError:
+        return Response({"error": "Account not found: {}".format(str(target_account_id))}, 404)
+    except InsufficientFundsError:
+        return Response({"error": "Insufficient funds"}, 400)
+    except TransactionError as te:
+        return Response({"error": str(te)}, 409)
+    except Exception as e:
+        return failed(e)
+
+
+@route('/api/v1/account', 'GET')
+@jwt_required
+async def get_account_details(request: Request) -> Response:
+    user_id = str(request.identity)
+    try:
+        balance = await run_in_bank(api.bank().get_balance, UUID(user_id))
+        return Response({"balance": str(balance), "identity": user_id})
+    except Exception as e:
+        return Response({"msg": str(e)}, 400)
+
+
+@route('/api/v1/account/balance', 'GET')
+@jwt_required
+async def get_account_balance_at(request: Request) -> Response:
+    user_id = str(request.identity)
+    try:
+        body, status = await run_in_bank(api._balance_at, UUID(user_id), request.query)
+        return Response(body, status)
+    except Exception as e:
+        return Response({"msg": str(e)}, 400)
+
+
+@route('/api/v1/account/transactions', 'GET')
+@jwt_required
+async def get_account_transactions(request: Request) -> Response:
+    user_id = str(request.identity)
+    try:
+        body, status = await run_in_bank(api._transactions_page, UUID(user_id), request.query)
+        return Response(body, status)
+    except Exception as e:
+        return Response({"msg": str(e)}, 400)
+
+
+@route('/api/v1/batch', 'POST')
+@jwt_required
+async def batch(request: Request) -> Response:
+    postings = (await request.json()).get('postings', None)
+    if not isinstance(postings, list) or not all(isinstance(posting, dict) for posting in postings):
+        return Response({"error": "postings must be a list of objects"}, 400)
+    try:
+        results = await run_in_bank(api.bank().apply_batch, postings)
+        return Response({"msg": "Batch applied", "results": results})
+    except Exception as e:
+        return Response({"msg": str(e)}, 400)
+
+
+@route('/api/v1/batch/stream', 'POST')
+@jwt_required
+async def batch_stream(request: Request) -> Response:
+    chunk_size = api.app.config["BATCH_STREAM_CHUNK_SIZE"]
+
+    async def lines() -> AsyncIterator[bytes]:
+        buffer = b""
+        async for chunk in request.body_chunks():  # pragma: no branch
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                yield line
+        yield buffer
+
+    async def results() -> AsyncIterator[str]:
+        # Read one chunk of lines, apply it off the loop, send its results, repeat.
+        pending: List[bytes] = []
+        async for line in lines():  # pragma: no branch
+            pending.append(line)
+            if len(pending) == chunk_size:
+                yield await run_in_bank(apply_lines, pending)
+                pending = []
+        if pending:
+            yield await run_in_bank(apply_lines, pending)
+
+    lines_applied = [0]
+
+    def apply_lines(chunk: List[bytes]) -> str:
+        offset = lines_applied[0]
+        lines_applied[0] += len(chunk)
+        parsed = ((offset + n, posting) for n, posting in api._parse_ndjson(chunk))
+        return "".join(api._apply_ndjson_chunks(parsed, chunk_size))
+
+    return StreamingResponse(results(), 'application/x-ndjson')
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            else:
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    started = time.perf_counter()
+    metrics.begin_request()
+    handler = routes.get((scope["method"], scope["path"]))
+    if handler is None:
+        if any(path == scope["path"] for _, path in routes):
+            response = Response({"msg": "Method Not Allowed"}, 405)
+        else:
+            response = Response({"msg": "Not Found"}, 404)
+    else:
+        try:
+            response = await handler(Request(scope, receive))
+        except HTTPError as e:
+            response = e.response
+        except Exception:
+            response = Response({"msg": "Internal Server Error"}, 500)
+    seconds = time.perf_counter() - started
+    sample = metrics.end_request()
+    # Streamed responses are timed to when they start.
+    route_path = scope["path"] if handler is not None else "unmatched"
+    api.bank().metrics.record_request(route_path, scope["method"], response.status, seconds, sample)
+    if api.app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = sample.server_timing(seconds)
+    await response(send)
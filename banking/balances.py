@@ -0,0 +1,169 @@
+# coding=utf-8
+
+from copy import deepcopy
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from eventsourcing.application import AggregateNotFound, ProcessingEvent
+from eventsourcing.domain import Aggregate, DomainEventProtocol, event
+from eventsourcing.persistence import IntegrityError, Recording, Transcoder
+from eventsourcing.sqlite import Factory as SQLiteFactory
+from eventsourcing.system import ProcessApplication, ProcessingJob
+from eventsourcing.utils import Environment, EnvType, get_topic
+
+from banking import partitions
+from banking.domainmodel import Account, AccountNotFoundError
+from banking.transcoding import CompactTranscoder, stored_topics
+
+
+class AccountBalance(Aggregate):
+    """
+    Just the parts of an account that the read endpoints need.
+    Its events are small and it has no credentials, so it is
+    much cheaper to rebuild and to copy than an Account. It
+    remembers the version of the account it reflects, so that
+    an account event is never applied twice.
+    """
+
+    _id: UUID
+
+    @event("Opened")
+    def __init__(self, id: UUID):
+        self._id = id
+        self.balance = 0  # In cents
+        self.overdraft_limit = 0
+        self.closed = False
+        self.account_version = 1
+
+    @event("Credited")
+    def credit(self, amount_in_cents: int, account_version: int) -> None:
+        self.balance += amount_in_cents
+        self.account_version = account_version
+
+    @event("Debited")
+    def debit(self, amount_in_cents: int, account_version: int) -> None:
+        self.balance -= amount_in_cents
+        self.account_version = account_version
+
+    @event("OverdraftSet")
+    def set_overdraft_limit(self, amount_in_cents: int, account_version: int) -> None:
+        self.overdraft_limit = amount_in_cents
+        self.account_version = account_version
+
+    @event("Closed")
+    def close(self, account_version: int) -> None:
+        self.closed = True
+        self.account_version = account_version
+
+
+class Balances(ProcessApplication):
+    """
+    Balance read model, projected from the Opened, Credited, Debited,
+    OverdraftSet and Closed events of the application it follows. Each
+    event is recorded together with its tracking position, so after a
+    restart it carries on from where it stopped, and it catches up
+    before each lookup so that reads see all writes committed so far,
+    including those of other processes sharing the store.
+    """
+
+    env = {"AGGREGATE_CACHE_MAXSIZE": "10000"}
+    snapshotting_intervals = {AccountBalance: 100}
+    pull_section_size = 1000
+    follow_topics = stored_topics(
+        get_topic(Account.Opened),  # type: ignore
+        get_topic(Account.Credited),  # type: ignore
+        get_topic(Account.Debited),  # type: ignore
+        get_topic(Account.OverdraftSet),  # type: ignore
+        get_topic(Account.Closed),  # type: ignore
+    )
+
+    def __init__(self, env: Optional[EnvType] = None) -> None:
+        super().__init__(env)
+        # How far each leader's log has been seen to be projected.
+        self.positions: Dict[str, int] = {}
+
+    def construct_env(self, name: str, env: Optional[EnvType] = None) -> Environment:
+        environment = super().construct_env(name, env)
+        # eventsourcing's SQLite tables aren't named per application, so unless
+        # told otherwise keep our own database file next to the one we follow.
+        own_dbname = environment.create_keys(SQLiteFactory.SQLITE_DBNAME)[0]
+        dbname = partitions.sqlite_dbname(environment, own_dbname, "balances")
+        if name == self.name and dbname:
+            environment[own_dbname] = dbname
+        return environment
+
+    def construct_transcoder(self) -> Transcoder:
+        # Reads the events of an application written in either encoding.
+        transcoder = CompactTranscoder.from_env(self.env)
+        self.register_transcodings(transcoder)
+        return transcoder
+
+    def _record(self, processing_event: ProcessingEvent) -> List[Recording]:
+        recordings = super()._record(processing_event)
+        # This is the only writer of these aggregates, so cache what was
+        # just written and the next event for the account only fast-forwards.
+        if self.repository.cache is not None and self.repository.fastforward:
+            for aggregate_id, aggregate in processing_event.aggregates.items():
+                self.repository.cache.put(aggregate_id, deepcopy(aggregate))
+        return recordings
+
+    def policy(self, domain_event: DomainEventProtocol, processing_event: ProcessingEvent) -> None:
+        account_id = domain_event.originator_id
+        if isinstance(domain_event, Account.Opened):  # type: ignore
+            processing_event.collect_events(AccountBalance(account_id))
+            return
+        # Earlier events in the same page may have changed it already.
+        balance = processing_event.aggregates.get(account_id) or self.repository.get(account_id)
+        version = domain_event.originator_version
+        if version <= balance.account_version:
+            # Already projected by another process sharing the store.
+            return
+        if isinstance(domain_event, Account.Credited):  # type: ignore
+            balance.credit(domain_event.amount_in_cents, version)
+        elif isinstance(domain_event, Account.Debited):  # type: ignore
+            balance.debit(domain_event.amount_in_cents, version)
+        elif isinstance(domain_event, Account.OverdraftSet):  # type: ignore
+            balance.set_overdraft_limit(domain_event.amount_in_cents, version)
+        else:
+            balance.close(version)
+        processing_event.collect_events(balance)
+
+    def pull_and_process(self, leader_name: str, start: Optional[int] = None, stop: Optional[int] = None) -> None:
+        """
+        Like Follower.pull_and_process(), but each page of notifications is
+        recorded in one go, with the tracking position of its last event.
+        """
+        if start is None:
+            start = self.recorder.max_tracking_id(leader_name) + 1
+        for notifications in self.pull_notifications(leader_name, start=start, stop=stop):
+            self.process_page(self.convert_notifications(leader_name, notifications))
+
+    def process_page(self, jobs: List[ProcessingJob]) -> None:
+        processing_event = ProcessingEvent(tracking=jobs[-1][1])
+        for domain_event, _ in jobs:
+            self.policy(domain_event, processing_event)
+        self._record(processing_event)
+        self._take_snapshots(processing_event)
+
+    def catch_up(self) -> None:
+        with self.processing_lock:
+            for leader_name, reader in self.readers.items():
+                max_notification_id = reader.notification_log.recorder.max_notification_id()
+                while self.positions.get(leader_name, 0) < max_notification_id:
+                    tracked = self.recorder.max_tracking_id(leader_name)
+                    try:
+                        self.pull_and_process(leader_name, start=tracked + 1, stop=max_notification_id)
+                    except IntegrityError:
+                        # Another process sharing the store got there first,
+                        # so carry on from wherever it has got to.
+                        if self.recorder.max_tracking_id(leader_name) == tracked:
+                            raise
+                        continue
+                    self.positions[leader_name] = max_notification_id
+
+    def get(self, account_id: UUID) -> AccountBalance:
+        self.catch_up()
+        try:
+            return self.repository.get(account_id, deepcopy_from_cache=False)
+        except AggregateNotFound:
+            raise AccountNotFoundError(f"No account found with ID: {account_id}")
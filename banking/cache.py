@@ -0,0 +1,53 @@
+# coding=utf-8
+
+from threading import Lock
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from eventsourcing.application import LRUCache
+
+
+class AccountCache(LRUCache[UUID, Any]):
+    """
+    Bounded LRU cache of aggregates used by the Bank's
+    repository. It behaves exactly like the eventsourcing
+    LRUCache, which the repository fast-forwards against
+    the event store on every hit, but it also counts hits,
+    misses and evictions so they can be reported.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stats_lock = Lock()
+
+    def get(self, key: UUID, evict: bool = False) -> Any:
+        try:
+            value = super().get(key, evict)
+        except KeyError:
+            with self.stats_lock:
+                self.misses += 1
+            raise
+        if not evict:
+            with self.stats_lock:
+                self.hits += 1
+        return value
+
+    def put(self, key: UUID, value: Any) -> Optional[Any]:
+        evicted = super().put(key, value)
+        if evicted[0] is not None:
+            with self.stats_lock:
+                self.evictions += 1
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        with self.stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.cache),
+                "maxsize": self.maxsize,
+            }
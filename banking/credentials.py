@@ -0,0 +1,115 @@
+# coding=utf-8
+
+import sqlite3
+from threading import Lock
+from typing import Any, Mapping, NamedTuple, Optional
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.utils import get_topic
+
+from banking import partitions
+from banking.domainmodel import Account, AccountNotFoundError
+from banking.transcoding import stored_topics
+
+
+class Credentials(NamedTuple):
+    account_id: UUID
+    email_address: str
+    password: str
+    closed: bool
+    version: int
+
+
+class CredentialsIndex:
+    """
+    Read model of everything needed to log in, projected from
+    the Opened, PasswordChanged, PasswordHashChanged and Closed
+    events in the application's notification log. The credentials
+    are kept in a SQLite table, and each page of the log is saved
+    together with its position, so when restarted it carries on
+    from there, and processes sharing the database carry on from
+    each other. It is in memory unless it has a database. It
+    catches up before each lookup, so it also sees accounts written
+    by other processes sharing the store.
+    """
+
+    CREDENTIALS_SQLITE_DBNAME = "CREDENTIALS_SQLITE_DBNAME"
+
+    page_size = 1000
+    topics = stored_topics(
+        get_topic(Account.Opened),  # type: ignore
+        get_topic(Account.PasswordChanged),  # type: ignore
+        get_topic(Account.PasswordHashChanged),  # type: ignore
+        get_topic(Account.Closed),  # type: ignore
+    )
+
+    def __init__(self, app: Application, dbname: Optional[str] = None):
+        self.app = app
+        self.dbname = dbname
+        self.position = 0
+        self.lock = Lock()
+        self.connection = sqlite3.connect(dbname or ":memory:", check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(
+                "CREATE TABLE IF NOT EXISTS credentials ("
+                "account_id BLOB PRIMARY KEY, email_address TEXT NOT NULL, password TEXT NOT NULL, "
+                "closed INTEGER NOT NULL, version INTEGER NOT NULL"
+                ") WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS credentials_position (id INTEGER PRIMARY KEY, position INTEGER NOT NULL);"
+            )
+
+    @classmethod
+    def from_env(cls, app: Application, env: Mapping[str, str]) -> "CredentialsIndex":
+        return cls(app, dbname=partitions.sqlite_dbname(env, cls.CREDENTIALS_SQLITE_DBNAME, "credentials"))
+
+    def get(self, account_id: UUID) -> Credentials:
+        self.catch_up()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT email_address, password, closed, version FROM credentials WHERE account_id = ?",
+                (account_id.bytes,),
+            ).fetchone()
+        if row is None:
+            raise AccountNotFoundError(f"No account found with ID: {account_id}")
+        email_address, password, closed, version = row
+        return Credentials(account_id, email_address, password, bool(closed), version)
+
+    def catch_up(self) -> None:
+        with self.lock:
+            # Another process sharing the database may have got further.
+            row = self.connection.execute("SELECT position FROM credentials_position").fetchone()
+            if row is not None:
+                self.position = max(self.position, row[0])
+            for notifications, position in partitions.pages(self.app, self.topics, self.position, self.page_size):
+                with self.connection:
+                    for notification in notifications:
+                        self.project(self.app.mapper.to_domain_event(notification))
+                    self.connection.execute(
+                        "INSERT INTO credentials_position VALUES (0, ?)"
+                        " ON CONFLICT (id) DO UPDATE SET position = MAX(position, excluded.position)",
+                        (position,),
+                    )
+                self.position = position
+
+    def project(self, event: Any) -> None:
+        """Applies an event to the account's credentials, unless it has been already."""
+        account_id = event.originator_id
+        if isinstance(event, Account.Opened):  # type: ignore
+            self.connection.execute("INSERT OR IGNORE INTO credentials VALUES (?, ?, ?, 0, ?)", (
+                account_id.bytes, event.email_address, event.password, event.originator_version,
+            ))
+            return
+        if isinstance(event, Account.PasswordChanged):  # type: ignore
+            column, value = "password", Account.hash_password(event.new_password)
+        elif isinstance(event, Account.PasswordHashChanged):  # type: ignore
+            column, value = "password", event.password_hash
+        else:
+            column, value = "closed", 1
+        self.connection.execute(
+            f"UPDATE credentials SET {column} = ?, version = ? WHERE account_id = ? AND version < ?",
+            (value, event.originator_version, account_id.bytes, event.originator_version),
+        )
+
+    def close(self) -> None:
+        self.connection.close()
@@ -1,10 +1,12 @@
 # coding=utf-8
 
-from hashlib import sha512
+from typing import Optional
 from uuid import UUID
 
 from eventsourcing.domain import Aggregate, event
 
+from banking.passwords import legacy_hash, verify_password
+
 
 class Account(Aggregate):
     """
@@ -35,14 +37,24 @@ class Account(Aggregate):
         self.overdraft_limit = 0
 
     @event("Credited")
-    def credit(self, amount_in_cents: int) -> None:
-        """Add money to the account."""
+    def credit(
+            self,
+            amount_in_cents: int,
+            counterparty_id: Optional[UUID] = None,
+            transfer_id: Optional[UUID] = None,
+    ) -> None:
+        """Add money to the account, from the counterparty of a transfer if any."""
         if self.closed:
             raise AccountClosedError("Account is closed.")
         self.balance += amount_in_cents
 
     @event("Debited")
-    def debit(self, amount_in_cents: int) -> None:
+    def debit(
+            self,
+            amount_in_cents: int,
+            counterparty_id: Optional[UUID] = None,
+            transfer_id: Optional[UUID] = None,
+    ) -> None:
         """Withdraw money from the account. Raise an error if insufficient funds."""
         if amount_in_cents <= 0:
             raise ValueError("Invalid debit amount. Amount should be positive.")
@@ -72,14 +84,46 @@ class Account(Aggregate):
         """Set an overdraft limit."""
         self.overdraft_limit = amount_in_cents
 
+    @event("PasswordHashChanged")
+    def set_password_hash(self, password_hash: str) -> None:
+        """Replace the stored password hash, e.g. after a rehash."""
+        self.password = password_hash
+
     @staticmethod
     def hash_password(password: str) -> str:
-        """Hash the password before saving it."""
-        return sha512(password.encode()).hexdigest()
+        """
+        Legacy unsalted hash. New hashes come from the Bank's
+        PasswordHasher; this stays so that old PasswordChanged
+        events replay to the same state.
+        """
+        return legacy_hash(password)
 
     def check_password(self, password: str) -> bool:
         """Check if the provided password matches the stored one."""
-        return self.hash_password(password) == self.password
+        return verify_password(password, self.password)
+
+
+class Transfer(Aggregate):
+    """
+    Record of one transfer between two accounts. It is saved
+    together with the debit and the credit, which both carry its
+    id, so the same transfer can never be made twice.
+    """
+
+    _id: UUID
+
+    @event("Made")
+    def __init__(
+            self,
+            id: UUID,
+            debit_account_id: UUID,
+            credit_account_id: UUID,
+            amount_in_cents: int,
+    ):
+        self._id = id
+        self.debit_account_id = debit_account_id
+        self.credit_account_id = credit_account_id
+        self.amount_in_cents = amount_in_cents
 
 
 class TransactionError(Exception):
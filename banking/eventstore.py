@@ -0,0 +1,60 @@
+# coding=utf-8
+
+import time
+from typing import Any, Iterator, List, Optional, Sequence
+from uuid import UUID
+
+from eventsourcing.domain import DomainEventProtocol
+from eventsourcing.persistence import AggregateRecorder, EventStore, Mapper, Recording
+
+from banking.metrics import record_store
+
+
+class PagedEventStore(EventStore):
+    """
+    Event store that reads an aggregate's events a page at a time,
+    using the version of the last event read as the cursor for the
+    next page. The repository folds events as they are yielded, so
+    however long an account's history is, no more than a page of
+    its events is held in memory while it is reconstructed or
+    fast-forwarded. A page size of zero reads them all at once.
+    Each read and write is counted, with the events read and the
+    bytes written, against the request and Bank call it was for.
+    """
+
+    def __init__(self, mapper: Mapper, recorder: AggregateRecorder, page_size: int = 1000):
+        super().__init__(mapper, recorder)
+        self.page_size = page_size
+
+    def get(
+            self,
+            originator_id: UUID,
+            gt: Optional[int] = None,
+            lte: Optional[int] = None,
+            desc: bool = False,
+            limit: Optional[int] = None,
+    ) -> Iterator[DomainEventProtocol]:
+        if desc or limit is not None or self.page_size <= 0:
+            started = time.perf_counter()
+            stored_events = self.recorder.select_events(originator_id, gt=gt, lte=lte, desc=desc, limit=limit)
+            record_store(len(stored_events), 1, seconds=time.perf_counter() - started)
+            return map(self.mapper.to_domain_event, stored_events)
+        return self._get_pages(originator_id, gt, lte)
+
+    def put(self, domain_events: Sequence[DomainEventProtocol], **kwargs: Any) -> List[Recording]:
+        started = time.perf_counter()
+        recordings = super().put(domain_events, **kwargs)
+        bytes_written = sum(len(recording.notification.state) for recording in recordings)
+        record_store(0, 1, bytes_written, time.perf_counter() - started)
+        return recordings
+
+    def _get_pages(self, originator_id: UUID, gt: Optional[int], lte: Optional[int]) -> Iterator[DomainEventProtocol]:
+        while True:
+            started = time.perf_counter()
+            stored_events = self.recorder.select_events(originator_id, gt=gt, lte=lte, limit=self.page_size)
+            record_store(len(stored_events), 1, seconds=time.perf_counter() - started)
+            for stored_event in stored_events:
+                yield self.mapper.to_domain_event(stored_event)
+            if len(stored_events) < self.page_size:
+                return
+            gt = stored_events[-1].originator_version
@@ -0,0 +1,130 @@
+# coding=utf-8
+
+import sqlite3
+import time
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
+from threading import Thread
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+from weakref import WeakSet
+
+from eventsourcing.persistence import IntegrityError, StoredEvent
+from eventsourcing.sqlite import SQLiteApplicationRecorder, SQLiteConnection, SQLiteCursor, SQLiteDatastore
+
+Pending = Tuple[List[StoredEvent], Dict[str, Any], "Future[Optional[Sequence[int]]]"]
+
+
+class GroupCommitRecorder(SQLiteApplicationRecorder):
+    """
+    SQLite recorder that commits the saves of concurrent callers
+    together. Saves are queued for one writer thread, which waits up
+    to a window after the first for more, or until it has max_events,
+    then inserts them all in one transaction, so they share a single
+    fsync of the write-ahead log. Each save has its own savepoint, so
+    one that conflicts fails alone, and each caller returns only once
+    the transaction holding its events has been committed.
+    """
+
+    SQLITE_GROUP_COMMIT_WINDOW = "SQLITE_GROUP_COMMIT_WINDOW"
+    SQLITE_GROUP_COMMIT_MAX_EVENTS = "SQLITE_GROUP_COMMIT_MAX_EVENTS"
+
+    # Set on each connection the writer uses. A commit is durable once
+    # it returns only with synchronous=FULL, which fsyncs the log on
+    # every commit (NORMAL defers that to checkpoints); checkpointing
+    # less often keeps the writer appending to the log.
+    pragmas = (
+        "PRAGMA synchronous=FULL",
+        "PRAGMA wal_autocheckpoint=4000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-16000",
+    )
+
+    def __init__(
+            self,
+            datastore: SQLiteDatastore,
+            window: float = 0.002,
+            max_events: int = 500,
+            events_table_name: str = "stored_events",
+    ):
+        super().__init__(datastore, events_table_name)
+        self.window = window
+        self.max_events = max_events
+        self.configured: "WeakSet[SQLiteConnection]" = WeakSet()
+        self.queue: "SimpleQueue[Optional[Pending]]" = SimpleQueue()
+        self.thread = Thread(target=self.run, name="group-commit", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_env(cls, datastore: SQLiteDatastore, env: Mapping[str, str]) -> "GroupCommitRecorder":
+        return cls(
+            datastore,
+            window=float(env.get(cls.SQLITE_GROUP_COMMIT_WINDOW) or 0.002),
+            max_events=int(env.get(cls.SQLITE_GROUP_COMMIT_MAX_EVENTS) or 500),
+        )
+
+    def insert_events(self, stored_events: List[StoredEvent], **kwargs: Any) -> Optional[Sequence[int]]:
+        future: "Future[Optional[Sequence[int]]]" = Future()
+        self.queue.put((stored_events, kwargs, future))
+        return future.result()
+
+    def run(self) -> None:
+        while True:
+            pending = [self.queue.get()]
+            if pending[0] is not None:
+                events = len(pending[0][0])
+                deadline = time.perf_counter() + self.window
+                while events < self.max_events:
+                    try:
+                        item = self.queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                    except Empty:
+                        break
+                    pending.append(item)
+                    if item is None:
+                        break
+                    events += len(item[0])
+            stopping = pending[-1] is None
+            batch = [item for item in pending if item is not None]
+            if batch:
+                self.commit(batch)
+            if stopping:
+                return
+
+    def commit(self, batch: List[Pending]) -> None:
+        results: List[Any] = []
+        try:
+            with self.datastore.get_connection(commit=True) as conn:
+                self.configure(conn)
+                with conn.transaction(commit=True) as c:
+                    for stored_events, kwargs, _ in batch:
+                        results.append(self.insert_pending(c, stored_events, kwargs))
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def insert_pending(
+            self, c: SQLiteCursor, stored_events: List[StoredEvent], kwargs: Dict[str, Any],
+    ) -> Any:
+        c.execute("SAVEPOINT pending")
+        try:
+            result: Any = self._insert_events(c, stored_events, **kwargs)
+        except sqlite3.IntegrityError as e:
+            c.execute("ROLLBACK TO pending")
+            result = IntegrityError(e)
+        c.execute("RELEASE pending")
+        return result
+
+    def configure(self, conn: SQLiteConnection) -> None:
+        if conn not in self.configured:
+            cursor = conn.cursor()
+            for pragma in self.pragmas:
+                cursor.execute(pragma)
+            self.configured.add(conn)
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
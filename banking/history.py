@@ -0,0 +1,189 @@
+# coding=utf-8
+
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Any, List, Mapping, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.utils import get_topic
+
+from banking import partitions
+from banking.domainmodel import Account
+from banking.transcoding import stored_topics
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class Movement(NamedTuple):
+    account_id: UUID
+    timestamp: datetime
+    type: str  # "credit" or "debit"
+    amount: int
+    balance: int
+    counterparty_id: Optional[UUID]
+    transfer_id: Optional[UUID]
+    version: int  # of the account, after the movement
+
+
+def _microseconds(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def _movement(row: Tuple[Any, ...]) -> Movement:
+    account_id, version, timestamp, movement_type, amount, balance, counterparty_id, transfer_id = row
+    return Movement(
+        account_id=UUID(bytes=account_id),
+        timestamp=EPOCH + timestamp * MICROSECOND,
+        type=movement_type,
+        amount=amount,
+        balance=balance,
+        counterparty_id=UUID(bytes=counterparty_id) if counterparty_id else None,
+        transfer_id=UUID(bytes=transfer_id) if transfer_id else None,
+        version=version,
+    )
+
+
+class TransactionHistory:
+    """
+    Read model of every account's movements, projected from the
+    Credited and Debited events in the application's notification
+    log, with the balance after each one and the other account and
+    id of transfers. The movements are kept in a SQLite table, indexed
+    by account and timestamp, so a page, or the version of the account
+    at a given time, is found with an index lookup, wherever it is in
+    the history. Each page of the log is saved together with its
+    position, so when restarted it carries on from there, and
+    processes sharing the database carry on from each other. It is in
+    memory unless it has a database. Like the CredentialsIndex, it
+    catches up before each lookup.
+    """
+
+    HISTORY_SQLITE_DBNAME = "HISTORY_SQLITE_DBNAME"
+
+    page_size = 1000
+    topics = stored_topics(
+        get_topic(Account.Credited),  # type: ignore
+        get_topic(Account.Debited),  # type: ignore
+    )
+
+    def __init__(self, app: Application, dbname: Optional[str] = None):
+        self.app = app
+        self.dbname = dbname
+        self.position = 0
+        self.lock = Lock()
+        self.connection = sqlite3.connect(dbname or ":memory:", check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(
+                "CREATE TABLE IF NOT EXISTS history_movements ("
+                "account_id BLOB NOT NULL, version INTEGER NOT NULL, timestamp INTEGER NOT NULL, "
+                "type TEXT NOT NULL, amount INTEGER NOT NULL, balance INTEGER NOT NULL, "
+                "counterparty_id BLOB, transfer_id BLOB, PRIMARY KEY (account_id, version)"
+                ") WITHOUT ROWID;"
+                "CREATE INDEX IF NOT EXISTS history_movements_timestamp "
+                "ON history_movements (account_id, timestamp);"
+                "CREATE TABLE IF NOT EXISTS history_position (id INTEGER PRIMARY KEY, position INTEGER NOT NULL);"
+            )
+
+    @classmethod
+    def from_env(cls, app: Application, env: Mapping[str, str]) -> "TransactionHistory":
+        return cls(app, dbname=partitions.sqlite_dbname(env, cls.HISTORY_SQLITE_DBNAME, "history"))
+
+    def page(
+            self,
+            account_id: UUID,
+            limit: int,
+            before: Optional[int] = None,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+    ) -> Tuple[List[Movement], Optional[int]]:
+        """
+        Up to ``limit`` movements, newest first, from ``since`` (inclusive)
+        until ``until`` (exclusive), and only those older than the cursor
+        ``before``, the version of the last movement of the previous page.
+        Also returns the cursor for the next page, if any.
+        """
+        self.catch_up()
+        conditions = ["account_id = ?"]
+        params: List[Any] = [account_id.bytes]
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(_microseconds(since))
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(_microseconds(until))
+        if before is not None:
+            # Older than the cursor's movement, in the order of the index.
+            conditions.append(
+                "(timestamp, version) < (SELECT timestamp, version FROM history_movements"
+                " WHERE account_id = ? AND version = ?)"
+            )
+            params.extend((account_id.bytes, before))
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT * FROM history_movements WHERE {' AND '.join(conditions)}"
+                " ORDER BY timestamp DESC, version DESC LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+        page = [_movement(row) for row in rows[:limit]]
+        return page, page[-1].version if len(rows) > limit else None
+
+    def version_at(self, account_id: UUID, timestamp: datetime) -> Optional[int]:
+        """The account's version after its last movement at or before ``timestamp``, if any."""
+        self.catch_up()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT version FROM history_movements WHERE account_id = ? AND timestamp <= ?"
+                " ORDER BY timestamp DESC, version DESC LIMIT 1",
+                (account_id.bytes, _microseconds(timestamp)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def catch_up(self) -> None:
+        with self.lock:
+            # Another process sharing the database may have got further.
+            row = self.connection.execute("SELECT position FROM history_position").fetchone()
+            if row is not None:
+                self.position = max(self.position, row[0])
+            for notifications, position in partitions.pages(self.app, self.topics, self.position, self.page_size):
+                with self.connection:
+                    for notification in notifications:
+                        self.project(self.app.mapper.to_domain_event(notification))
+                    self.connection.execute(
+                        "INSERT INTO history_position VALUES (0, ?)"
+                        " ON CONFLICT (id) DO UPDATE SET position = MAX(position, excluded.position)",
+                        (position,),
+                    )
+                self.position = position
+
+    def project(self, event: Any) -> None:
+        """Adds the movement of a Credited or Debited event, unless it has been already."""
+        account_id = event.originator_id
+        row = self.connection.execute(
+            "SELECT balance FROM history_movements WHERE account_id = ? AND version < ?"
+            " ORDER BY version DESC LIMIT 1",
+            (account_id.bytes, event.originator_version),
+        ).fetchone()
+        balance = row[0] if row else 0
+        if isinstance(event, Account.Credited):  # type: ignore
+            movement_type, balance = "credit", balance + event.amount_in_cents
+        else:
+            movement_type, balance = "debit", balance - event.amount_in_cents
+        # Events from before transfers were identified don't have these.
+        counterparty_id = getattr(event, "counterparty_id", None)
+        transfer_id = getattr(event, "transfer_id", None)
+        self.connection.execute("INSERT OR IGNORE INTO history_movements VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+            account_id.bytes,
+            event.originator_version,
+            _microseconds(event.timestamp),
+            movement_type,
+            event.amount_in_cents,
+            balance,
+            counterparty_id.bytes if counterparty_id else None,
+            transfer_id.bytes if transfer_id else None,
+        ))
+
+    def close(self) -> None:
+        self.connection.close()
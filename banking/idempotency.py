@@ -0,0 +1,173 @@
+# coding=utf-8
+
+import sqlite3
+import struct
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock, local
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+from banking import partitions
+
+DIGEST_BYTES = 16
+HEADER = struct.Struct("<dH")  # expires, status
+
+
+def digest(value: bytes) -> bytes:
+    return blake2b(value, digest_size=DIGEST_BYTES).digest()
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: bytes  # Digest of the request body
+    status: int  # Zero while the first request is still in progress
+    body: str
+
+
+class IdempotencyStore:
+    """
+    Responses to requests made with an Idempotency-Key, so that a
+    client retrying the same request is answered without running it
+    again. A key is reserved by the first request that uses it, and
+    its response is kept for a fixed time to live. Keys are held in
+    memory, hashed and packed into bytes to keep them small. Requests
+    in progress and finished ones are held apart, each oldest first,
+    so expired keys are evicted from the front. Only finished ones
+    are capped, so a request in progress is never evicted to make
+    room. Given a SQLite database, the store is also kept there,
+    so worker processes sharing it see each other's keys, and the
+    database decides which of two concurrent requests goes first.
+    """
+
+    IDEMPOTENCY_KEY_TTL = "IDEMPOTENCY_KEY_TTL"
+    IDEMPOTENCY_CACHE_MAXSIZE = "IDEMPOTENCY_CACHE_MAXSIZE"
+    IDEMPOTENCY_SQLITE_DBNAME = "IDEMPOTENCY_SQLITE_DBNAME"
+
+    # How long a key stays reserved by a request that never finishes.
+    pending_ttl = 60.0
+    # Expired keys are deleted from the database every so many reservations.
+    purge_interval = 1000
+
+    def __init__(self, ttl: float = 86400.0, maxsize: int = 1000000, dbname: Optional[str] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.dbname = dbname
+        self.entries: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self.pending: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self.lock = Lock()
+        self.connections = local()
+        self.reservations = 0
+        if dbname:
+            self.connection().execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                "key BLOB PRIMARY KEY, expires REAL NOT NULL, fingerprint BLOB NOT NULL, "
+                "status INTEGER NOT NULL, body TEXT NOT NULL) WITHOUT ROWID"
+            )
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> "IdempotencyStore":
+        return cls(
+            ttl=float(env.get(cls.IDEMPOTENCY_KEY_TTL, 86400.0)),
+            maxsize=int(env.get(cls.IDEMPOTENCY_CACHE_MAXSIZE, 1000000)),
+            # Workers sharing a SQLite event store share the keys too.
+            dbname=partitions.sqlite_dbname(env, cls.IDEMPOTENCY_SQLITE_DBNAME, "idempotency"),
+        )
+
+    def begin(self, key: str, fingerprint: bytes) -> Optional[StoredResponse]:
+        """
+        Reserves the key for a new request and returns None, or returns
+        what is stored for it: the response, or that it is in progress.
+        """
+        key_digest = digest(key.encode())
+        now = time.time()
+        with self.lock:
+            stored = self._get(key_digest, now)
+            if stored is None and not self.dbname:
+                self._put(key_digest, StoredResponse(fingerprint, 0, ""), now + self.pending_ttl)
+            if stored is not None or not self.dbname:
+                return stored
+        stored, expires = self._begin_shared(key_digest, fingerprint, now)
+        if stored is not None and stored.status:
+            with self.lock:
+                self._put(key_digest, stored, expires)
+        return stored
+
+    def finish(self, key: str, fingerprint: bytes, status: int, body: str) -> None:
+        key_digest = digest(key.encode())
+        stored = StoredResponse(fingerprint, status, body)
+        expires = time.time() + self.ttl
+        if self.dbname:
+            # Even if its reservation expired and was purged while it ran.
+            with self.connection() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO idempotency_keys VALUES (?, ?, ?, ?, ?)",
+                    (key_digest, expires, fingerprint, status, body),
+                )
+        with self.lock:
+            self._put(key_digest, stored, expires)
+
+    def cancel(self, key: str) -> None:
+        """Releases the key of a request that failed, so that it can be retried."""
+        key_digest = digest(key.encode())
+        if self.dbname:
+            with self.connection() as connection:
+                connection.execute("DELETE FROM idempotency_keys WHERE key = ?", (key_digest,))
+        with self.lock:
+            self.pending.pop(key_digest, None)
+            self.entries.pop(key_digest, None)
+
+    def _get(self, key_digest: bytes, now: float) -> Optional[StoredResponse]:
+        for entries in (self.pending, self.entries):
+            entry = entries.get(key_digest)
+            if entry is not None:
+                break
+        else:
+            return None
+        expires, status = HEADER.unpack_from(entry)
+        if expires < now:
+            del entries[key_digest]
+            return None
+        fingerprint = entry[HEADER.size:HEADER.size + DIGEST_BYTES]
+        return StoredResponse(fingerprint, status, entry[HEADER.size + DIGEST_BYTES:].decode())
+
+    def _put(self, key_digest: bytes, stored: StoredResponse, expires: float) -> None:
+        entries = self.entries if stored.status else self.pending
+        self.pending.pop(key_digest, None)
+        entries[key_digest] = HEADER.pack(expires, stored.status) + stored.fingerprint + stored.body.encode()
+        entries.move_to_end(key_digest)
+        # Each is in order of expiry, since all its keys live as long,
+        # and only finished requests are evicted to keep within maxsize.
+        now = time.time()
+        for kept, maxsize in ((self.pending, None), (self.entries, self.maxsize)):
+            while kept:
+                oldest = next(iter(kept.values()))
+                if (maxsize is None or len(kept) <= maxsize) and HEADER.unpack_from(oldest)[0] >= now:
+                    break
+                kept.popitem(last=False)
+
+    def _begin_shared(self, key_digest: bytes, fingerprint: bytes, now: float) -> Tuple[Optional[StoredResponse], float]:
+        with self.connection() as connection:
+            connection.execute("DELETE FROM idempotency_keys WHERE key = ? AND expires < ?", (key_digest, now))
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO idempotency_keys VALUES (?, ?, ?, 0, '')",
+                (key_digest, now + self.pending_ttl, fingerprint),
+            ).rowcount
+            if inserted:
+                self.reservations += 1
+                if self.reservations % self.purge_interval == 0:
+                    connection.execute("DELETE FROM idempotency_keys WHERE expires < ?", (now,))
+                return None, 0.0
+            expires, stored_fingerprint, status, body = connection.execute(
+                "SELECT expires, fingerprint, status, body FROM idempotency_keys WHERE key = ?", (key_digest,)
+            ).fetchone()
+        return StoredResponse(stored_fingerprint, status, body), expires
+
+    def connection(self) -> sqlite3.Connection:
+        # One connection per thread, since the api serves requests on several.
+        connection = getattr(self.connections, "connection", None)
+        if connection is None:
+            assert self.dbname
+            connection = sqlite3.connect(self.dbname, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.connections.connection = connection
+        return connection
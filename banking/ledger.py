@@ -0,0 +1,306 @@
+# coding=utf-8
+
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+from multiprocessing import Queue
+from threading import Lock
+from typing import Any, Deque, Dict, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.persistence import Cipher, Compressor
+from eventsourcing.utils import get_topic
+
+from banking import partitions
+from banking.domainmodel import Account, Transfer
+from banking.partitions import StateDecoder, StoredState
+from banking.transcoding import stored_topics
+
+CREDITED, DEBITED, OVERDRAFT_SET, TRANSFER_MADE = range(4)
+KINDS = {
+    topic: kind
+    for kind, cls in enumerate([
+        Account.Credited, Account.Debited, Account.OverdraftSet, Transfer.Made,  # type: ignore
+    ])
+    for topic in stored_topics(get_topic(cls))
+}
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerTotals(NamedTuple):
+    credits: int = 0
+    debits: int = 0
+    deposits: int = 0  # credits that aren't part of a transfer
+    withdrawals: int = 0  # debits that aren't part of a transfer
+    transfers: int = 0  # amounts of the transfers made
+
+    @property
+    def balanced(self) -> bool:
+        """Whether what the accounts hold between them is what was deposited less what was withdrawn."""
+        return self.credits - self.debits == self.deposits - self.withdrawals
+
+
+class Violation(NamedTuple):
+    originator_id: Optional[UUID]  # the account or transfer, if known
+    message: str
+
+
+class LedgerRescan(NamedTuple):
+    totals: LedgerTotals
+    violations: List[Violation]
+    events: int
+    seconds: float
+
+
+class LedgerState:
+    """
+    Running totals, and each account's balance and overdraft limit,
+    folded from the stored state of Credited, Debited, OverdraftSet
+    and Transfer.Made events in the order they were recorded. A debit
+    that takes an account past its overdraft limit is a violation.
+    The debit, credit and record of each transfer are saved together,
+    so when they are all seen they must be for the same amount. They
+    are either paired up by transfer id, or, when a transfer's parts
+    may be seen by different processes, summed as hashes of the id
+    and amount, which add up to the same for each part if they pair.
+    """
+
+    def __init__(self, decoder: StateDecoder, pair_transfers: bool = True):
+        self.decoder = decoder
+        self.totals = [0, 0, 0, 0, 0]
+        self.accounts: Dict[UUID, List[int]] = {}  # balance, overdraft limit
+        self.changed: Set[UUID] = set()
+        self.transfers: Optional[Dict[UUID, List[Optional[int]]]] = {} if pair_transfers else None
+        self.transfer_hashes = [0, 0, 0]  # debits, credits, transfers made
+        self.violations: List[Violation] = []
+        self.events = 0
+
+    def add(self, stored_states: Iterable[StoredState]) -> None:
+        totals = self.totals
+        for originator_id, topic, state in stored_states:
+            self.events += 1
+            kind = KINDS[topic]
+            decoded = self.decoder.decode(state)
+            amount = decoded["amount_in_cents"]
+            if kind == TRANSFER_MADE:
+                totals[4] += amount
+                self.add_part(originator_id, 2, amount)
+                continue
+            account = self.accounts.get(originator_id)
+            if account is None:
+                account = self.accounts[originator_id] = [0, 0]
+            self.changed.add(originator_id)
+            if kind == OVERDRAFT_SET:
+                account[1] = amount
+                continue
+            # Events from before transfers were identified don't have one.
+            transfer_id = decoded.get("transfer_id")
+            if kind == CREDITED:
+                account[0] += amount
+                totals[0] += amount
+                if transfer_id is None:
+                    totals[2] += amount
+                else:
+                    self.add_part(transfer_id, 1, amount)
+            else:
+                account[0] -= amount
+                totals[1] += amount
+                if transfer_id is None:
+                    totals[3] += amount
+                else:
+                    self.add_part(transfer_id, 0, amount)
+                if account[0] < -account[1]:
+                    self.violations.append(Violation(
+                        originator_id, f"Overdrawn to {account[0]} with an overdraft limit of {account[1]}"
+                    ))
+
+    def add_part(self, transfer_id: UUID, part: int, amount: int) -> None:
+        if self.transfers is None:
+            self.transfer_hashes[part] += hash((transfer_id.int, amount))
+            return
+        parts = self.transfers.setdefault(transfer_id, [None, None, None])
+        parts[part] = amount
+        if None not in parts:
+            del self.transfers[transfer_id]
+            if parts[0] != parts[1] or parts[1] != parts[2]:
+                self.unpaired(transfer_id, parts)
+
+    def check_transfers(self) -> None:
+        """Flag the transfers not yet seen in full, once all the events saved with those seen have been."""
+        if self.transfers:
+            for transfer_id, parts in self.transfers.items():
+                self.unpaired(transfer_id, parts)
+            self.transfers.clear()
+
+    def unpaired(self, transfer_id: UUID, parts: List[Optional[int]]) -> None:
+        debited, credited, made = parts
+        self.violations.append(Violation(
+            transfer_id, f"Transfer of {made} debited {debited} and credited {credited}"
+        ))
+
+
+def _rescan_partition(
+        queue: "Queue[Optional[List[StoredState]]]",
+        results: "Queue[Tuple[List[int], List[int], List[Violation], int]]",
+        n: int,
+        compressor: Optional[Compressor],
+        cipher: Optional[Cipher],
+) -> None:
+    state = LedgerState(StateDecoder(partitions.transcoder(), compressor, cipher), pair_transfers=False)
+    for stored_states in iter(queue.get, None):
+        state.add(stored_states)
+    results.put((state.totals, state.transfer_hashes, state.violations, state.events))
+
+
+class LedgerVerifier:
+    """
+    Proof that the books balance, kept up to date by following the
+    application's notification log: credits less debits across all
+    accounts is deposits less withdrawals, because each transfer's
+    debit and credit are for the amount of the transfer, and no debit
+    takes an account past its overdraft limit. Violations are logged
+    and kept. Its position, running totals and the balance and limit
+    of each account it has seen are saved to a SQLite database, if it
+    has one, every so many pages and after catching up, so it carries
+    on from there when restarted. The whole log can also be rescanned,
+    on several processes, without touching any of that.
+    """
+
+    LEDGER_SQLITE_DBNAME = "LEDGER_SQLITE_DBNAME"
+
+    page_size = 1000
+    checkpoint_interval = 100  # pages
+    max_violations = 1000
+    topics = list(KINDS)
+
+    def __init__(self, app: Application, dbname: Optional[str] = None):
+        self.app = app
+        self.dbname = dbname
+        self.position = 0
+        self.state = LedgerState(StateDecoder.from_mapper(app.mapper))
+        self.violations: Deque[Violation] = deque(maxlen=self.max_violations)
+        self.lock = Lock()
+        self.connection: Optional[sqlite3.Connection] = None
+        if dbname:
+            self.connection = sqlite3.connect(dbname, check_same_thread=False)
+            self.connection.executescript(
+                "CREATE TABLE IF NOT EXISTS ledger_checkpoint ("
+                "id INTEGER PRIMARY KEY, position INTEGER NOT NULL, credits INTEGER NOT NULL, "
+                "debits INTEGER NOT NULL, deposits INTEGER NOT NULL, withdrawals INTEGER NOT NULL, "
+                "transfers INTEGER NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS ledger_accounts ("
+                "account_id BLOB PRIMARY KEY, balance INTEGER NOT NULL, overdraft_limit INTEGER NOT NULL"
+                ") WITHOUT ROWID;"
+            )
+            self.load()
+
+    @classmethod
+    def from_env(cls, app: Application, env: Mapping[str, str]) -> "LedgerVerifier":
+        return cls(app, dbname=partitions.sqlite_dbname(env, cls.LEDGER_SQLITE_DBNAME, "ledger"))
+
+    @property
+    def totals(self) -> LedgerTotals:
+        return LedgerTotals(*self.state.totals)
+
+    def catch_up(self) -> List[Violation]:
+        """Verify the events recorded since the last call, returning any violations found."""
+        with self.lock:
+            pages = 0
+            for notifications, position in partitions.pages(self.app, self.topics, self.position, self.page_size):
+                self.state.add((n.originator_id, n.topic, n.state) for n in notifications)
+                self.position = position
+                pages += 1
+                # Only between transfers, since part way through one can't be resumed.
+                if pages % self.checkpoint_interval == 0 and not self.state.transfers:
+                    self.save()
+            self.state.check_transfers()
+            if pages:
+                self.save()
+            violations, self.state.violations = self.state.violations, []
+        for violation in violations:
+            logger.warning("Ledger violation: %s (%s)", violation.message, violation.originator_id)
+        self.violations.extend(violations)
+        return violations
+
+    def rescan(self, workers: int = 0) -> LedgerRescan:
+        """Verify the whole log from the start, on ``workers`` processes, or in this one if none."""
+        started = time.perf_counter()
+        pages = partitions.scan(self.app, self.topics, self.page_size)
+        if workers <= 0:
+            state = LedgerState(StateDecoder.from_mapper(self.app.mapper), pair_transfers=False)
+            for stored_states in pages:
+                state.add(stored_states)
+            results: List[Any] = [(state.totals, state.transfer_hashes, state.violations, state.events)]
+        else:
+            mapper = self.app.mapper
+            results = partitions.run_partitioned(pages, _rescan_partition, (mapper.compressor, mapper.cipher), workers)
+        totals = LedgerTotals(*map(sum, zip(*(totals for totals, _, _, _ in results))))
+        debited, credited, made = map(sum, zip(*(hashes for _, hashes, _, _ in results)))
+        violations = [violation for _, _, partition_violations, _ in results for violation in partition_violations]
+        if not debited == credited == made:
+            violations.append(Violation(None, "Transfer debits, credits and amounts don't pair up"))
+        return LedgerRescan(
+            totals=totals,
+            violations=violations,
+            events=sum(events for _, _, _, events in results),
+            seconds=time.perf_counter() - started,
+        )
+
+    def load(self) -> None:
+        assert self.connection is not None
+        row = self.connection.execute(
+            "SELECT position, credits, debits, deposits, withdrawals, transfers FROM ledger_checkpoint"
+        ).fetchone()
+        if row is not None:
+            self.position, *self.state.totals = row
+        for account_id, balance, overdraft_limit in self.connection.execute("SELECT * FROM ledger_accounts"):
+            self.state.accounts[UUID(bytes=account_id)] = [balance, overdraft_limit]
+
+    def save(self) -> None:
+        if self.connection is None:
+            self.state.changed.clear()
+            return
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO ledger_accounts VALUES (?, ?, ?)", (
+                (account_id.bytes, *self.state.accounts[account_id]) for account_id in self.state.changed
+            ))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO ledger_checkpoint VALUES (0, ?, ?, ?, ?, ?, ?)",
+                (self.position, *self.state.totals),
+            )
+        self.state.changed.clear()
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from banking.applicationmodel import Bank
+
+    parser = argparse.ArgumentParser(description="Verify that the books balance.")
+    parser.add_argument("--rescan", type=int, metavar="WORKERS",
+                        help="verify the whole log once, on WORKERS processes (0 for none), and exit")
+    parser.add_argument("--period", type=float, default=1.0, help="seconds between catching up (default 1)")
+    args = parser.parse_args()
+    logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
+
+    bank = Bank()
+    verifier = LedgerVerifier.from_env(bank, os.environ)
+    if args.rescan is not None:
+        rescan = verifier.rescan(args.rescan)
+        print(f"{rescan.events} events in {rescan.seconds:.1f}s, {rescan.totals},"
+              f" {'balanced' if rescan.totals.balanced else 'NOT balanced'}, {len(rescan.violations)} violations")
+        for violation in rescan.violations:
+            print(f"{violation.originator_id}: {violation.message}")
+    else:
+        while True:
+            verifier.catch_up()
+            logger.info("Verified up to %d: %s", verifier.position, verifier.totals)
+            time.sleep(args.period)
@@ -0,0 +1,200 @@
+# coding=utf-8
+
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, cast
+
+Labels = Tuple[Tuple[str, str], ...]
+TCall = TypeVar("TCall", bound=Callable[..., Any])
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Time to answer a request, by route, method and status."),
+    "http_request_phase_seconds_total": ("counter", "Time spent in each phase of answering requests, by route."),
+    "bank_call_duration_seconds": ("histogram", "Time taken by each Bank command and query."),
+    "bank_events_read_total": ("counter", "Stored events read by each Bank command and query."),
+    "bank_store_round_trips_total": ("counter", "Event store reads and writes made by each Bank command and query."),
+    "bank_bytes_written_total": ("counter", "Bytes of event state written by each Bank command."),
+}
+
+
+class Sample:
+    """The store work done by a request or a Bank call, and its seconds by phase."""
+
+    __slots__ = ("events_read", "round_trips", "bytes_written", "phases")
+
+    def __init__(self) -> None:
+        self.events_read = 0
+        self.round_trips = 0
+        self.bytes_written = 0
+        self.phases: Dict[str, float] = {}
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        """A Server-Timing header value, in milliseconds."""
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.3f}" for name, seconds in [*self.phases.items(), ("total", total)]
+        )
+
+
+# What is being sampled in this context: the request, and the Bank call it's in, if any.
+_request: ContextVar[Optional[Sample]] = ContextVar("request_sample", default=None)
+_call: ContextVar[Optional[Sample]] = ContextVar("call_sample", default=None)
+
+
+def begin_request() -> Sample:
+    sample = Sample()
+    _request.set(sample)
+    return sample
+
+
+def end_request() -> Sample:
+    sample = _request.get() or Sample()
+    _request.set(None)
+    return sample
+
+
+def record_store(events_read: int = 0, round_trips: int = 0, bytes_written: int = 0, seconds: float = 0.0) -> None:
+    """Count store work against the request and the Bank call it was done for."""
+    for sample in (_request.get(), _call.get()):
+        if sample is not None:
+            sample.events_read += events_read
+            sample.round_trips += round_trips
+            sample.bytes_written += bytes_written
+            sample.add_phase("store", seconds)
+
+
+class phase:
+    """Time a phase of the current request (a class, being cheaper to enter than a generator)."""
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        sample = _request.get()
+        if sample is not None:
+            sample.add_phase(self.name, time.perf_counter() - self.started)
+
+
+def instrumented(call: TCall) -> TCall:
+    """
+    Time a Bank command or query, and count the store work it does,
+    in the Bank's metrics. Calls it makes to others are part of it.
+    """
+    labels = (("call", call.__name__),)
+
+    @wraps(call)
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        if _call.get() is not None:
+            return call(self, *args, **kwargs)
+        sample = Sample()
+        token = _call.set(sample)
+        started = time.perf_counter()
+        try:
+            return call(self, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            _call.reset(token)
+            request = _request.get()
+            if request is not None:
+                request.add_phase("bank", seconds)
+            self.metrics.record_call(labels, seconds, sample)
+    return cast(TCall, wrapper)
+
+
+class Metrics:
+    """
+    Counters and latency histograms, in memory, rendered in the
+    Prometheus text format. Each process has its own, so with several
+    workers each one's are those of the requests it answered.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # A count per bucket, then over the last, then the sum of what was observed.
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self.lock = Lock()
+
+    def inc(self, name: str, labels: Labels, amount: float = 1) -> None:
+        with self.lock:
+            self._inc(name, labels, amount)
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        with self.lock:
+            self._observe(name, labels, value)
+
+    def record_call(self, labels: Labels, seconds: float, sample: Sample) -> None:
+        with self.lock:
+            self._observe("bank_call_duration_seconds", labels, seconds)
+            self._inc("bank_events_read_total", labels, sample.events_read)
+            self._inc("bank_store_round_trips_total", labels, sample.round_trips)
+            self._inc("bank_bytes_written_total", labels, sample.bytes_written)
+
+    def record_request(self, route: str, method: str, status: int, seconds: float, sample: Sample) -> None:
+        with self.lock:
+            self._observe(
+                "http_request_duration_seconds",
+                (("method", method), ("route", route), ("status", str(status))),
+                seconds,
+            )
+            for name, phase_seconds in sample.phases.items():
+                self._inc("http_request_phase_seconds_total", (("phase", name), ("route", route)), phase_seconds)
+
+    def _inc(self, name: str, labels: Labels, amount: float) -> None:
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def _observe(self, name: str, labels: Labels, value: float) -> None:
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def render(self) -> str:
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(histogram) for key, histogram in self.histograms.items()}
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (histogram_name, labels), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                count = 0.0
+                for bound, bucket_count in zip([*map(str, self.buckets), "+Inf"], histogram):
+                    count += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {_format_value(count)}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(count)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
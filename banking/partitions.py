@@ -0,0 +1,150 @@
+# coding=utf-8
+
+import os
+from multiprocessing import Process, Queue
+from queue import Empty
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.persistence import (
+    Cipher, Compressor, DatetimeAsISO, DecimalAsStr, Mapper, Notification, Transcoder, UUIDAsHex,
+)
+
+from banking.transcoding import CompactTranscoder
+
+StoredState = Tuple[UUID, str, bytes]  # originator id, topic, state
+
+
+def pages(
+        app: Application,
+        topics: Sequence[str],
+        position: int = 0,
+        page_size: int = 1000,
+) -> Iterator[Tuple[List[Notification], int]]:
+    """
+    Pages of the notifications with the given topics recorded after
+    ``position``, up to the last one recorded when it is called, each with
+    the position that reading it takes the reader to. The last position is
+    that of the last notification recorded, whatever its topic.
+    """
+    max_notification_id = app.recorder.max_notification_id()
+    while position < max_notification_id:
+        notifications = app.recorder.select_notifications(
+            start=position + 1,
+            limit=page_size,
+            stop=max_notification_id,
+            topics=topics,
+        )
+        if len(notifications) < page_size:
+            position = max_notification_id
+        else:
+            position = notifications[-1].id
+        yield notifications, position
+
+
+def scan(app: Application, topics: Sequence[str], page_size: int = 1000) -> Iterator[List[StoredState]]:
+    """Pages of the stored state of the events with the given topics, in the order they were recorded."""
+    for notifications, _ in pages(app, topics, page_size=page_size):
+        if notifications:
+            yield [(n.originator_id, n.topic, n.state) for n in notifications]
+
+
+def sqlite_dbname(env: Mapping[str, str], name: str, suffix: str) -> Optional[str]:
+    """
+    The SQLite database named by ``name`` in ``env``, or else one named
+    with the suffix next to the SQLite event store, if there is one, so
+    that workers sharing the store share it too. None if there isn't
+    one, or ``name`` is set empty.
+    """
+    dbname = env.get(name)
+    sqlite_dbname = env.get("SQLITE_DBNAME", "")
+    if dbname is None and env.get("PERSISTENCE_MODULE") == "eventsourcing.sqlite" \
+            and sqlite_dbname and ":memory:" not in sqlite_dbname:
+        root, ext = os.path.splitext(sqlite_dbname)
+        dbname = f"{root}-{suffix}{ext}"
+    return dbname or None
+
+
+def transcoder() -> Transcoder:
+    """A transcoder for worker processes, since they don't pickle. Reading either encoding needs no settings."""
+    compact_transcoder = CompactTranscoder()
+    for transcoding in (UUIDAsHex(), DecimalAsStr(), DatetimeAsISO()):
+        compact_transcoder.register(transcoding)
+    return compact_transcoder
+
+
+class StateDecoder:
+    """
+    Decodes the stored state of events as the application's mapper does,
+    decrypting and decompressing it first if the mapper would, but
+    without making domain events of it. Worker processes are given the
+    compressor and cipher, and make one with a transcoder of their own.
+    """
+
+    def __init__(
+            self,
+            transcoder: Transcoder,
+            compressor: Optional[Compressor] = None,
+            cipher: Optional[Cipher] = None,
+    ):
+        self.transcoder = transcoder
+        self.compressor = compressor
+        self.cipher = cipher
+
+    @classmethod
+    def from_mapper(cls, mapper: Mapper) -> "StateDecoder":
+        return cls(mapper.transcoder, mapper.compressor, mapper.cipher)
+
+    def decode(self, state: bytes) -> Dict[str, Any]:
+        if self.cipher is not None:
+            state = self.cipher.decrypt(state)
+        if self.compressor is not None:
+            state = self.compressor.decompress(state)
+        return self.transcoder.decode(state)
+
+
+def run_partitioned(
+        pages: Iterable[List[StoredState]],
+        target: Callable[..., None],
+        args: Tuple[Any, ...],
+        workers: int,
+        queue_size: int = 16,
+        poll_interval: float = 1.0,
+) -> List[Any]:
+    """
+    Run ``target(queue, results, n, *args)`` in each of ``workers``
+    processes, numbered ``n``, putting on its queue, which is bounded,
+    the stored events of its partition of the originators, in order,
+    then None. A slow worker holds the reader back instead of a backlog
+    building up. Returns what each worker put on ``results``, in no
+    particular order.
+    """
+    queues: "List[Queue[Optional[List[StoredState]]]]" = [Queue(queue_size) for _ in range(workers)]
+    results: "Queue[Any]" = Queue()
+    processes = [
+        Process(target=target, args=(queue, results, n, *args), daemon=True) for n, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for page in pages:
+            partitions: List[List[StoredState]] = [[] for _ in queues]
+            for stored_state in page:
+                partitions[stored_state[0].int % workers].append(stored_state)
+            for queue, partition in zip(queues, partitions):
+                if partition:
+                    queue.put(partition)
+    finally:
+        for queue in queues:
+            queue.put(None)
+    returned: List[Any] = []
+    while len(returned) < workers:
+        try:
+            returned.append(results.get(timeout=poll_interval))
+        except Empty:
+            if any(process.exitcode for process in processes):
+                raise RuntimeError("A worker process failed, see its traceback above")
+    for process in processes:
+        process.join()
+    return returned
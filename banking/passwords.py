@@ -0,0 +1,138 @@
+# coding=utf-8
+
+import hmac
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import scrypt, sha256, sha512
+from threading import Lock
+from typing import Mapping, Optional
+
+SCRYPT_PREFIX = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 64
+
+
+def legacy_hash(password: str) -> str:
+    """The original unsalted sha512 hex digest."""
+    return sha512(password.encode()).hexdigest()
+
+
+def scrypt_hash(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=128 * r * (n + p + 2) + 1024 * 1024,
+        dklen=KEY_BYTES,
+    )
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Check a password against a scrypt or legacy sha512 hash."""
+    if password_hash.startswith(SCRYPT_PREFIX + "$"):
+        _, n, r, p, salt, key = password_hash.split("$")
+        expected = scrypt_hash(password, bytes.fromhex(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(expected, bytes.fromhex(key))
+    return hmac.compare_digest(legacy_hash(password), password_hash)
+
+
+class PasswordHasher:
+    """
+    Salted scrypt password hashing with configurable cost.
+    The cost parameters are stored in each hash, so hashes
+    made with other settings (and legacy sha512 hashes)
+    still verify, and needs_rehash() says which to upgrade.
+    Hashing runs on a bounded thread pool, which caps the
+    memory scrypt can use at once, and successful checks
+    are remembered for a short time so that repeating the
+    same credentials doesn't pay for the KDF again.
+    """
+
+    PASSWORD_SCRYPT_N = "PASSWORD_SCRYPT_N"
+    PASSWORD_SCRYPT_R = "PASSWORD_SCRYPT_R"
+    PASSWORD_SCRYPT_P = "PASSWORD_SCRYPT_P"
+    PASSWORD_HASH_WORKERS = "PASSWORD_HASH_WORKERS"
+    PASSWORD_VERIFIED_TTL = "PASSWORD_VERIFIED_TTL"
+
+    verified_maxsize = 10000
+
+    def __init__(
+            self,
+            n: int = 2 ** 14,
+            r: int = 8,
+            p: int = 1,
+            workers: Optional[int] = None,
+            verified_ttl: float = 60.0,
+    ):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self.verified_ttl = verified_ttl
+        self.verified: "OrderedDict[bytes, float]" = OrderedDict()
+        self.verified_key = os.urandom(32)
+        self.lock = Lock()
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> "PasswordHasher":
+        workers = env.get(cls.PASSWORD_HASH_WORKERS)
+        return cls(
+            n=int(env.get(cls.PASSWORD_SCRYPT_N, 2 ** 14)),
+            r=int(env.get(cls.PASSWORD_SCRYPT_R, 8)),
+            p=int(env.get(cls.PASSWORD_SCRYPT_P, 1)),
+            workers=int(workers) if workers else None,
+            verified_ttl=float(env.get(cls.PASSWORD_VERIFIED_TTL, 60.0)),
+        )
+
+    def hash(self, password: str) -> str:
+        return self.hash_async(password).result()
+
+    def hash_async(self, password: str) -> "Future[str]":
+        return self.executor.submit(self._hash, password)
+
+    def _hash(self, password: str) -> str:
+        salt = os.urandom(SALT_BYTES)
+        key = scrypt_hash(password, salt, self.n, self.r, self.p)
+        return f"{SCRYPT_PREFIX}${self.n}${self.r}${self.p}${salt.hex()}${key.hex()}"
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        return self.verify_async(password, password_hash).result()
+
+    def verify_async(self, password: str, password_hash: str) -> "Future[bool]":
+        token = hmac.new(self.verified_key, f"{password_hash}\0{password}".encode(), sha256).digest()
+        if self._recently_verified(token):
+            future: "Future[bool]" = Future()
+            future.set_result(True)
+            return future
+        return self.executor.submit(self._verify, password, password_hash, token)
+
+    def _verify(self, password: str, password_hash: str, token: bytes) -> bool:
+        if not verify_password(password, password_hash):
+            return False
+        if self.verified_ttl > 0:
+            with self.lock:
+                self.verified[token] = time.monotonic() + self.verified_ttl
+                self.verified.move_to_end(token)
+                if len(self.verified) > self.verified_maxsize:
+                    self.verified.popitem(last=False)
+        return True
+
+    def _recently_verified(self, token: bytes) -> bool:
+        with self.lock:
+            expires = self.verified.get(token)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self.verified[token]
+                return False
+            return True
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return not password_hash.startswith(f"{SCRYPT_PREFIX}${self.n}${self.r}${self.p}$")
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,94 @@
+# coding=utf-8
+
+import random
+import time
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Dict, Mapping, TypeVar, cast
+
+from eventsourcing.persistence import IntegrityError
+
+TCommand = TypeVar("TCommand", bound=Callable[..., Any])
+
+
+class RecordingConflict(IntegrityError):
+    """
+    Another writer recorded events for one of the aggregates first, so
+    none of the command's events were recorded and it can run again.
+    Conflicts after the events are recorded, such as a snapshot that
+    was already taken, are not this, and are never retried.
+    """
+
+
+class RetryPolicy:
+    """
+    Bounded retries with jittered exponential backoff for commands
+    that lose an optimistic concurrency race. Each retry waits a
+    random time between zero and backoff * 2 ** (retry - 1), capped
+    at backoff_max, so writers contending for the same account
+    spread out instead of colliding again in lockstep. It also
+    counts commands, conflicts, retries and exhausted commands.
+    """
+
+    COMMAND_MAX_ATTEMPTS = "COMMAND_MAX_ATTEMPTS"
+    COMMAND_RETRY_BACKOFF = "COMMAND_RETRY_BACKOFF"
+    COMMAND_RETRY_BACKOFF_MAX = "COMMAND_RETRY_BACKOFF_MAX"
+
+    def __init__(self, max_attempts: int = 5, backoff: float = 0.002, backoff_max: float = 0.1):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.commands = 0
+        self.conflicts = 0
+        self.retries = 0
+        self.exhausted = 0
+        self.stats_lock = Lock()
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> "RetryPolicy":
+        return cls(
+            max_attempts=int(env.get(cls.COMMAND_MAX_ATTEMPTS, 5)),
+            backoff=float(env.get(cls.COMMAND_RETRY_BACKOFF, 0.002)),
+            backoff_max=float(env.get(cls.COMMAND_RETRY_BACKOFF_MAX, 0.1)),
+        )
+
+    def delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (retry - 1)))
+
+    def run(self, command: Callable[[], Any]) -> Any:
+        with self.stats_lock:
+            self.commands += 1
+        attempt = 1
+        while True:
+            try:
+                return command()
+            except RecordingConflict:
+                with self.stats_lock:
+                    self.conflicts += 1
+                    if attempt >= self.max_attempts:
+                        self.exhausted += 1
+                        raise
+                    self.retries += 1
+                time.sleep(self.delay(attempt))
+                attempt += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self.stats_lock:
+            return {
+                "commands": self.commands,
+                "conflicts": self.conflicts,
+                "retries": self.retries,
+                "exhausted": self.exhausted,
+                "conflict_rate": self.conflicts / self.commands if self.commands else 0.0,
+            }
+
+
+def retry_on_conflict(command: TCommand) -> TCommand:
+    """
+    Run a command again, from a fresh load of its accounts, when
+    another writer saved one of them first (optimistic concurrency).
+    """
+    @wraps(command)
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        return self.retry_policy.run(lambda: command(self, *args, **kwargs))
+    return cast(TCommand, wrapper)
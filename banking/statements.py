@@ -0,0 +1,215 @@
+# coding=utf-8
+
+import csv
+import json
+import os
+import time
+from datetime import datetime, timezone
+from multiprocessing import Queue
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from eventsourcing.application import Application
+from eventsourcing.persistence import Cipher, Compressor
+from eventsourcing.utils import get_topic
+
+from banking import partitions
+from banking.domainmodel import Account
+from banking.partitions import StateDecoder, StoredState
+from banking.transcoding import stored_topics
+
+OPENED, CREDITED, DEBITED, CLOSED = range(4)
+KINDS = {
+    topic: kind
+    for kind, cls in enumerate([Account.Opened, Account.Credited, Account.Debited, Account.Closed])  # type: ignore
+    for topic in stored_topics(get_topic(cls))
+}
+FORMATS = ("csv", "jsonl")
+
+
+class Statement(NamedTuple):
+    account_id: UUID
+    opening_balance: int
+    credits: int
+    debits: int
+    credit_count: int
+    debit_count: int
+    closing_balance: int
+    closed: bool
+
+
+class StatementRun(NamedTuple):
+    accounts: int
+    events: int
+    seconds: float
+    paths: List[str]
+
+    @property
+    def accounts_per_second(self) -> float:
+        return self.accounts / self.seconds if self.seconds else 0.0
+
+
+class StatementPartition:
+    """
+    Statement totals of one partition of the accounts, for a period
+    from ``since`` (inclusive) until ``until`` (exclusive), folded from
+    the stored state of their Opened, Credited, Debited and Closed
+    events in the order they were recorded. Only a few integers are
+    kept per account, and nothing per event.
+    """
+
+    def __init__(self, decoder: StateDecoder, since: datetime, until: datetime):
+        self.decoder = decoder
+        self.since = since
+        self.until = until
+        # Opening balance, credits, debits, credit count, debit count, closed.
+        self.totals: Dict[UUID, List[int]] = {}
+        self.events = 0
+
+    def add(self, stored_states: Iterable[StoredState]) -> None:
+        for account_id, topic, state in stored_states:
+            self.events += 1
+            kind = KINDS[topic]
+            decoded = self.decoder.decode(state)
+            if decoded["timestamp"] >= self.until:
+                continue
+            if kind == OPENED:
+                self.totals[account_id] = [0, 0, 0, 0, 0, 0]
+                continue
+            totals = self.totals.get(account_id)
+            if totals is None:
+                # Opened after the period, by a clock behind this event's.
+                continue
+            if kind == CLOSED:
+                totals[5] = 1
+            elif decoded["timestamp"] < self.since:
+                totals[0] += decoded["amount_in_cents"] if kind == CREDITED else -decoded["amount_in_cents"]
+            elif kind == CREDITED:
+                totals[1] += decoded["amount_in_cents"]
+                totals[3] += 1
+            else:
+                totals[2] += decoded["amount_in_cents"]
+                totals[4] += 1
+
+    def statements(self) -> Iterator[Statement]:
+        for account_id, (opening, credits, debits, credit_count, debit_count, closed) in self.totals.items():
+            yield Statement(
+                account_id, opening, credits, debits, credit_count, debit_count, opening + credits - debits,
+                bool(closed),
+            )
+
+    def write(self, path: str, format: str) -> int:
+        """Write out the statements one line at a time, returning how many were written."""
+        count = 0
+        with open(path, "w", newline="") as f:
+            if format == "csv":
+                writer = csv.writer(f)
+                writer.writerow(Statement._fields)
+                for statement in self.statements():
+                    writer.writerow(statement)
+                    count += 1
+            else:
+                for statement in self.statements():
+                    f.write(json.dumps({**statement._asdict(), "account_id": str(statement.account_id)}) + "\n")
+                    count += 1
+        return count
+
+
+def _run_partition(
+        queue: "Queue[Optional[List[StoredState]]]",
+        results: "Queue[Tuple[int, int]]",
+        n: int,
+        since: datetime,
+        until: datetime,
+        paths: List[str],
+        format: str,
+        compressor: Optional[Compressor],
+        cipher: Optional[Cipher],
+) -> None:
+    partition = StatementPartition(StateDecoder(partitions.transcoder(), compressor, cipher), since, until)
+    for stored_states in iter(queue.get, None):
+        partition.add(stored_states)
+    results.put((partition.write(paths[n], format), partition.events))
+
+
+class StatementJob:
+    """
+    Month-end statements for every account: the opening and closing
+    balance, and the total and number of credits and debits, over a
+    period. The notification log is read once, in order, a page at a
+    time, and each account's events are sent to the worker process
+    that owns its partition of the accounts, through a bounded queue,
+    so a slow worker holds the reader back instead of a backlog
+    building up. Workers decode the events and keep just a few totals
+    per account, then each streams its statements to a file of its
+    own. With no workers, it is all done in this process.
+    """
+
+    STATEMENT_WORKERS = "STATEMENT_WORKERS"
+
+    page_size = 1000
+    queue_size = 16
+    poll_interval = 1.0
+    topics = list(KINDS)
+
+    def __init__(self, app: Application, workers: int = 0):
+        self.app = app
+        self.workers = workers
+
+    @classmethod
+    def from_env(cls, app: Application, env: Mapping[str, str]) -> "StatementJob":
+        return cls(app, workers=int(env.get(cls.STATEMENT_WORKERS) or os.cpu_count() or 1))
+
+    def run(self, since: datetime, until: datetime, directory: str, format: str = "csv") -> StatementRun:
+        """Write statements for the period from ``since`` until ``until`` (exclusive) into ``directory``."""
+        if format not in FORMATS:
+            raise ValueError(f"Unknown statement format: {format} (expected one of {', '.join(FORMATS)})")
+        started = time.perf_counter()
+        os.makedirs(directory, exist_ok=True)
+        paths = [os.path.join(directory, f"statements-{n}.{format}") for n in range(max(self.workers, 1))]
+        if self.workers <= 0:
+            partition = StatementPartition(StateDecoder.from_mapper(self.app.mapper), since, until)
+            for stored_states in self.scan():
+                partition.add(stored_states)
+            results = [(partition.write(paths[0], format), partition.events)]
+        else:
+            results = self.run_workers(since, until, paths, format)
+        return StatementRun(
+            accounts=sum(accounts for accounts, _ in results),
+            events=sum(events for _, events in results),
+            seconds=time.perf_counter() - started,
+            paths=paths,
+        )
+
+    def run_workers(self, since: datetime, until: datetime, paths: List[str], format: str) -> List[Tuple[int, int]]:
+        args = (since, until, paths, format, self.app.mapper.compressor, self.app.mapper.cipher)
+        return partitions.run_partitioned(
+            self.scan(), _run_partition, args, len(paths), self.queue_size, self.poll_interval,
+        )
+
+    def scan(self) -> Iterator[List[StoredState]]:
+        """Pages of the stored state of account events, in the order they were recorded."""
+        return partitions.scan(self.app, self.topics, self.page_size)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from banking.applicationmodel import Bank
+
+    def timestamp(value: str) -> datetime:
+        parsed = datetime.fromisoformat(value)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+    parser = argparse.ArgumentParser(description="Write statements for every account over a period.")
+    parser.add_argument("--since", type=timestamp, required=True, help="start of the period, ISO 8601")
+    parser.add_argument("--until", type=timestamp, required=True, help="end of the period (exclusive), ISO 8601")
+    parser.add_argument("--directory", default="statements")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    args = parser.parse_args()
+
+    bank = Bank()
+    run = StatementJob.from_env(bank, os.environ).run(args.since, args.until, args.directory, args.format)
+    print(f"{run.accounts} statements from {run.events} events in {run.seconds:.1f}s"
+          f" ({run.accounts_per_second:.0f} accounts/s): {', '.join(run.paths)}")
+    bank.close()
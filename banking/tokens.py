@@ -0,0 +1,61 @@
+# coding=utf-8
+
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from typing import Any, Callable, Dict, Generic, Mapping, Tuple, TypeVar
+
+TIdentity = TypeVar("TIdentity")
+
+
+class VerifiedTokens(Generic[TIdentity]):
+    """
+    The identities of recently verified tokens, so that a token seen
+    again costs a hash and a lookup instead of a decode and an HMAC.
+    Tokens are kept by digest, not as they are, and each is forgotten
+    at its exp, after which it is decoded again, and refused. Tokens
+    without an exp aren't remembered. Decoding raises the same errors
+    as ``decode``.
+    """
+
+    JWT_VERIFIED_CACHE_MAXSIZE = "JWT_VERIFIED_CACHE_MAXSIZE"
+
+    def __init__(
+            self,
+            decode: Callable[[str], Dict[str, Any]],
+            identity: Callable[[Dict[str, Any]], TIdentity],
+            maxsize: int = 100000,
+    ):
+        self.decode = decode
+        self.make_identity = identity
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[bytes, Tuple[TIdentity, float]]" = OrderedDict()
+        self.lock = Lock()
+
+    @classmethod
+    def from_env(
+            cls,
+            decode: Callable[[str], Dict[str, Any]],
+            identity: Callable[[Dict[str, Any]], TIdentity],
+            env: Mapping[str, str],
+    ) -> "VerifiedTokens[TIdentity]":
+        return cls(decode, identity, maxsize=int(env.get(cls.JWT_VERIFIED_CACHE_MAXSIZE, 100000)))
+
+    def identity(self, token: str) -> TIdentity:
+        key = sha256(token.encode()).digest()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] > time.time():
+                    self.entries.move_to_end(key)
+                    return entry[0]
+                del self.entries[key]
+        payload = self.decode(token)
+        identity = self.make_identity(payload)
+        if self.maxsize > 0 and isinstance(payload.get("exp"), (int, float)):
+            with self.lock:
+                self.entries[key] = (identity, payload["exp"])
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return identity
@@ -0,0 +1,379 @@
+# coding=utf-8
+
+import lzma
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+from uuid import UUID
+
+from eventsourcing.domain import DomainEventProtocol
+from eventsourcing.persistence import JSONTranscoder, Mapper, StoredEvent, Transcoder, Transcoding
+from eventsourcing.utils import get_topic, register_topic
+
+from banking.domainmodel import Account, Transfer
+
+# Short codes stored instead of the topics of the commonest events. Both
+# forms are resolved, so a code must never be changed or reused.
+TOPIC_CODES: Dict[str, str] = {}
+for _cls, _code in [
+    (Account.Opened, "AO"),  # type: ignore
+    (Account.Credited, "AC"),  # type: ignore
+    (Account.Debited, "AD"),  # type: ignore
+    (Account.Closed, "AX"),  # type: ignore
+    (Account.PasswordChanged, "AP"),  # type: ignore
+    (Account.OverdraftSet, "AL"),  # type: ignore
+    (Account.PasswordHashChanged, "AH"),  # type: ignore
+    (Transfer.Made, "TM"),  # type: ignore
+]:
+    TOPIC_CODES[get_topic(_cls)] = _code
+    register_topic(_code, _cls)
+
+# Strings that are written as their position in this list, mostly
+# field names. It may be appended to, but never otherwise changed.
+WORDS: List[str] = [
+    "timestamp",
+    "originator_topic",
+    "full_name",
+    "email_address",
+    "password",
+    "amount_in_cents",
+    "counterparty_id",
+    "transfer_id",
+    "old_password",
+    "new_password",
+    "password_hash",
+    "debit_account_id",
+    "credit_account_id",
+    "id",
+    "topic",
+    "state",
+    "_created_on",
+    "_modified_on",
+    "balance",
+    "closed",
+    "overdraft_limit",
+    "account_version",
+    get_topic(Account),
+    get_topic(Transfer),
+    "banking.balances:AccountBalance",
+]
+WORD_CODES = {word: code for code, word in enumerate(WORDS, start=1)}
+
+# Tags of the values in compact state.
+NONE, FALSE, TRUE, INT, STR, WORD, UUID_, UTC_DATETIME, DATETIME, DICT, LIST, FLOAT, DECIMAL = range(13)
+
+# The first byte of compact state, which JSON state never starts with.
+RAW, ZLIB, LZMA = 1, 2, 3
+# Headerless streams, since every byte counts in state this small, and a
+# small LZMA dictionary, since a large one costs more to set up than to use.
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 9, "dict_size": 1 << 16}]
+COMPRESSORS: Dict[str, Tuple[int, Callable[[bytes], bytes]]] = {
+    "zlib": (ZLIB, lambda data: _deflate(data)),
+    "lzma": (LZMA, lambda data: lzma.compress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)),
+}
+# State smaller than this is rarely made smaller by compressing it.
+COMPRESSION_MIN_SIZE = 64
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+INT64 = struct.Struct("<q")
+DOUBLE = struct.Struct("<d")
+
+
+def stored_topics(*topics: str) -> List[str]:
+    """The given topics in each of the forms they may be stored in."""
+    return [*topics, *(TOPIC_CODES[topic] for topic in topics if topic in TOPIC_CODES)]
+
+
+class CompactTranscoder(Transcoder):
+    """
+    Binary encoding of event state: UUIDs as their 16 bytes, integers
+    and UTC timestamps as variable-length integers, and known field
+    names and topics as small numbers, optionally compressed when that
+    makes it smaller. It reads state written by the JSON transcoder
+    too, so a store can be switched either way, and unless told to be
+    compact it writes JSON, exactly as before.
+    """
+
+    EVENT_TRANSCODER = "EVENT_TRANSCODER"
+    EVENT_COMPRESSION = "EVENT_COMPRESSION"
+
+    def __init__(self, compact: bool = True, compression: Optional[str] = None):
+        super().__init__()
+        if compression and compression not in COMPRESSORS:
+            raise ValueError(f"Unknown compression: {compression} (expected one of {', '.join(COMPRESSORS)})")
+        self.compact = compact
+        self.compression = compression or None
+        self.json = JSONTranscoder()
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> "CompactTranscoder":
+        encoding = env.get(cls.EVENT_TRANSCODER) or "json"
+        if encoding not in ("json", "compact"):
+            raise ValueError(f"Unknown event transcoder: {encoding} (expected json or compact)")
+        return cls(compact=encoding == "compact", compression=env.get(cls.EVENT_COMPRESSION))
+
+    def register(self, transcoding: Transcoding) -> None:
+        super().register(transcoding)
+        self.json.register(transcoding)
+
+    def encode(self, obj: Any) -> bytes:
+        if not self.compact:
+            return self.json.encode(obj)
+        out = bytearray([RAW])
+        _encode(obj, out)
+        if self.compression and len(out) > COMPRESSION_MIN_SIZE:
+            flag, compress = COMPRESSORS[self.compression]
+            compressed = compress(out[1:])
+            if len(compressed) + 1 < len(out):
+                return bytes([flag]) + compressed
+        return bytes(out)
+
+    def decode(self, data: bytes) -> Any:
+        flag = data[0]
+        if flag == RAW:
+            return _decode(data, 1)[0]
+        elif flag == ZLIB:
+            return _decode(zlib.decompress(data[1:], -zlib.MAX_WBITS), 0)[0]
+        elif flag == LZMA:
+            return _decode(lzma.decompress(data[1:], format=lzma.FORMAT_RAW, filters=LZMA_FILTERS), 0)[0]
+        return self.json.decode(data)
+
+
+class CompactMapper(Mapper):
+    """Mapper that stores the codes of topics that have them."""
+
+    def to_stored_event(self, domain_event: DomainEventProtocol) -> StoredEvent:
+        stored_event = super().to_stored_event(domain_event)
+        code = TOPIC_CODES.get(stored_event.topic)
+        if code is not None:
+            object.__setattr__(stored_event, "topic", code)
+        return stored_event
+
+
+def _deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _write_uint(out: bytearray, n: int) -> None:
+    if n < 0x80:
+        out.append(n)
+        return
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _write_str(out: bytearray, value: str) -> None:
+    encoded = value.encode()
+    _write_uint(out, len(encoded))
+    out += encoded
+
+
+def _read_uint(data: bytes, pos: int) -> Tuple[int, int]:
+    n = data[pos]
+    if n < 0x80:
+        return n, pos + 1
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _read_str(data: bytes, pos: int) -> Tuple[str, int]:
+    length, pos = _read_uint(data, pos)
+    return data[pos:pos + length].decode(), pos + length
+
+
+def _encode(obj: Any, out: bytearray) -> None:
+    try:
+        encoder = ENCODERS[type(obj)]
+    except KeyError:
+        for cls, encoder in ENCODERS.items():
+            if isinstance(obj, cls):
+                break
+        else:
+            raise TypeError(f"Object of type {type(obj).__name__} can't be encoded by the compact transcoder")
+    encoder(obj, out)
+
+
+def _encode_none(obj: None, out: bytearray) -> None:
+    out.append(NONE)
+
+
+def _encode_bool(obj: bool, out: bytearray) -> None:
+    out.append(TRUE if obj else FALSE)
+
+
+def _encode_int(obj: int, out: bytearray) -> None:
+    out.append(INT)
+    _write_uint(out, obj << 1 if obj >= 0 else (-obj << 1) - 1)
+
+
+def _encode_str(obj: str, out: bytearray) -> None:
+    code = WORD_CODES.get(obj)
+    if code:
+        out.append(WORD)
+        _write_uint(out, code)
+    else:
+        out.append(STR)
+        _write_str(out, obj)
+
+
+def _encode_uuid(obj: UUID, out: bytearray) -> None:
+    out.append(UUID_)
+    out += obj.bytes
+
+
+def _encode_datetime(obj: datetime, out: bytearray) -> None:
+    if obj.tzinfo is not None and not obj.utcoffset():
+        out.append(UTC_DATETIME)
+        out += INT64.pack((obj - EPOCH) // MICROSECOND)
+    else:
+        out.append(DATETIME)
+        _write_str(out, obj.isoformat())
+
+
+def _encode_dict(obj: Dict[str, Any], out: bytearray) -> None:
+    out.append(DICT)
+    _write_uint(out, len(obj))
+    for key, value in obj.items():
+        code = WORD_CODES.get(key, 0)
+        _write_uint(out, code)
+        if not code:
+            _write_str(out, key)
+        _encode(value, out)
+
+
+def _encode_list(obj: List[Any], out: bytearray) -> None:
+    out.append(LIST)
+    _write_uint(out, len(obj))
+    for value in obj:
+        _encode(value, out)
+
+
+def _encode_float(obj: float, out: bytearray) -> None:
+    out.append(FLOAT)
+    out += DOUBLE.pack(obj)
+
+
+def _encode_decimal(obj: Decimal, out: bytearray) -> None:
+    out.append(DECIMAL)
+    _write_str(out, str(obj))
+
+
+# By exact type, then (for subclasses) in this order.
+ENCODERS: Dict[type, Callable[[Any, bytearray], None]] = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    str: _encode_str,
+    UUID: _encode_uuid,
+    datetime: _encode_datetime,
+    dict: _encode_dict,
+    list: _encode_list,
+    tuple: _encode_list,
+    float: _encode_float,
+    Decimal: _encode_decimal,
+}
+
+
+def _decode(data: bytes, pos: int) -> Tuple[Any, int]:
+    tag = data[pos]
+    try:
+        decoder = DECODERS[tag]
+    except IndexError:
+        raise ValueError(f"Invalid tag {tag} at position {pos} of compact state")
+    return decoder(data, pos + 1)
+
+
+def _decode_none(data: bytes, pos: int) -> Tuple[None, int]:
+    return None, pos
+
+
+def _decode_false(data: bytes, pos: int) -> Tuple[bool, int]:
+    return False, pos
+
+
+def _decode_true(data: bytes, pos: int) -> Tuple[bool, int]:
+    return True, pos
+
+
+def _decode_int(data: bytes, pos: int) -> Tuple[int, int]:
+    n, pos = _read_uint(data, pos)
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def _decode_word(data: bytes, pos: int) -> Tuple[str, int]:
+    code, pos = _read_uint(data, pos)
+    return WORDS[code - 1], pos
+
+
+def _decode_uuid(data: bytes, pos: int) -> Tuple[UUID, int]:
+    return UUID(bytes=bytes(data[pos:pos + 16])), pos + 16
+
+
+def _decode_utc_datetime(data: bytes, pos: int) -> Tuple[datetime, int]:
+    return EPOCH + timedelta(microseconds=INT64.unpack_from(data, pos)[0]), pos + INT64.size
+
+
+def _decode_datetime(data: bytes, pos: int) -> Tuple[datetime, int]:
+    value, pos = _read_str(data, pos)
+    return datetime.fromisoformat(value), pos
+
+
+def _decode_dict(data: bytes, pos: int) -> Tuple[Dict[str, Any], int]:
+    length, pos = _read_uint(data, pos)
+    obj = {}
+    for _ in range(length):
+        code, pos = _read_uint(data, pos)
+        if code:
+            key = WORDS[code - 1]
+        else:
+            key, pos = _read_str(data, pos)
+        obj[key], pos = _decode(data, pos)
+    return obj, pos
+
+
+def _decode_list(data: bytes, pos: int) -> Tuple[List[Any], int]:
+    length, pos = _read_uint(data, pos)
+    values = []
+    for _ in range(length):
+        value, pos = _decode(data, pos)
+        values.append(value)
+    return values, pos
+
+
+def _decode_float(data: bytes, pos: int) -> Tuple[float, int]:
+    return DOUBLE.unpack_from(data, pos)[0], pos + DOUBLE.size
+
+
+def _decode_decimal(data: bytes, pos: int) -> Tuple[Decimal, int]:
+    value, pos = _read_str(data, pos)
+    return Decimal(value), pos
+
+
+# By tag.
+DECODERS: List[Callable[[bytes, int], Tuple[Any, int]]] = [
+    _decode_none,
+    _decode_false,
+    _decode_true,
+    _decode_int,
+    _read_str,
+    _decode_word,
+    _decode_uuid,
+    _decode_utc_datetime,
+    _decode_datetime,
+    _decode_dict,
+    _decode_list,
+    _decode_float,
+    _decode_decimal,
+]
@@ -0,0 +1,75 @@
+# coding=utf-8
+
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
+from threading import Thread
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+ApplyPostings = Callable[[Sequence[Dict[str, Any]]], List[Optional[Exception]]]
+Pending = Tuple[Dict[str, Any], "Future[None]"]
+
+
+class AccountWriter:
+    """
+    Single writer per account. Postings are routed to one of a fixed
+    number of shards by account id, and each shard has one thread that
+    applies its postings in order. Whatever is waiting when a shard
+    thread wakes up is applied together, so a burst of credits to a
+    hot account costs one load and one save instead of one each, and
+    no two threads race to save the same account.
+
+    A transfer is routed by its debit account. If its credit account
+    lives on another shard, that save can still conflict, in which case
+    the postings applied with it fail with the conflict and can be
+    retried by the caller.
+    """
+
+    max_batch = 1000
+
+    def __init__(self, apply_postings: ApplyPostings, shards: int):
+        self.apply_postings = apply_postings
+        self.queues: List["SimpleQueue[Optional[Pending]]"] = [SimpleQueue() for _ in range(shards)]
+        self.threads = [
+            Thread(target=self.run, args=(queue,), name=f"account-writer-{n}", daemon=True)
+            for n, queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, account_id: UUID, posting: Dict[str, Any]) -> "Future[None]":
+        future: "Future[None]" = Future()
+        self.queues[account_id.int % len(self.queues)].put((posting, future))
+        return future
+
+    def run(self, queue: "SimpleQueue[Optional[Pending]]") -> None:
+        while True:
+            pending = [queue.get()]
+            while pending[-1] is not None and len(pending) < self.max_batch:
+                try:
+                    pending.append(queue.get_nowait())
+                except Empty:
+                    break
+            stopping = pending[-1] is None
+            batch = [item for item in pending if item is not None]
+            if batch:
+                self.apply(batch)
+            if stopping:
+                return
+
+    def apply(self, batch: List[Pending]) -> None:
+        try:
+            errors = self.apply_postings([posting for posting, _ in batch])
+        except Exception as e:
+            errors = [e] * len(batch)
+        for (_, future), error in zip(batch, errors):
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def close(self) -> None:
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,141 @@
+# coding=utf-8
+"""
+Bank-wide daily aggregates over 30 days of postings to 10k accounts
+with overdraft limits, from an on-disk SQLite store: LedgerAnalytics
+(load into columns, then vectorized group-bys) against a Python loop
+over each account's events, whose results it checks against.
+
+    python -m benchmarks.bench_analytics
+"""
+import os
+import random
+import tempfile
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+from unittest.mock import patch
+from uuid import UUID, uuid4
+
+from banking.analytics import UTILIZATION_BINS, DailyAggregates
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+
+ACCOUNTS = 10000
+DAYS = 30
+POSTINGS_PER_DAY = 10000
+BATCH_SIZE = 1000
+BUCKETS = len(UTILIZATION_BINS) + 1
+
+
+def python_daily(bank: Bank, account_ids: List[UUID]) -> Dict[date, Tuple[int, int, List[int]]]:
+    """Credits, debits and overdraft buckets at the end of each day, one account at a time."""
+    bins = UTILIZATION_BINS.tolist()
+    credits: Dict[date, int] = defaultdict(int)
+    debits: Dict[date, int] = defaultdict(int)
+    changes: Dict[date, List[int]] = defaultdict(lambda: [0] * BUCKETS)
+    for account_id in account_ids:
+        balance = limit = 0
+        buckets: Dict[date, int] = {}
+        for event in bank.events.get(account_id):
+            day = event.timestamp.date()
+            if isinstance(event, Account.Credited):  # type: ignore
+                balance += event.amount_in_cents
+                credits[day] += event.amount_in_cents
+            elif isinstance(event, Account.Debited):  # type: ignore
+                balance -= event.amount_in_cents
+                debits[day] += event.amount_in_cents
+            elif isinstance(event, Account.OverdraftSet):  # type: ignore
+                limit = event.amount_in_cents
+            else:
+                continue
+            buckets[day] = -1 if balance >= 0 else bisect_left(bins, -balance / limit if limit else float("inf"))
+        previous = -1
+        for day, bucket in buckets.items():
+            if bucket != previous:
+                if previous >= 0:
+                    changes[day][previous] -= 1
+                if bucket >= 0:
+                    changes[day][bucket] += 1
+            previous = bucket
+    first = min(credits.keys() | debits.keys() | changes.keys())
+    last = max(credits.keys() | debits.keys() | changes.keys())
+    daily = {}
+    counts = [0] * BUCKETS
+    day = first
+    while day <= last:
+        counts = [count + change for count, change in zip(counts, changes[day])]
+        daily[day] = (credits[day], debits[day], counts)
+        day += timedelta(days=1)
+    return daily
+
+
+def as_dict(aggregates: DailyAggregates) -> Dict[date, Tuple[int, int, List[int]]]:
+    return {
+        day: (credits, debits, utilization)
+        for day, credits, debits, utilization in zip(
+            aggregates.days.tolist(), aggregates.credits.tolist(), aggregates.debits.tolist(),
+            aggregates.utilization.tolist(),
+        )
+    }
+
+
+def main() -> None:
+    bank = Bank(env={
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+    })
+    random.seed(1)
+    now = [datetime(2026, 6, 1, tzinfo=timezone.utc)]
+    with patch.object(Account.Event, "create_timestamp", staticmethod(lambda: now[0])):
+        password = bank.passwords.hash("bench")
+        account_ids = []
+        for _ in range(0, ACCOUNTS, BATCH_SIZE):
+            accounts = [Account(uuid4(), "Bench", "bench@example.com", password) for _ in range(BATCH_SIZE)]
+            for account in accounts:
+                account.set_overdraft_limit(random.choice([0, 1000, 5000, 20000]))
+            bank.save(*accounts)
+            account_ids.extend(account.id for account in accounts)
+        for day in range(DAYS):
+            for start in range(0, POSTINGS_PER_DAY, BATCH_SIZE):
+                now[0] = datetime(2026, 6, 1, tzinfo=timezone.utc) + timedelta(days=day, seconds=start)
+                bank.apply_batch([
+                    {
+                        "type": random.choice(["deposit", "withdraw"]),
+                        "account_id": random.choice(account_ids),
+                        "amount": random.randint(1, 10000),
+                    }
+                    for _ in range(BATCH_SIZE)
+                ])
+
+    started = time.perf_counter()
+    expected = python_daily(bank, account_ids)
+    python_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    columns = bank.analytics.columns()
+    load_time = time.perf_counter() - started
+    started = time.perf_counter()
+    aggregates = bank.get_daily_aggregates()
+    compute_time = time.perf_counter() - started
+    assert as_dict(aggregates) == expected
+    # Later queries only load the events recorded since.
+    bank.apply_batch([{"type": "deposit", "account_id": account_ids[0], "amount": 1}] * BATCH_SIZE)
+    started = time.perf_counter()
+    bank.get_daily_aggregates()
+    requery_time = time.perf_counter() - started
+
+    events = len(columns.account)
+    print(f"{events} events, {ACCOUNTS} accounts, {len(aggregates.days)} days")
+    print(f"{'python loop over accounts':<28} {python_time:>8.2f} s")
+    print(f"{'LedgerAnalytics load':<28} {load_time:>8.2f} s"
+          f" ({sum(column.nbytes for column in columns) / events:.0f} bytes/event)")
+    print(f"{'LedgerAnalytics aggregate':<28} {compute_time * 1000:>8.1f} ms")
+    print(f"{'... after 1000 more events':<28} {requery_time * 1000:>8.1f} ms")
+    bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+What authenticating a request costs, before and after: flask_jwt's
+jwt_required() decoding and verifying the token every time, against
+banking.api's looking up a token it has already verified and checking
+the account is still open in the credentials read model. Each is timed
+in one request context, with the Bank in memory and in SQLite, and
+against a whole request for the account's balance.
+
+    python -m benchmarks.bench_auth
+"""
+import os
+import tempfile
+import time
+from typing import Callable
+from unittest.mock import patch
+
+from flask_jwt import _jwt_required  # type: ignore
+
+from banking import api
+from banking.applicationmodel import Bank
+from banking.tokens import VerifiedTokens
+
+REQUESTS = 20000
+
+
+def per_request(headers: dict, check: Callable[[], object], n: int = REQUESTS) -> float:
+    with api.app.test_request_context(headers=headers):
+        started = time.perf_counter()
+        for _ in range(n):
+            check()
+        return (time.perf_counter() - started) / n
+
+
+def measure(bank: Bank) -> None:
+    with patch.object(api, "bank_instance", bank):
+        bank.open_account("Bench", "bench@example.com", "bench")
+        client = api.app.test_client()
+        token = client.post("/api/v1/login", json={
+            "email_address": "bench@example.com", "password": "bench"
+        }).json["access_token"]
+        headers = {"Authorization": f"JWT {token}"}
+        realm = api.app.config["JWT_DEFAULT_REALM"]
+        header = headers["Authorization"]
+        uncached = VerifiedTokens(api.verified_tokens.decode, api.identity, maxsize=0)
+
+        account_id = bank.get_account_id_by_email("bench@example.com")
+        before = per_request(headers, lambda: _jwt_required(realm))
+        after = per_request(headers, lambda: api.authenticate_header(header))
+        lookup = per_request(headers, lambda: api.verified_tokens.identity(token))
+        closed = per_request(headers, lambda: bank.is_account_closed(account_id))
+        with patch.object(api, "verified_tokens", uncached):
+            miss = per_request(headers, lambda: api.authenticate_header(header))
+        started = time.perf_counter()
+        for _ in range(REQUESTS // 10):
+            client.get("/api/v1/account", headers=headers)
+        request_time = (time.perf_counter() - started) / (REQUESTS // 10)
+
+    print(f"{'flask_jwt decode':<28} {before * 1e6:>8.1f} us")
+    print(f"{'verified token (cached)':<28} {after * 1e6:>8.1f} us  {before / after:>5.1f}x")
+    print(f"{'  of which token lookup':<28} {lookup * 1e6:>8.1f} us")
+    print(f"{'  of which closed check':<28} {closed * 1e6:>8.1f} us")
+    print(f"{'verified token (uncached)':<28} {miss * 1e6:>8.1f} us")
+    print(f"{'GET /api/v1/account':<28} {request_time * 1e6:>8.1f} us")
+
+
+def main() -> None:
+    env = {"PASSWORD_SCRYPT_N": "1024"}
+    print("popo")
+    measure(Bank(env=env))
+    print("sqlite")
+    dbname = os.path.join(tempfile.mkdtemp(), "auth.db")
+    bank = Bank(env=dict(env, PERSISTENCE_MODULE="eventsourcing.sqlite", SQLITE_DBNAME=dbname))
+    try:
+        measure(bank)
+    finally:
+        bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# coding=utf-8
+"""
+Time to answer "what was the balance at T" for an account with a
+long history, with get_balance_at (timestamp index and snapshots)
+and by replaying the account's events from when it was opened
+until T, with T a tenth, half and nine tenths of the way through.
+
+    python -m benchmarks.bench_balance_at
+"""
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+
+EVENTS = 100000
+BATCH_SIZE = 1000
+QUERIES = 20
+
+
+def replay_balance_at(bank: Bank, account_id: UUID, at: datetime) -> int:
+    account: Optional[Account] = None
+    for event in bank.events.get(account_id):
+        if event.timestamp > at:
+            break
+        account = event.mutate(account)
+    assert account is not None
+    return account.balance
+
+
+def main() -> None:
+    bank = Bank(env={
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+    })
+    account_id = bank.open_account("Bench", "bench@example.com", "bench")
+    for _ in range(0, EVENTS, BATCH_SIZE):
+        bank.apply_batch([{"type": "deposit", "account_id": account_id, "amount": 1}] * BATCH_SIZE)
+    movements, _ = bank.get_transactions(account_id, limit=EVENTS)
+    timestamps = [movement.timestamp for movement in reversed(movements)]
+    bank.get_balance_at(account_id, timestamps[0])  # build the index
+
+    print(f"{'point':>6} {'get_balance_at ms':>18} {'replay ms':>10}")
+    for fraction in [0.1, 0.5, 0.9]:
+        # Half way between snapshots, taken every 100 events.
+        at = timestamps[int(EVENTS * fraction) + 50]
+        started = time.perf_counter()
+        for _ in range(QUERIES):
+            balance = bank.get_balance_at(account_id, at)
+        indexed = (time.perf_counter() - started) / QUERIES
+        started = time.perf_counter()
+        assert replay_balance_at(bank, account_id, at) == balance
+        replayed = time.perf_counter() - started
+        print(f"{fraction:>6.0%} {indexed * 1000:>18.2f} {replayed * 1000:>10.0f}")
+    bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# coding=utf-8
+"""
+Rebuild rate of the Balances projection from a long notification
+log, and balance-read latency from the projection against loading
+the Account, using an on-disk SQLite store.
+
+    python -m benchmarks.bench_balances
+"""
+import os
+import tempfile
+import time
+
+from banking.applicationmodel import Bank
+from banking.balances import Balances
+
+ACCOUNTS = 100
+EVENTS = 50000
+BATCH_SIZE = 1000
+READS = 1000
+
+
+def main() -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+    }
+    bank = Bank(env=env)
+    accounts = [bank.open_account("Bench", f"bench{n}@example.com", "bench") for n in range(ACCOUNTS)]
+    for start in range(0, EVENTS, BATCH_SIZE):
+        bank.apply_batch([
+            {"type": "deposit", "account_id": accounts[n % ACCOUNTS], "amount": 1}
+            for n in range(start, start + BATCH_SIZE)
+        ])
+    events = bank.recorder.max_notification_id()
+
+    # Rebuild into an empty projection database.
+    balances = Balances(env=dict(env, BALANCES_SQLITE_DBNAME=os.path.join(tempfile.mkdtemp(), "rebuild.db")))
+    balances.follow(bank.name, bank.notification_log)
+    started = time.perf_counter()
+    balances.catch_up()
+    elapsed = time.perf_counter() - started
+    print(f"rebuilt {events} events in {elapsed:.1f}s: {events / elapsed:.0f} events/s")
+
+    bank.get_balance(accounts[0])
+    for name, read in [
+        ("Bank.get_balance (projection)", lambda n: bank.get_balance(accounts[n % ACCOUNTS])),
+        ("Bank.get_account (aggregate)", lambda n: bank.get_account(accounts[n % ACCOUNTS]).balance),
+    ]:
+        started = time.perf_counter()
+        for n in range(READS):
+            read(n)
+        print(f"{name:<32} {(time.perf_counter() - started) / READS * 1e6:>8.0f} us/read")
+
+
+if __name__ == "__main__":
+    main()
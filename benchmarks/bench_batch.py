@@ -0,0 +1,61 @@
+# coding=utf-8
+"""
+Throughput of single postings against Bank.apply_batch(), both on the
+Bank directly and over HTTP through the Flask test client, using an
+on-disk SQLite store.
+
+    python -m benchmarks.bench_batch
+"""
+import os
+import tempfile
+import time
+
+POSTINGS = 2000
+BATCH_SIZE = 500
+
+os.environ["PERSISTENCE_MODULE"] = "eventsourcing.sqlite"
+os.environ["SQLITE_DBNAME"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from banking.api import app, bank_instance  # noqa: E402
+
+
+def report(name: str, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    print(f"{name:<24} {POSTINGS / elapsed:>10.0f} postings/s")
+
+
+def main() -> None:
+    alice = bank_instance.open_account("Alice", "alice@example.com", "alice")
+    bob = bank_instance.open_account("Bob", "bob@example.com", "bob")
+
+    started = time.perf_counter()
+    for _ in range(POSTINGS):
+        bank_instance.deposit(alice, 1)
+    report("Bank.deposit", started)
+
+    started = time.perf_counter()
+    postings = [{"type": "transfer", "source_account_id": alice, "target_account_id": bob, "amount": 1}]
+    for _ in range(0, POSTINGS, BATCH_SIZE):
+        bank_instance.apply_batch(postings * BATCH_SIZE)
+    report("Bank.apply_batch", started)
+
+    client = app.test_client()
+    token = client.post("/api/v1/login", json={
+        "email_address": "alice@example.com", "password": "alice",
+    }).json["access_token"]
+    headers = {"Authorization": f"JWT {token}"}
+
+    started = time.perf_counter()
+    for _ in range(POSTINGS):
+        client.post("/api/v1/deposit", headers=headers, json={"account_id": str(alice), "amount": 1})
+    report("POST /api/v1/deposit", started)
+
+    started = time.perf_counter()
+    postings = [{"type": "deposit", "account_id": str(alice), "amount": 1}]
+    for _ in range(0, POSTINGS, BATCH_SIZE):
+        client.post("/api/v1/batch", headers=headers, json={"postings": postings * BATCH_SIZE})
+    report("POST /api/v1/batch", started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# coding=utf-8
+"""
+The throughput and latency of deposits into an on-disk SQLite store,
+each client depositing into its own account, with every save its own
+transaction and with group commit (SQLITE_GROUP_COMMIT_WINDOW) over a
+range of windows, for a range of concurrent clients. A window of 0
+commits together only what queued up during the previous commit.
+
+    python -m benchmarks.bench_group_commit
+"""
+import os
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+from banking.applicationmodel import Bank
+
+WINDOWS: List[Optional[str]] = [None, "0", "0.001", "0.002", "0.005"]
+CLIENTS = [1, 8, 32]
+DEPOSITS = 1600
+
+
+def run(window: Optional[str], clients: int) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+    }
+    if window is not None:
+        env["SQLITE_GROUP_COMMIT_WINDOW"] = window
+    app = Bank(env=env)
+    accounts = [app.open_account("Bench", f"bench{n}@example.com", "bench") for n in range(clients)]
+    latencies: List[List[float]] = [[] for _ in accounts]
+
+    def client(n: int) -> None:
+        for _ in range(DEPOSITS // clients):
+            started = time.perf_counter()
+            app.deposit(accounts[n], 1)
+            latencies[n].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    app.close()
+
+    times = sorted(t for client_times in latencies for t in client_times)
+    name = "off" if window is None else f"{float(window) * 1000:g} ms"
+    print(f"{name:<8} {clients:>8} {len(times) / elapsed:>10.0f}"
+          f" {times[len(times) // 2] * 1000:>8.2f} {times[int(len(times) * 0.99)] * 1000:>8.2f}")
+
+
+def main() -> None:
+    print(f"{'window':<8} {'clients':>8} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for clients in CLIENTS:
+        for window in WINDOWS:
+            run(window, clients)
+
+
+if __name__ == "__main__":
+    main()
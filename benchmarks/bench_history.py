@@ -0,0 +1,46 @@
+# coding=utf-8
+"""
+Latency of the first, a middle and the last page of a long account
+history from the transaction-history read model, by cursor and by
+date range, and how fast the read model is built.
+
+    python -m benchmarks.bench_history
+"""
+import time
+
+from banking.applicationmodel import Bank
+
+EVENTS = 1000000
+BATCH_SIZE = 10000
+PAGE_SIZE = 50
+READS = 1000
+
+
+def main() -> None:
+    bank = Bank(env={"SNAPSHOTTING_INTERVAL": "0", "PASSWORD_SCRYPT_N": "1024"})
+    account_id = bank.open_account("Bench", "bench@example.com", "bench")
+    for _ in range(0, EVENTS, BATCH_SIZE):
+        bank.apply_batch([{"type": "deposit", "account_id": account_id, "amount": 1}] * BATCH_SIZE)
+
+    started = time.perf_counter()
+    bank.history.catch_up()
+    elapsed = time.perf_counter() - started
+    print(f"projected {EVENTS} movements in {elapsed:.1f}s: {EVENTS / elapsed:.0f} movements/s")
+
+    # The account was opened at version 1, so its movements are at versions 2 on.
+    (middle, *_), _ = bank.get_transactions(account_id, 1, before=EVENTS // 2)
+    for name, kwargs in [
+        ("first page", {}),
+        ("middle page (cursor)", {"before": EVENTS // 2}),
+        ("last page (cursor)", {"before": PAGE_SIZE + 2}),
+        ("middle page (until)", {"until": middle.timestamp}),
+    ]:
+        started = time.perf_counter()
+        for _ in range(READS):
+            page, _ = bank.get_transactions(account_id, PAGE_SIZE, **kwargs)
+        assert len(page) == PAGE_SIZE
+        print(f"{name:<24} {(time.perf_counter() - started) / READS * 1e6:>8.1f} us/page")
+
+
+if __name__ == "__main__":
+    main()
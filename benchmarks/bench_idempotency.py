@@ -0,0 +1,68 @@
+# coding=utf-8
+"""
+Latency of Idempotency-Key lookups, and memory per key, with 10M keys
+in the in-memory store, and with 10M keys in the SQLite tier shared
+by worker processes (looked up by a process that hasn't seen them).
+
+    python -m benchmarks.bench_idempotency
+"""
+import os
+import random
+import tempfile
+import time
+
+from banking.idempotency import IdempotencyStore, digest
+
+KEYS = 10000000
+READS = 100000
+BODY = '{"data": 500, "msg": "Amount deposited successfully"}'
+FINGERPRINT = digest(b'{"account_id": "0db7b668-2856-4c86-83cf-a0b42c80d935", "amount": 500}')
+
+
+def rss() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def key(n: int) -> str:
+    return f"0db7b668-2856-4c86-83cf-a0b42c80d935\0/api/v1/deposit\0{n:032x}"
+
+
+def report(name: str, store: IdempotencyStore, keys: list) -> None:
+    started = time.perf_counter()
+    for k in keys:
+        stored = store.begin(k, FINGERPRINT)
+    elapsed = time.perf_counter() - started
+    assert stored is not None and stored.status == 200
+    print(f"{name:<28} {elapsed / len(keys) * 1e6:>8.2f} us/lookup")
+
+
+def main() -> None:
+    store = IdempotencyStore(maxsize=KEYS)
+    before = rss()
+    started = time.perf_counter()
+    for n in range(KEYS):
+        store.begin(key(n), FINGERPRINT)
+        store.finish(key(n), FINGERPRINT, 200, BODY)
+    elapsed = time.perf_counter() - started
+    print(f"stored {KEYS} keys in {elapsed:.1f}s: {KEYS / elapsed:.0f} requests/s")
+    print(f"memory {(rss() - before) / KEYS:.0f} bytes/key ({(rss() - before) / 2 ** 20:.0f} MiB)")
+    report("in memory hit", store, [key(random.randrange(KEYS)) for _ in range(READS)])
+    del store
+
+    dbname = os.path.join(tempfile.mkdtemp(), "keys.db")
+    store = IdempotencyStore(dbname=dbname)
+    expires = time.time() + store.ttl
+    with store.connection() as connection:
+        connection.executemany(
+            "INSERT INTO idempotency_keys VALUES (?, ?, ?, 200, ?)",
+            ((digest(key(n).encode()), expires, FINGERPRINT, BODY) for n in range(KEYS)),
+        )
+    print(f"sqlite tier {os.path.getsize(dbname) / KEYS:.0f} bytes/key on disk")
+    sample = [key(n) for n in random.sample(range(KEYS), READS)]
+    report("sqlite hit (other worker)", store, sample)
+    report("in memory hit after that", store, sample)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# coding=utf-8
+"""
+Ledger verification of 200k postings (deposits, withdrawals and
+transfers) to 10k accounts, from an on-disk SQLite store: the rate
+they are written with apply_batch, against the LedgerVerifier
+catching up with them all, then with the next batch, and rescanning
+the whole log in this process and with worker processes.
+
+    python -m benchmarks.bench_ledger
+"""
+import os
+import random
+import tempfile
+import time
+from uuid import uuid4
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+from banking.ledger import LedgerVerifier
+
+ACCOUNTS = 10000
+POSTINGS = 200000
+BATCH_SIZE = 1000
+
+
+def postings(account_ids: list) -> list:
+    batch = []
+    for _ in range(BATCH_SIZE):
+        kind = random.choice(["deposit", "withdraw", "transfer"])
+        if kind == "transfer":
+            source, target = random.sample(account_ids, 2)
+            batch.append({"type": kind, "source_account_id": source, "target_account_id": target, "amount": 1})
+        else:
+            batch.append({"type": kind, "account_id": random.choice(account_ids), "amount": 1})
+    return batch
+
+
+def main() -> None:
+    tmp = tempfile.mkdtemp()
+    bank = Bank(env={
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": os.path.join(tmp, "bench.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+    })
+    random.seed(1)
+    password = bank.passwords.hash("bench")
+    account_ids = []
+    for _ in range(0, ACCOUNTS, BATCH_SIZE):
+        accounts = [Account(uuid4(), "Bench", "bench@example.com", password) for _ in range(BATCH_SIZE)]
+        for account in accounts:
+            account.set_overdraft_limit(1000)
+        bank.save(*accounts)
+        account_ids.extend(account.id for account in accounts)
+    verifier = LedgerVerifier(bank, dbname=os.path.join(tmp, "bench-ledger.db"))
+    verifier.catch_up()
+
+    events = verifier.state.events
+    started = time.perf_counter()
+    for _ in range(0, POSTINGS, BATCH_SIZE):
+        bank.apply_batch(postings(account_ids))
+    write_time = time.perf_counter() - started
+    verifier.catch_up()
+    events = verifier.state.events - events
+    print(f"{events} events to verify")
+    print(f"{'apply_batch (written)':<28} {events / write_time:>8.0f} events/s")
+
+    verifier = LedgerVerifier(bank)
+    started = time.perf_counter()
+    assert verifier.catch_up() == []
+    catch_up_time = time.perf_counter() - started
+    print(f"{'catch_up from the start':<28} {verifier.state.events / catch_up_time:>8.0f} events/s")
+
+    verifier = LedgerVerifier(bank, dbname=os.path.join(tmp, "bench-ledger.db"))
+    bank.apply_batch(postings(account_ids))
+    started = time.perf_counter()
+    verifier.catch_up()
+    print(f"{'catch_up after a batch':<28} {(time.perf_counter() - started) * 1000:>8.1f} ms"
+          f" ({verifier.state.events} events, checkpoint saved)")
+
+    for workers in sorted({0, 1, 2, os.cpu_count() or 1}):
+        rescan = verifier.rescan(workers)
+        assert rescan.violations == [] and rescan.totals == verifier.totals
+        print(f"{f'rescan workers={workers}':<28} {rescan.events / rescan.seconds:>8.0f} events/s")
+    bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+What the request instrumentation costs: the time it adds to each Bank
+call and each request, against the time a deposit takes through the
+Flask API (test client, in-memory store, Server-Timing on).
+
+    python -m benchmarks.bench_metrics
+"""
+import time
+from typing import Callable
+
+from banking import metrics
+from banking.metrics import Metrics, instrumented
+
+CALLS = 100000
+REQUESTS = 2000
+
+
+class Calls:
+    metrics = Metrics()
+
+    def plain(self) -> None:
+        pass
+
+    @instrumented
+    def timed(self) -> None:
+        pass
+
+
+def per_call(func: Callable[[], None], n: int = CALLS) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - started) / n
+
+
+def request_hooks() -> None:
+    """What the API does around each request, besides the Bank call."""
+    started = time.perf_counter()
+    sample = metrics.begin_request()
+    with metrics.phase("jwt"):
+        pass
+    with metrics.phase("json"):
+        pass
+    metrics.record_store(1, 1, 0, 0.0)
+    metrics.record_store(0, 1, 200, 0.0)
+    metrics.end_request()
+    seconds = time.perf_counter() - started
+    Calls.metrics.record_request("/api/v1/deposit", "POST", 200, seconds, sample)
+    sample.server_timing(seconds)
+
+
+def main() -> None:
+    from banking.api import app
+
+    calls = Calls()
+    call_overhead = per_call(calls.timed) - per_call(calls.plain)
+    hooks_overhead = per_call(request_hooks)
+
+    app.config["SERVER_TIMING"] = True
+    client = app.test_client()
+    client.post("/api/v1/signup", json={"full_name": "B", "email_address": "bench@example.com", "password": "bench"})
+    token = client.post("/api/v1/login", json={
+        "email_address": "bench@example.com", "password": "bench"
+    }).json["access_token"]
+    headers = {"Authorization": f"JWT {token}"}
+    account_id = client.get("/api/v1/account", headers=headers).json["identity"]
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        client.post("/api/v1/deposit", headers=headers, json={"account_id": account_id, "amount": 1})
+    request_time = (time.perf_counter() - started) / REQUESTS
+
+    overhead = call_overhead + hooks_overhead
+    print(f"{'per Bank call':<24} {call_overhead * 1e6:>8.2f} us")
+    print(f"{'per request (hooks)':<24} {hooks_overhead * 1e6:>8.2f} us")
+    print(f"{'deposit request':<24} {request_time * 1e6:>8.0f} us")
+    print(f"{'overhead':<24} {overhead / request_time:>8.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# coding=utf-8
+"""
+Logins per second through Bank.authenticate() at each scrypt cost,
+with four client threads, with and without the verified cache.
+
+    python -m benchmarks.bench_passwords
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from banking.applicationmodel import Bank
+
+COSTS = [2 ** 12, 2 ** 13, 2 ** 14, 2 ** 15]
+LOGINS = 200
+THREADS = 4
+
+
+def logins_per_second(n: int, verified_ttl: str) -> float:
+    bank = Bank(env={"PASSWORD_SCRYPT_N": str(n), "PASSWORD_VERIFIED_TTL": verified_ttl})
+    bank.open_account("Alice", "alice@example.com", "alice")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as clients:
+        for _ in range(LOGINS):
+            clients.submit(bank.authenticate, "alice@example.com", "alice")
+    elapsed = time.perf_counter() - started
+    bank.close()
+    return LOGINS / elapsed
+
+
+def main() -> None:
+    print(f"{'scrypt n':>9} {'memory':>8} {'logins/s':>10} {'cached logins/s':>16}")
+    for n in COSTS:
+        uncached = logins_per_second(n, "0")
+        cached = logins_per_second(n, "60")
+        print(f"{n:>9} {128 * 8 * n // 1024 // 1024:>6}MB {uncached:>10.0f} {cached:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# coding=utf-8
+"""
+Peak memory and time to load an account with 1M events, with
+snapshots and the aggregate cache off, reading its events all at
+once (EVENTS_PAGE_SIZE=0) and a page at a time, from an on-disk
+SQLite store.
+
+    python -m benchmarks.bench_reconstruction
+"""
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from banking.applicationmodel import Bank
+
+EVENTS = 1000000
+BATCH_SIZE = 10000
+PAGE_SIZES = [0, 100, 1000, 10000]
+
+
+def main() -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+        "SNAPSHOTTING_INTERVAL": "0",
+    }
+    # Written with the account cached, so each batch doesn't replay the history.
+    bank = Bank(env=env)
+    account_id = bank.open_account("Bench", "bench@example.com", "bench")
+    for _ in range(0, EVENTS, BATCH_SIZE):
+        bank.apply_batch([{"type": "deposit", "account_id": account_id, "amount": 1}] * BATCH_SIZE)
+    bank.close()
+
+    print(f"{'page size':>10} {'peak MiB':>9} {'load s':>7}")
+    for page_size in PAGE_SIZES:
+        bank = Bank(env=dict(env, EVENTS_PAGE_SIZE=str(page_size), AGGREGATE_CACHE_MAXSIZE=""))
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        account = bank.get_account(account_id)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert account.balance == EVENTS
+        print(f"{page_size or 'all':>10} {peak / 2 ** 20:>9.1f} {elapsed:>7.1f}")
+        bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# coding=utf-8
+"""
+Concurrent deposits into one hot account, through the default
+optimistic path (load, save, retry on conflict) and through the
+single-writer path (SINGLE_WRITER_SHARDS), using an on-disk SQLite
+store.
+
+    python -m benchmarks.bench_single_writer
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from banking.applicationmodel import Bank
+
+DEPOSITS = 4000
+CLIENTS = 16
+
+
+def run(name: str, shards: int) -> None:
+    app = Bank(env={
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+        "COMMAND_MAX_ATTEMPTS": "1000",
+        "SINGLE_WRITER_SHARDS": str(shards),
+    })
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        list(pool.map(lambda _: app.deposit(merchant, 1), range(DEPOSITS)))
+    elapsed = time.perf_counter() - started
+
+    assert app.get_balance(merchant) == DEPOSITS
+    stats = app.command_retry_stats()
+    print(f"{name:<16} {DEPOSITS / elapsed:>10.0f} {stats['conflict_rate']:>14.3f} {stats['retries']:>8.0f}")
+    app.close()
+
+
+def main() -> None:
+    print(f"{'path':<16} {'deposits/s':>10} {'conflict rate':>14} {'retries':>8}")
+    run("optimistic", 0)
+    run("single writer", 4)
+
+
+if __name__ == "__main__":
+    main()
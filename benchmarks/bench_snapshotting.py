@@ -0,0 +1,45 @@
+# coding=utf-8
+"""
+Balance-read latency against account history length, with and
+without snapshotting, for the in-memory and SQLite stores.
+
+    python -m benchmarks.bench_snapshotting
+"""
+import time
+from typing import Dict
+
+from banking.applicationmodel import Bank
+
+HISTORY_LENGTHS = [100, 1000, 5000, 20000]
+READS = 10
+STORES: Dict[str, Dict[str, str]] = {
+    "popo": {},
+    "sqlite": {"PERSISTENCE_MODULE": "eventsourcing.sqlite", "SQLITE_DBNAME": ":memory:"},
+}
+
+
+def read_latency_us(store: str, interval: int, history_length: int) -> float:
+    bank = Bank(env=dict(STORES[store], SNAPSHOTTING_INTERVAL=str(interval)))
+    account_id = bank.open_account("Bench", "bench@example.com", "bench")
+    account = bank.get_account(account_id)
+    for _ in range(history_length):
+        account.credit(1)
+    bank.save(account)
+
+    started = time.perf_counter()
+    for _ in range(READS):
+        bank.get_account(account_id)
+    return (time.perf_counter() - started) / READS * 1e6
+
+
+def main() -> None:
+    print(f"{'store':>8} {'events':>8} {'no snapshots (us)':>18} {'interval=100 (us)':>18}")
+    for store in STORES:
+        for history_length in HISTORY_LENGTHS:
+            without = read_latency_us(store, 0, history_length)
+            with_snapshots = read_latency_us(store, 100, history_length)
+            print(f"{store:>8} {history_length:>8} {without:>18.1f} {with_snapshots:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# coding=utf-8
+"""
+Month-end statements for 100k accounts with 5 events each, from an
+on-disk SQLite store: the StatementJob in this process and with
+worker processes, against loading each account with get_account
+(which only gives the closing balance).
+
+    python -m benchmarks.bench_statements
+"""
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+from banking.statements import StatementJob
+
+ACCOUNTS = 100000
+DEPOSITS = 4
+BATCH_SIZE = 1000
+LOADS = 10000
+
+
+def main() -> None:
+    bank = Bank(env={
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+        "AGGREGATE_CACHE_MAXSIZE": "",
+    })
+    password = bank.passwords.hash("bench")
+    account_ids = []
+    for _ in range(0, ACCOUNTS, BATCH_SIZE):
+        accounts = [Account(uuid4(), "Bench", "bench@example.com", password) for _ in range(BATCH_SIZE)]
+        bank.save(*accounts)
+        account_ids.extend(account.id for account in accounts)
+    since = datetime.now(timezone.utc)
+    for deposit in range(DEPOSITS):
+        for start in range(0, ACCOUNTS, BATCH_SIZE):
+            bank.apply_batch([
+                {"type": "deposit", "account_id": account_id, "amount": deposit + 1}
+                for account_id in account_ids[start:start + BATCH_SIZE]
+            ])
+    until = datetime.now(timezone.utc)
+
+    started = time.perf_counter()
+    for account_id in account_ids[:LOADS]:
+        bank.get_account(account_id)
+    print(f"{'get_account per account':<26} {LOADS / (time.perf_counter() - started):>8.0f} accounts/s")
+
+    directory = tempfile.mkdtemp()
+    for workers in sorted({0, 1, 2, os.cpu_count() or 1}):
+        run = StatementJob(bank, workers=workers).run(since, until, directory)
+        assert run.accounts == ACCOUNTS
+        print(f"{f'StatementJob workers={workers}':<26} {run.accounts_per_second:>8.0f} accounts/s"
+              f" {run.events / run.seconds:>8.0f} events/s")
+    bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# coding=utf-8
+"""
+Size and speed of the event encodings (EVENT_TRANSCODER and
+EVENT_COMPRESSION): stored bytes per deposit and per transfer
+posting, encode and decode rates, how much the SQLite file grows
+per posting, and how long an account with a long history takes
+to load, with snapshots and the aggregate cache off.
+
+    python -m benchmarks.bench_transcoding
+"""
+import os
+import sqlite3
+import tempfile
+import time
+from uuid import uuid4
+
+from banking.applicationmodel import Bank
+
+ENCODINGS = [("json", {}), ("compact", {"EVENT_TRANSCODER": "compact"})] + [
+    (f"compact+{compression}", {"EVENT_TRANSCODER": "compact", "EVENT_COMPRESSION": compression})
+    for compression in ["zlib", "lzma"]
+]
+EVENTS = 20000
+BATCH_SIZE = 1000
+CODECS = 100000
+LOADS = 5
+
+
+def database_size(dbname: str) -> int:
+    # Pages in use, including those still in the write-ahead log.
+    connection = sqlite3.connect(dbname)
+    (page_count,), = connection.execute("PRAGMA page_count")
+    (page_size,), = connection.execute("PRAGMA page_size")
+    connection.close()
+    return page_count * page_size
+
+
+def stored_size(bank: Bank, event: object) -> int:
+    stored_event = bank.mapper.to_stored_event(event)  # type: ignore
+    return len(stored_event.state) + len(stored_event.topic)
+
+
+def run(name: str, encoding: dict) -> None:
+    dbname = os.path.join(tempfile.mkdtemp(), "bench.db")
+    bank = Bank(env=dict(
+        encoding,
+        PERSISTENCE_MODULE="eventsourcing.sqlite",
+        SQLITE_DBNAME=dbname,
+        PASSWORD_SCRYPT_N="1024",
+        SNAPSHOTTING_INTERVAL="0",
+        AGGREGATE_CACHE_MAXSIZE="",
+    ))
+    account_id = bank.open_account("Bench", "bench@example.com", "bench")
+    other_id = bank.open_account("Other", "other@example.com", "other")
+
+    account = bank.get_account(account_id)
+    account.credit(100)
+    account.debit(100, counterparty_id=other_id, transfer_id=uuid4())
+    deposit, posting = account.collect_events()
+
+    started = time.perf_counter()
+    for _ in range(CODECS):
+        stored_event = bank.mapper.to_stored_event(posting)
+    encode_rate = CODECS / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for _ in range(CODECS):
+        bank.mapper.to_domain_event(stored_event)
+    decode_rate = CODECS / (time.perf_counter() - started)
+
+    size = database_size(dbname)
+    for _ in range(0, EVENTS, BATCH_SIZE):
+        bank.apply_batch([{"type": "deposit", "account_id": account_id, "amount": 1}] * BATCH_SIZE)
+    growth = (database_size(dbname) - size) / EVENTS
+
+    started = time.perf_counter()
+    for _ in range(LOADS):
+        bank.repository.get(account_id)
+    load_time = (time.perf_counter() - started) / LOADS
+
+    print(f"{name:<14} {stored_size(bank, deposit):>8} {stored_size(bank, posting):>9} {growth:>8.0f}"
+          f" {encode_rate:>9.0f} {decode_rate:>9.0f} {load_time * 1000:>9.0f}")
+    bank.close()
+
+
+def main() -> None:
+    print(f"{'encoding':<14} {'deposit':>8} {'transfer':>9} {'db/post':>8}"
+          f" {'encode/s':>9} {'decode/s':>9} {f'load {EVENTS}':>9}")
+    print(f"{'':<14} {'bytes':>8} {'bytes':>9} {'bytes':>8} {'':>9} {'':>9} {'ms':>9}")
+    for name, encoding in ENCODINGS:
+        run(name, encoding)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# coding=utf-8
+"""
+Deposit throughput over HTTP against `main.py --workers N`, sharing
+one on-disk SQLite store. Half the clients deposit into their own
+account and half into one shared hot account, so both scaling and
+conflict retries are exercised.
+
+    python -m benchmarks.bench_workers [--workers 1 2 4] [--clients 16] [--seconds 5]
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+
+HOST = "127.0.0.1"
+
+
+def request(conn: http.client.HTTPConnection, method: str, path: str,
+            body: Any = None, token: str = "") -> Tuple[int, Dict[str, Any]]:
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"JWT {token}"
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def wait_for_server(port: int) -> None:
+    for _ in range(100):
+        try:
+            http.client.HTTPConnection(HOST, port, timeout=1).connect()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def run(workers: int, clients: int, seconds: float, port: int) -> None:
+    env = dict(os.environ, PERSISTENCE_MODULE="eventsourcing.sqlite",
+               SQLITE_DBNAME=os.path.join(tempfile.mkdtemp(), "bench.db"),
+               PASSWORD_SCRYPT_N="1024")
+    server = subprocess.Popen([sys.executable, "main.py", "--workers", str(workers), "--port", str(port)],
+                              env=env, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port)
+
+        def client(n: int) -> Tuple[int, int]:
+            conn = http.client.HTTPConnection(HOST, port)
+            email = f"client{n}@example.com"
+            _, data = request(conn, "POST", "/api/v1/signup",
+                              {"full_name": "c", "email_address": email, "password": "pw"})
+            _, login = request(conn, "POST", "/api/v1/login", {"email_address": email, "password": "pw"})
+            account_id = data["account_id"] if n % 2 else hot_account
+            ok = failed = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                status, _ = request(conn, "POST", "/api/v1/deposit",
+                                    {"account_id": account_id, "amount": 1}, login["access_token"])
+                if status == 200:
+                    ok += 1
+                else:
+                    failed += 1
+            return ok, failed
+
+        conn = http.client.HTTPConnection(HOST, port)
+        _, hot = request(conn, "POST", "/api/v1/signup",
+                         {"full_name": "hot", "email_address": "hot@example.com", "password": "pw"})
+        hot_account = hot["account_id"]
+        with ThreadPoolExecutor(clients) as pool:
+            results = list(pool.map(client, range(clients)))
+        ok = sum(r[0] for r in results)
+        failed = sum(r[1] for r in results)
+        print(f"{workers:>8} {ok / seconds:>10.0f} {failed:>8}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=5077)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'deposits/s':>10} {'failed':>8}")
+    for workers in args.workers:
+        run(workers, args.clients, args.seconds, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# coding=utf-8
+"""
+Load test comparing the Flask app with the ASGI app, in process,
+at several concurrency levels. Each virtual client alternates
+GET /api/v1/account and POST /api/v1/deposit. Flask clients are
+threads; ASGI clients are tasks on one event loop.
+
+    python -m benchmarks.loadtest_asgi [--requests N] [--concurrency 10 100 1000]
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from banking import asgi
+from banking.api import app
+
+EMAIL = "loadtest@example.com"
+PASSWORD = "loadtest"
+
+
+def setup() -> Tuple[str, str]:
+    client = app.test_client()
+    account_id = client.post("/api/v1/signup", json={
+        "full_name": "Load Test", "email_address": EMAIL, "password": PASSWORD,
+    }).json["account_id"]
+    token = client.post("/api/v1/login", json={
+        "email_address": EMAIL, "password": PASSWORD,
+    }).json["access_token"]
+    return account_id, token
+
+
+def summarize(name: str, concurrency: int, latencies: List[float], elapsed: float) -> None:
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:<6} {concurrency:>6} {len(latencies) / elapsed:>10.0f} {p50:>9.2f} {p99:>9.2f}")
+
+
+def run_flask(account_id: str, token: str, concurrency: int, requests: int) -> None:
+    headers = {"Authorization": f"JWT {token}"}
+
+    def client_loop(n: int) -> List[float]:
+        client = app.test_client()
+        latencies = []
+        for i in range(n):
+            started = time.perf_counter()
+            if i % 2:
+                client.post("/api/v1/deposit", headers=headers, json={"account_id": account_id, "amount": 1})
+            else:
+                client.get("/api/v1/account", headers=headers)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(client_loop, [requests // concurrency] * concurrency))
+    summarize("flask", concurrency, [x for r in results for x in r], time.perf_counter() - started)
+
+
+async def asgi_request(method: str, path: str, token: str, body: Any = None) -> None:
+    messages = [{"type": "http.request", "body": json.dumps(body).encode() if body else b""}]
+
+    async def receive() -> Dict[str, Any]:
+        return messages.pop()
+
+    async def send(message: Dict[str, Any]) -> None:
+        pass
+
+    scope = {"type": "http", "method": method, "path": path,
+             "headers": [(b"authorization", f"JWT {token}".encode())]}
+    await asgi.app(scope, receive, send)
+
+
+def run_asgi(account_id: str, token: str, concurrency: int, requests: int) -> None:
+    async def client_loop(n: int) -> List[float]:
+        latencies = []
+        for i in range(n):
+            started = time.perf_counter()
+            if i % 2:
+                await asgi_request("POST", "/api/v1/deposit", token, {"account_id": account_id, "amount": 1})
+            else:
+                await asgi_request("GET", "/api/v1/account", token)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    async def main() -> List[List[float]]:
+        return await asyncio.gather(*[client_loop(requests // concurrency) for _ in range(concurrency)])
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    summarize("asgi", concurrency, [x for r in results for x in r], time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    account_id, token = setup()
+    print(f"{'app':<6} {'conc':>6} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for concurrency in args.concurrency:
+        if concurrency <= 200:
+            run_flask(account_id, token, concurrency, args.requests)
+        run_asgi(account_id, token, concurrency, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# coding=utf-8
+"""
+Benchmark suite for the Bank's commands and queries and the HTTP API,
+run over a matrix of persistence module (POPO in memory, SQLite on
+disk), history length (events per account before measuring) and
+concurrency (threads, each on its own accounts). Every case starts
+from a fresh Bank, warms up, then times a fixed number of operations.
+Results are written as JSON, and compared with a stored baseline:
+a case whose throughput has dropped by more than the tolerance is a
+regression, and the suite exits with status 1.
+
+    python -m benchmarks.suite --save-baseline          # on the main branch
+    python -m benchmarks.suite --output results.json    # on a change, compared with it
+
+Baselines are only comparable on the machine they were made on, so
+they aren't kept in the repository. Single runs of the threaded cases
+vary by 10-20%, so use --repeat to compare with a tighter tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+from unittest.mock import patch
+from uuid import UUID
+
+from banking import api
+from banking.applicationmodel import Bank
+
+PERSISTENCE = ["popo", "sqlite"]
+HISTORIES = [0, 1000]
+CONCURRENCY = [1, 4]
+OPERATIONS = ["open_account", "deposit", "withdraw", "transfer", "get_balance", "http_flow"]
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+BATCH_SIZE = 500
+WARMUP = 20
+
+Operation = Callable[[], Any]
+
+
+def make_bank(persistence: str) -> Bank:
+    env = {"PASSWORD_SCRYPT_N": "1024"}
+    if persistence == "sqlite":
+        env["PERSISTENCE_MODULE"] = "eventsourcing.sqlite"
+        env["SQLITE_DBNAME"] = os.path.join(tempfile.mkdtemp(), "suite.db")
+    return Bank(env=env)
+
+
+def make_accounts(bank: Bank, n: int, history: int) -> Tuple[UUID, UUID]:
+    """A pair of accounts with ``history`` deposits each, and funds for anything the suite does."""
+    accounts = tuple(bank.open_account("Suite", f"suite-{n}-{i}@example.com", "suite") for i in range(2))
+    for account_id in accounts:
+        bank.deposit(account_id, 10 ** 12)
+        for start in range(0, history, BATCH_SIZE):
+            bank.apply_batch([
+                {"type": "deposit", "account_id": account_id, "amount": 1}
+                for _ in range(min(BATCH_SIZE, history - start))
+            ])
+    return accounts[0], accounts[1]
+
+
+def operation(name: str, bank: Bank, n: int, accounts: Tuple[UUID, UUID]) -> Operation:
+    """What thread ``n`` does, once per iteration."""
+    source, target = accounts
+    if name == "open_account":
+        counter = iter(range(10 ** 9))
+        return lambda: bank.open_account("Suite", f"suite-{n}-new-{next(counter)}@example.com", "suite")
+    if name == "deposit":
+        return lambda: bank.deposit(source, 1)
+    if name == "withdraw":
+        return lambda: bank.withdraw(source, 1)
+    if name == "transfer":
+        return lambda: bank.transfer(source, target, 1)
+    if name == "get_balance":
+        return lambda: bank.get_balance(source)
+    assert name == "http_flow"
+    # Log in, deposit, transfer and read the account, through the Flask app.
+    client = api.app.test_client()
+    login = {"email_address": f"suite-{n}-0@example.com", "password": "suite"}
+    deposit = {"account_id": str(source), "amount": 1}
+    transfer = {"source_account_id": str(source), "target_account_id": str(target), "amount": 1}
+
+    def http_flow() -> None:
+        token = client.post("/api/v1/login", json=login).json["access_token"]
+        headers = {"Authorization": f"JWT {token}"}
+        for path, body in (("/api/v1/deposit", deposit), ("/api/v1/transfer", transfer)):
+            assert client.post(path, headers=headers, json=body).status_code == 200
+        assert client.get("/api/v1/account", headers=headers).status_code == 200
+    return http_flow
+
+
+def run_case(name: str, persistence: str, history: int, concurrency: int, ops: int) -> Dict[str, Any]:
+    bank = make_bank(persistence)
+    try:
+        operations = [
+            operation(name, bank, n, make_accounts(bank, n, history)) for n in range(concurrency)
+        ]
+        latencies: List[List[float]] = [[] for _ in operations]
+        barrier = threading.Barrier(concurrency + 1)
+
+        def worker(n: int) -> None:
+            for _ in range(WARMUP):
+                operations[n]()
+            barrier.wait()
+            times = latencies[n]
+            for _ in range(ops // concurrency):
+                started = time.perf_counter()
+                operations[n]()
+                times.append(time.perf_counter() - started)
+
+        with patch.object(api, "bank_instance", bank):
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            barrier.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - started
+    finally:
+        bank.close()
+    times = sorted(t for thread_times in latencies for t in thread_times)
+    return {
+        "name": f"{name}[{persistence},history={history},concurrency={concurrency}]",
+        "operation": name,
+        "persistence": persistence,
+        "history": history,
+        "concurrency": concurrency,
+        "ops": len(times),
+        "seconds": seconds,
+        "ops_per_second": len(times) / seconds,
+        "p50_ms": times[len(times) // 2] * 1000,
+        "p99_ms": times[int(len(times) * 0.99)] * 1000,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Print each case against the baseline, returning the names of those that regressed."""
+    before = {result["name"]: result for result in baseline}
+    regressions = []
+    print(f"\n{'case':<58} {'baseline':>10} {'now':>10} {'change':>8}")
+    for result in results:
+        previous = before.get(result["name"])
+        if previous is None:
+            continue
+        change = result["ops_per_second"] / previous["ops_per_second"] - 1
+        flag = ""
+        if change < -tolerance:
+            regressions.append(result["name"])
+            flag = "  REGRESSION"
+        print(f"{result['name']:<58} {previous['ops_per_second']:>10.0f}"
+              f" {result['ops_per_second']:>10.0f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2000, help="operations timed per case (default 2000)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="run each case this many times and keep the median (default 1)")
+    parser.add_argument("--operations", nargs="+", default=OPERATIONS, choices=OPERATIONS)
+    parser.add_argument("--persistence", nargs="+", default=PERSISTENCE, choices=PERSISTENCE)
+    parser.add_argument("--histories", nargs="+", type=int, default=HISTORIES)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=CONCURRENCY)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE, help=f"baseline to compare with (default {BASELINE})")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="drop in throughput that counts as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'case':<58} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for persistence in args.persistence:
+        for history in args.histories:
+            for concurrency in args.concurrency:
+                for name in args.operations:
+                    runs = sorted(
+                        (run_case(name, persistence, history, concurrency, args.ops) for _ in range(args.repeat)),
+                        key=lambda run: run["ops_per_second"],
+                    )
+                    result = runs[len(runs) // 2]
+                    results.append(result)
+                    print(f"{result['name']:<58} {result['ops_per_second']:>10.0f}"
+                          f" {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+    report = {"environment": environment(), "results": results}
+    for path in filter(None, [args.output, args.baseline if args.save_baseline else None]):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline: Dict[str, Any] = json.load(f)
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regressions (throughput down more than {args.tolerance:.0%})")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
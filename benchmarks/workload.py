@@ -0,0 +1,374 @@
+# coding=utf-8
+"""
+Synthetic workload for load testing: generate a seeded trace of
+signups, logins, deposits, withdrawals, transfers and balance reads,
+then replay it against the Bank in this process, the Flask app in
+this process (test client), or a server over HTTP.
+
+The trace is JSON lines, one operation per line, after a header
+with the settings it was made with, so the same seed and settings
+always make the same trace. Accounts are picked with a Zipf
+distribution, so a few are hot. Users sign up and log in in bursts,
+and some withdrawals and transfers are for exactly the balance the
+generator expects the account to have, or one cent more; the rest
+are for no more than that.
+
+    python -m benchmarks.workload generate trace.jsonl --users 1000 --operations 100000 --seed 1
+    python -m benchmarks.workload replay trace.jsonl --target bank --concurrency 8
+    python -m benchmarks.workload replay trace.jsonl --target app --output results.json
+    python -m benchmarks.workload replay trace.jsonl --target http://127.0.0.1:5000 --concurrency 32
+
+Replay sends each user's operations in the order they were generated,
+on one of ``--concurrency`` threads, and records the throughput, and
+latency percentiles and histogram, of each kind of operation.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+from urllib.parse import urlsplit
+from uuid import UUID
+
+from banking.domainmodel import (
+    AccountClosedError,
+    AccountNotFoundError,
+    BadCredentials,
+    InsufficientFundsError,
+    TransactionError,
+)
+from banking.metrics import BUCKETS
+
+Operation = Dict[str, Any]
+
+MIX = {"deposit": 0.35, "withdraw": 0.25, "transfer": 0.3, "balance": 0.1}
+PASSWORD = "workload"
+# What a rejected request raises when replaying against the Bank.
+REJECTIONS = (AccountClosedError, AccountNotFoundError, BadCredentials, InsufficientFundsError,
+              TransactionError, ValueError)
+
+
+def generate(
+        users: int = 1000,
+        operations: int = 100000,
+        seed: int = 1,
+        zipf: float = 1.1,
+        mix: Optional[Dict[str, float]] = None,
+        burst_every: int = 10000,
+        burst_size: int = 100,
+        edge_cases: float = 0.02,
+) -> Iterator[Operation]:
+    """
+    The operations of a trace: ``users`` signups and logins, then
+    ``operations`` postings and balance reads in the proportions of
+    ``mix``, with a burst of ``burst_size`` new signups and as many
+    logins every ``burst_every`` of them. The user of each is picked
+    with a Zipf distribution of exponent ``zipf`` over the users who
+    have signed up, the first the hottest. A fraction ``edge_cases``
+    of withdrawals and transfers are for the whole balance, or one
+    cent more, and the rest for no more than it; with nothing to
+    take out, a deposit is made instead.
+    """
+    assert users >= 2, "transfers need two users"
+    rng = random.Random(seed)
+    kinds, weights = zip(*(mix or MIX).items())
+    max_users = users + (operations // burst_every if burst_every else 0) * burst_size
+    cumulative = list(itertools.accumulate(1 / rank ** zipf for rank in range(1, max_users + 1)))
+    balances: List[int] = []  # as expected if the trace is replayed in order
+
+    def pick() -> int:
+        return bisect_left(cumulative, rng.random() * cumulative[len(balances) - 1])
+
+    def signups(n: int) -> Iterator[Operation]:
+        for _ in range(n):
+            balances.append(0)
+            yield {"op": "signup", "user": len(balances) - 1}
+            yield {"op": "login", "user": len(balances) - 1}
+
+    yield from signups(users)
+    for n in range(operations):
+        if burst_every and n and n % burst_every == 0:
+            yield from signups(burst_size)
+            for _ in range(burst_size):
+                yield {"op": "login", "user": pick()}
+        kind = rng.choices(kinds, weights)[0]
+        user = pick()
+        if kind == "balance":
+            yield {"op": kind, "user": user}
+            continue
+        amount = max(1, int(rng.lognormvariate(7, 1.5)))  # a median of about $11
+        if kind == "deposit":
+            balances[user] += amount
+            yield {"op": kind, "user": user, "amount": amount}
+            continue
+        if rng.random() < edge_cases:
+            amount = max(balances[user], 1) + rng.randint(0, 1)
+        elif balances[user]:
+            amount = min(amount, balances[user])
+        else:
+            # Nothing to take out, so it's paid in instead.
+            balances[user] += amount
+            yield {"op": "deposit", "user": user, "amount": amount}
+            continue
+        operation: Operation = {"op": kind, "user": user, "amount": amount}
+        if kind == "transfer":
+            operation["to"] = to = user
+            while to == user:
+                operation["to"] = to = pick()
+        if amount <= balances[user]:
+            balances[user] -= amount
+            if kind == "transfer":
+                balances[to] += amount
+        yield operation
+
+
+def write_trace(path: str, settings: Dict[str, Any]) -> int:
+    count = 0
+    with open(path, "w") as f:
+        f.write(json.dumps({"trace": settings}) + "\n")
+        for operation in generate(**settings):
+            f.write(json.dumps(operation) + "\n")
+            count += 1
+    return count
+
+
+def read_trace(f: TextIO) -> Iterator[Operation]:
+    for line in f:
+        operation = json.loads(line)
+        if "op" in operation:
+            yield operation
+
+
+class Accounts:
+    """The account id and latest token of each user, as replay threads sign them up and log them in."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.ids: Dict[int, str] = {}
+        self.tokens: Dict[int, str] = {}
+
+    def email(self, user: int) -> str:
+        return f"{self.prefix}{user}@workload.test"
+
+    def id(self, user: int) -> str:
+        # Another thread may not have signed up the other side of a transfer yet.
+        while user not in self.ids:
+            time.sleep(0.001)
+        return self.ids[user]
+
+
+class BankDriver:
+    """Replays operations against the Bank, counting its domain errors as rejections."""
+
+    def __init__(self, accounts: Accounts):
+        from banking.api import bank
+
+        self.bank = bank()
+        self.accounts = accounts
+
+    def run(self, operation: Operation) -> bool:
+        user, kind = operation["user"], operation["op"]
+        try:
+            if kind == "signup":
+                account_id = self.bank.open_account("Workload", self.accounts.email(user), PASSWORD)
+                self.accounts.ids[user] = str(account_id)
+            elif kind == "login":
+                self.bank.authenticate(self.accounts.email(user), PASSWORD)
+            elif kind == "deposit":
+                self.bank.deposit(UUID(self.accounts.id(user)), operation["amount"])
+            elif kind == "withdraw":
+                self.bank.withdraw(UUID(self.accounts.id(user)), operation["amount"])
+            elif kind == "transfer":
+                self.bank.transfer(
+                    UUID(self.accounts.id(user)), UUID(self.accounts.id(operation["to"])), operation["amount"],
+                )
+            else:
+                self.bank.get_balance(UUID(self.accounts.id(user)))
+        except REJECTIONS:
+            return False
+        return True
+
+
+class HTTPDriver:
+    """Replays operations as API requests, over HTTP or to the Flask app's test client."""
+
+    def __init__(self, accounts: Accounts, target: str):
+        self.accounts = accounts
+        self.client: Any = None
+        self.connection: Optional[http.client.HTTPConnection] = None
+        if target == "app":
+            from banking.api import app
+
+            self.client = app.test_client()
+        else:
+            url = urlsplit(target)
+            self.connection = http.client.HTTPConnection(url.hostname or "127.0.0.1", url.port or 80)
+
+    def request(self, method: str, path: str, user: int, body: Any = None) -> Tuple[int, Any]:
+        headers = {"Content-Type": "application/json"}
+        if user in self.accounts.tokens:
+            headers["Authorization"] = f"JWT {self.accounts.tokens[user]}"
+        if self.client is not None:
+            response = self.client.open(path, method=method, headers=headers, json=body)
+            return response.status_code, response.json
+        assert self.connection is not None
+        self.connection.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+        http_response = self.connection.getresponse()
+        return http_response.status, json.loads(http_response.read() or b"null")
+
+    def run(self, operation: Operation) -> bool:
+        user, kind = operation["user"], operation["op"]
+        if kind == "signup":
+            status, data = self.request("POST", "/api/v1/signup", user, {
+                "full_name": "Workload", "email_address": self.accounts.email(user), "password": PASSWORD,
+            })
+            if status == 200:
+                self.accounts.ids[user] = data["account_id"]
+        elif kind == "login":
+            status, data = self.request("POST", "/api/v1/login", user, {
+                "email_address": self.accounts.email(user), "password": PASSWORD,
+            })
+            if status == 200:
+                self.accounts.tokens[user] = data["access_token"]
+        elif kind in ("deposit", "withdraw"):
+            status, _ = self.request("POST", f"/api/v1/{kind}", user, {
+                "account_id": self.accounts.id(user), "amount": operation["amount"],
+            })
+        elif kind == "transfer":
+            status, _ = self.request("POST", "/api/v1/transfer", user, {
+                "source_account_id": self.accounts.id(user),
+                "target_account_id": self.accounts.id(operation["to"]),
+                "amount": operation["amount"],
+            })
+        else:
+            status, _ = self.request("GET", "/api/v1/account", user)
+        if status >= 500:
+            raise RuntimeError(f"{kind} answered {status}")
+        return status < 400
+
+
+class Recorder:
+    """Outcomes and latencies of each kind of operation."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: {"ok": 0, "rejected": 0, "error": 0})
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, outcome: str, seconds: float) -> None:
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            self.outcomes[kind][outcome] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        kinds = {}
+        for kind, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            histogram = [0] * (len(BUCKETS) + 1)
+            for seconds in latencies:
+                histogram[bisect_left(BUCKETS, seconds)] += 1
+            kinds[kind] = {
+                **self.outcomes[kind],
+                "count": len(latencies),
+                "per_second": len(latencies) / elapsed,
+                "p50_ms": latencies[len(latencies) // 2] * 1000,
+                "p90_ms": latencies[int(len(latencies) * 0.9)] * 1000,
+                "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+                "max_ms": latencies[-1] * 1000,
+                "histogram": dict(zip([*map(str, BUCKETS), "+Inf"], histogram)),
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {"elapsed": elapsed, "operations": total, "per_second": total / elapsed, "kinds": kinds}
+
+
+def replay(operations: Iterable[Operation], target: str, concurrency: int, prefix: str) -> Dict[str, Any]:
+    accounts = Accounts(prefix)
+    recorder = Recorder()
+    queues: "List[queue.Queue[Optional[Operation]]]" = [queue.Queue(1000) for _ in range(concurrency)]
+
+    def worker(n: int) -> None:
+        driver = BankDriver(accounts) if target == "bank" else HTTPDriver(accounts, target)
+        for operation in iter(queues[n].get, None):
+            started = time.perf_counter()
+            try:
+                outcome = "ok" if driver.run(operation) else "rejected"
+            except Exception as e:
+                outcome = "error"
+                print(f"{operation}: {e!r}", file=sys.stderr)
+            recorder.record(operation["op"], outcome, time.perf_counter() - started)
+            if operation["op"] == "signup":
+                # Nothing waits forever for an account that failed to open, it fails too.
+                accounts.ids.setdefault(operation["user"], "")
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    for operation in operations:
+        queues[operation["user"] % concurrency].put(operation)
+    for q in queues:
+        q.put(None)
+    for thread in threads:
+        thread.join()
+    return recorder.summary(time.perf_counter() - started)
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    print(f"{'operation':<10} {'count':>8} {'ok':>8} {'rejected':>8} {'error':>6} {'per s':>8}"
+          f" {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, stats in summary["kinds"].items():
+        print(f"{kind:<10} {stats['count']:>8} {stats['ok']:>8} {stats['rejected']:>8} {stats['error']:>6}"
+              f" {stats['per_second']:>8.0f} {stats['p50_ms']:>8.2f} {stats['p90_ms']:>8.2f}"
+              f" {stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+    print(f"{summary['operations']} operations in {summary['elapsed']:.1f}s, {summary['per_second']:.0f}/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="write a trace")
+    generate_parser.add_argument("trace")
+    generate_parser.add_argument("--users", type=int, default=1000, help="signed up before anything else")
+    generate_parser.add_argument("--operations", type=int, default=100000, help="postings and balance reads")
+    generate_parser.add_argument("--seed", type=int, default=1)
+    generate_parser.add_argument("--zipf", type=float, default=1.1, help="exponent, higher is hotter")
+    generate_parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in MIX.items()),
+                                 help="proportions of each operation (default %(default)s)")
+    generate_parser.add_argument("--burst-every", type=int, default=10000)
+    generate_parser.add_argument("--burst-size", type=int, default=100)
+    generate_parser.add_argument("--edge-cases", type=float, default=0.02,
+                                 help="withdrawals and transfers of the whole balance, or a cent more")
+    replay_parser = commands.add_parser("replay", help="replay a trace")
+    replay_parser.add_argument("trace")
+    replay_parser.add_argument("--target", default="bank", help="bank, app, or a URL like http://127.0.0.1:5000")
+    replay_parser.add_argument("--concurrency", type=int, default=8)
+    replay_parser.add_argument("--prefix", default=f"run{int(time.time())}-",
+                               help="of the email addresses, so a trace can be replayed again on one store")
+    replay_parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        settings = {
+            "users": args.users, "operations": args.operations, "seed": args.seed, "zipf": args.zipf,
+            "mix": {k: float(v) for k, v in (item.split("=") for item in args.mix.split(","))},
+            "burst_every": args.burst_every, "burst_size": args.burst_size, "edge_cases": args.edge_cases,
+        }
+        print(f"{write_trace(args.trace, settings)} operations written to {args.trace}")
+        return
+    with open(args.trace) as f:
+        summary = replay(read_trace(f), args.target, args.concurrency, args.prefix)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
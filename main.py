@@ -1,8 +1,17 @@
 #!/bin/python3
 # coding=utf-8
-from banking.api import app as bankingapi
+from banking import api
+from banking.api import app as bankingapi, bank_instance
+from banking.applicationmodel import Bank
+from banking.idempotency import IdempotencyStore
+from multiprocessing import Process
+from werkzeug.serving import make_server
+import argparse
 import logging
 import os
+import signal
+import socket
+import sys
 
 logging.basicConfig(
     format=os.getenv(
@@ -13,5 +22,62 @@ logging.basicConfig(
 )
 
 
+def run_worker(listener: socket.socket, compact: bool) -> None:
+    # Each worker needs its own connections to the shared store.
+    api.bank_instance = Bank()
+    api.idempotency_keys = IdempotencyStore.from_env(os.environ)
+    compaction_period = os.getenv("SNAPSHOT_COMPACTION_PERIOD")
+    if compaction_period and compact:
+        api.bank_instance.run_snapshot_compaction(float(compaction_period))
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, bankingapi, threaded=True, fd=listener.fileno())
+    server.serve_forever()
+
+
+def serve(host: str, port: int, workers: int) -> None:
+    """Serve the api from several processes that accept on one shared socket."""
+    if workers > 1 and not os.getenv("PERSISTENCE_MODULE"):
+        sys.exit("Multiple workers need a shared store, e.g. PERSISTENCE_MODULE=eventsourcing.sqlite")
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1024)
+    listener.set_inheritable(True)
+
+    # Snapshots are compacted by the first worker only, so workers don't race each other to take them.
+    processes = [Process(target=run_worker, args=(listener, n == 0), daemon=True) for n in range(workers)]
+    for process in processes:
+        process.start()
+    logging.warning("Serving on http://%s:%d with %d workers", host, port, workers)
+
+    def stop(signum: int, frame: object) -> None:
+        raise KeyboardInterrupt
+
+    # Take the workers down with us when asked to stop.
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
 if __name__ == "__main__":
-    bankingapi.run(debug=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "0")),
+                        help="run N production worker processes instead of the debug server")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5000")))
+    args = parser.parse_args()
+
+    if args.workers:
+        serve(args.host, args.port, args.workers)
+    else:
+        compaction_period = os.getenv("SNAPSHOT_COMPACTION_PERIOD")
+        if compaction_period:
+            bank_instance.run_snapshot_compaction(float(compaction_period))
+        bankingapi.run(debug=True)
@@ -0,0 +1,123 @@
+# coding=utf-8
+
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Iterator, List, Tuple
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from eventsourcing.persistence import Notification
+
+from banking import partitions
+from banking.applicationmodel import Bank
+from banking.analytics import LedgerAnalytics
+from banking.domainmodel import Account
+
+DAY0 = datetime(2026, 6, 28, 9, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def clock() -> Iterator[List[datetime]]:
+    """The time events are stamped with, which tests move on."""
+    now = [DAY0]
+    with patch.object(Account.Event, "create_timestamp", staticmethod(lambda: now[0])):
+        yield now
+
+
+def test_daily_aggregates(clock: List[datetime]) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.set_overdraft_limit(alice, 1000)
+    app.set_overdraft_limit(bob, 100)
+    app.deposit(alice, 500)
+    clock[0] = DAY0 + timedelta(days=1)
+    app.withdraw(alice, 1200)  # 70% of the limit
+    app.withdraw(bob, 100)  # all of it
+    clock[0] = DAY0 + timedelta(days=2, hours=14)
+    app.set_overdraft_limit(bob, 50)  # now over it
+    clock[0] = DAY0 + timedelta(days=4)
+    app.deposit(alice, 1000)
+
+    daily = app.get_daily_aggregates()
+    assert daily.days.tolist() == [(DAY0 + timedelta(days=n)).date() for n in range(5)]
+    assert daily.credits.tolist() == [500, 0, 0, 0, 1000]
+    assert daily.debits.tolist() == [0, 1300, 0, 0, 0]
+    assert daily.net_flow.tolist() == [500, -1300, 0, 0, 1000]
+    assert daily.accounts_in_overdraft.tolist() == [0, 2, 2, 2, 1]
+    assert daily.utilization.tolist() == [
+        [0, 0, 0, 0, 0],
+        [0, 0, 1, 1, 0],
+        [0, 0, 1, 0, 1],
+        [0, 0, 1, 0, 1],
+        [0, 0, 0, 0, 1],
+    ]
+
+
+def test_compressed_events(clock: List[datetime]) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024", "COMPRESSOR_TOPIC": "eventsourcing.compressor:ZlibCompressor"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit(alice, 500)
+    clock[0] = DAY0 + timedelta(days=1)
+    app.withdraw(alice, 200)
+
+    daily = app.get_daily_aggregates()
+    assert daily.credits.tolist() == [500, 0]
+    assert daily.debits.tolist() == [0, 200]
+
+
+def test_overdrawn_without_a_limit_and_back_within_a_day(clock: List[datetime]) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.set_overdraft_limit(alice, 100)
+    app.withdraw(alice, 100)
+    app.set_overdraft_limit(alice, 0)  # overdrawn with no limit
+    app.deposit(alice, 40)
+    clock[0] = DAY0 + timedelta(days=1)
+    app.deposit(alice, 100)
+    app.set_overdraft_limit(alice, 100)
+    app.withdraw(alice, 50)  # overdrawn again during the day
+    app.deposit(alice, 20)  # but not at the end of it
+
+    daily = app.analytics.daily()
+    assert daily.accounts_in_overdraft.tolist() == [1, 0]
+    assert daily.utilization.tolist() == [[0, 0, 0, 0, 1], [0, 0, 0, 0, 0]]
+
+
+def test_loads_in_chunks_and_catches_up(clock: List[datetime]) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    assert app.analytics.daily().days.size == 0
+    assert app.analytics.daily().utilization.shape == (0, 5)
+
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    with patch.object(LedgerAnalytics, "page_size", 3), patch.object(LedgerAnalytics, "chunk_size", 5):
+        app.apply_batch([{"type": "deposit", "account_id": alice, "amount": n} for n in range(1, 13)])
+        columns = app.analytics.columns()
+        assert len(app.analytics.chunks) == 1
+        assert columns.amount.tolist() == list(range(1, 13))
+        assert columns.account.dtype == np.int32
+        assert app.analytics.account_ids == [alice]
+
+        app.withdraw(alice, 8)
+        assert app.analytics.daily().net_flow.tolist() == [70]
+    assert app.analytics.position == app.recorder.max_notification_id()
+
+
+def test_catches_up_again_after_a_failed_read(clock: List[datetime]) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    for _ in range(6):
+        app.deposit(alice, 100)
+    pages = partitions.pages
+
+    def fail_after_two_pages(*args: Any, **kwargs: Any) -> Iterator[Tuple[List[Notification], int]]:
+        yield from islice(pages(*args, **kwargs), 2)
+        raise sqlite3.OperationalError("database is locked")
+
+    with patch.object(LedgerAnalytics, "page_size", 2):
+        with patch.object(partitions, "pages", fail_after_two_pages), pytest.raises(sqlite3.OperationalError):
+            app.analytics.catch_up()
+        assert app.analytics.position == 0
+        assert app.analytics.columns().amount.sum() == 600
@@ -1,5 +1,11 @@
+import json
+from uuid import uuid4
+
 import pytest
-from banking.api import app, bank_instance as bank
+from eventsourcing.persistence import IntegrityError
+from flask_jwt import _default_jwt_encode_handler
+from banking.api import app, bank_instance as bank, idempotency_keys, verified_tokens, User, _idempotency_scope
+from banking.idempotency import digest
 from unittest.mock import patch
 
 
@@ -44,6 +50,17 @@ def test_login_success(client):
     assert response.json['msg'] == "Logged in successfully"
 
 
+def test_login_with_token_encoded_as_str(client):
+    # Later versions of PyJWT encode tokens as str rather than bytes.
+    with patch('banking.api._default_jwt_encode_handler', return_value='a.b.c'):
+        response = client.post('/api/v1/login', json={
+            'email_address': 'alice@example.com',
+            'password': 'Alice123!'
+        })
+    assert response.status_code == 200
+    assert response.json['access_token'] == 'a.b.c'
+
+
 def test_login_failure(client):
     # Set up: Ensure an account with bob@example.com exists
     client.post('/api/v1/signup', json={
@@ -328,9 +345,418 @@ def test_get_account_details_generic_exception(client):
     # Assume you have functions to setup mock accounts and get a valid JWT token
     token = obtain_jwt_token(client, source_email, source_password)
 
-    # Assuming that bank().get_account is the method that might throw an unexpected exception.
-    with patch('banking.api.bank_instance.get_account', side_effect=Exception("Some generic error")):
+    # Assuming that bank().get_balance is the method that might throw an unexpected exception.
+    with patch('banking.api.bank_instance.get_balance', side_effect=Exception("Some generic error")):
         response = client.get('/api/v1/account', headers={"Authorization": f"JWT {token}"})
 
         assert response.status_code == 400
         assert response.json["msg"] == "Some generic error"
+
+
+def test_batch(client):
+    email = 'nomiikm@gmail.com'
+    password = 'admin@123'
+    account_id = str(bank.get_account_id_by_email(email))
+    other_account_id = str(bank.get_account_id_by_email('nomiikzz@gmail.com'))
+    token = obtain_jwt_token(client, email, password)
+    headers = {'Authorization': f'JWT {token}'}
+    balance = bank.get_balance(bank.get_account_id_by_email(email))
+
+    response = client.post('/api/v1/batch', headers=headers, json={'postings': [
+        {'type': 'deposit', 'account_id': account_id, 'amount': 300},
+        {'type': 'withdraw', 'account_id': account_id, 'amount': 100},
+        {'type': 'transfer', 'source_account_id': account_id, 'target_account_id': other_account_id, 'amount': 100},
+        {'type': 'withdraw', 'account_id': account_id, 'amount': 10000000},
+        {'type': 'deposit', 'account_id': 'not-a-uuid', 'amount': 100},
+    ]})
+
+    assert response.status_code == 200
+    assert response.json['msg'] == "Batch applied"
+    assert [result['status'] for result in response.json['results']] == ['ok', 'ok', 'ok', 'error', 'error']
+    assert response.json['results'][3]['error'] == "Insufficient funds"
+    assert bank.get_balance(bank.get_account_id_by_email(email)) == balance + 100
+
+
+def test_batch_invalid_postings(client):
+    email = 'nomiikm@gmail.com'
+    password = 'admin@123'
+    token = obtain_jwt_token(client, email, password)
+    headers = {'Authorization': f'JWT {token}'}
+
+    response = client.post('/api/v1/batch', headers=headers, json={'postings': 'deposit'})
+    assert response.status_code == 400
+    assert response.json['error'] == "postings must be a list of objects"
+
+    response = client.post('/api/v1/batch', headers=headers, json={'postings': [1, 2]})
+    assert response.status_code == 400
+
+
+def test_batch_generic_exception(client):
+    email = 'nomiikm@gmail.com'
+    password = 'admin@123'
+    token = obtain_jwt_token(client, email, password)
+
+    with patch('banking.api.bank_instance.apply_batch', side_effect=Exception("Some generic error")):
+        response = client.post('/api/v1/batch', headers={"Authorization": f"JWT {token}"}, json={
+            'postings': []
+        })
+
+        assert response.status_code == 400
+        assert response.json["msg"] == "Some generic error"
+
+
+def test_batch_stream(client):
+    email = 'nomiikm@gmail.com'
+    password = 'admin@123'
+    account_id = str(bank.get_account_id_by_email(email))
+    token = obtain_jwt_token(client, email, password)
+    headers = {'Authorization': f'JWT {token}'}
+    balance = bank.get_balance(bank.get_account_id_by_email(email))
+
+    lines = [json.dumps({'type': 'deposit', 'account_id': account_id, 'amount': 10})] * 5
+    lines += ['', '{not json', '[1]', json.dumps({'type': 'withdraw', 'account_id': account_id, 'amount': 10000000})]
+    body = '\n'.join(lines) + '\n'
+
+    with patch.dict(app.config, {'BATCH_STREAM_CHUNK_SIZE': 2}), \
+            patch('banking.api.bank_instance.apply_batch', wraps=bank.apply_batch) as apply_batch:
+        response = client.post('/api/v1/batch/stream', headers=headers, data=body,
+                               content_type='application/x-ndjson')
+        results = [json.loads(line) for line in response.data.decode().splitlines()]
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert [result['line'] for result in results] == [1, 2, 3, 4, 5, 7, 8, 9]
+    assert [result['status'] for result in results] == ['ok'] * 5 + ['error'] * 3
+    assert results[6]['error'] == "posting must be an object"
+    assert results[7]['error'] == "Insufficient funds"
+    # Postings were applied in chunks of at most two lines.
+    assert [len(call.args[0]) for call in apply_batch.call_args_list] == [2, 2, 1, 1]
+    assert bank.get_balance(bank.get_account_id_by_email(email)) == balance + 50
+
+
+def test_batch_stream_generic_exception(client):
+    email = 'nomiikm@gmail.com'
+    password = 'admin@123'
+    account_id = str(bank.get_account_id_by_email(email))
+    token = obtain_jwt_token(client, email, password)
+    body = json.dumps({'type': 'deposit', 'account_id': account_id, 'amount': 10}) + '\n'
+
+    with patch('banking.api.bank_instance.apply_batch', side_effect=Exception("Some generic error")):
+        response = client.post('/api/v1/batch/stream', headers={"Authorization": f"JWT {token}"},
+                               data=body, content_type='application/x-ndjson')
+
+    assert response.status_code == 200
+    assert json.loads(response.data) == {'status': 'error', 'error': "Some generic error", 'line': 1}
+
+
+def test_login_closed_account(client):
+    client.post('/api/v1/signup', json={
+        'full_name': 'Closed User',
+        'email_address': 'closed@example.com',
+        'password': 'closed@123'
+    })
+    bank.close_account(bank.get_account_id_by_email('closed@example.com'))
+
+    response = client.post('/api/v1/login', json={
+        'email_address': 'closed@example.com',
+        'password': 'closed@123'
+    })
+    assert response.status_code == 401
+    assert response.json['msg'] == "Bad username or password"
+
+
+def test_token_of_closed_or_unknown_account(client):
+    client.post('/api/v1/signup', json={
+        'full_name': 'Closing User',
+        'email_address': 'closing@example.com',
+        'password': 'closing@123'
+    })
+    token = obtain_jwt_token(client, 'closing@example.com', 'closing@123')
+    headers = {"Authorization": f"JWT {token}"}
+    assert client.get('/api/v1/account', headers=headers).status_code == 200
+
+    bank.close_account(bank.get_account_id_by_email('closing@example.com'))
+    response = client.get('/api/v1/account', headers=headers)
+    assert response.status_code == 401
+    assert response.json['description'] == "Account is closed"
+
+    for account_id in [uuid4(), 'not-a-uuid']:
+        user = User()
+        user.id = str(account_id)
+        with app.app_context():
+            token = _default_jwt_encode_handler(user).decode()
+        response = client.get('/api/v1/account', headers={"Authorization": f"JWT {token}"})
+        assert response.status_code == 401
+        assert response.json['description'] == "User does not exist"
+
+
+def test_verified_tokens_are_not_decoded_again(client):
+    client.post('/api/v1/signup', json={
+        'full_name': 'Cached User',
+        'email_address': 'cached@example.com',
+        'password': 'cached@123'
+    })
+    token = obtain_jwt_token(client, 'cached@example.com', 'cached@123')
+    headers = {"Authorization": f"JWT {token}"}
+    assert client.get('/api/v1/account', headers=headers).status_code == 200
+
+    with patch.object(verified_tokens, 'decode', side_effect=AssertionError("decoded again")):
+        response = client.get('/api/v1/account', headers=headers)
+    assert response.status_code == 200
+    assert response.json['identity'] == str(bank.get_account_id_by_email('cached@example.com'))
+
+    response = client.get('/api/v1/account', headers={"Authorization": "Bearer abc"})
+    assert response.status_code == 401
+    assert response.json['description'] == "Unsupported authorization type"
+
+
+def test_jwt_auth_endpoint(client):
+    response = client.post('/auth', json={
+        'username': 'nomiikm@gmail.com',
+        'password': 'admin@123'
+    })
+    assert response.status_code == 200
+    assert 'access_token' in response.json
+
+    response = client.post('/auth', json={
+        'username': 'nomiikm@gmail.com',
+        'password': 'wrongpass'
+    })
+    assert response.status_code == 401
+
+
+def test_account_transactions(client):
+    for email in ['history-alice@example.com', 'history-bob@example.com']:
+        client.post('/api/v1/signup', json={'full_name': 'History', 'email_address': email, 'password': 'pw'})
+    alice = str(bank.get_account_id_by_email('history-alice@example.com'))
+    bob = str(bank.get_account_id_by_email('history-bob@example.com'))
+    headers = {'Authorization': f"JWT {obtain_jwt_token(client, 'history-alice@example.com', 'pw')}"}
+    for amount in [100, 200, 300]:
+        client.post('/api/v1/deposit', headers=headers, json={'account_id': alice, 'amount': amount})
+    client.post('/api/v1/transfer', headers=headers, json={
+        'source_account_id': alice, 'target_account_id': bob, 'amount': 50,
+    })
+
+    response = client.get('/api/v1/account/transactions?limit=3', headers=headers)
+    assert response.status_code == 200
+    assert [(t['type'], t['amount'], t['balance']) for t in response.json['transactions']] == [
+        ('debit', 50, 550), ('credit', 300, 600), ('credit', 200, 300),
+    ]
+    assert response.json['transactions'][0]['counterparty_id'] == bob
+
+    response = client.get(
+        f"/api/v1/account/transactions?limit=3&cursor={response.json['next_cursor']}", headers=headers
+    )
+    assert [t['amount'] for t in response.json['transactions']] == [100]
+    assert response.json['next_cursor'] is None
+
+    # Date ranges take ISO 8601 timestamps; since is inclusive, until exclusive.
+    first = response.json['transactions'][0]['timestamp']
+    response = client.get('/api/v1/account/transactions', headers=headers, query_string={'until': first})
+    assert response.json['transactions'] == []
+    response = client.get('/api/v1/account/transactions', headers=headers, query_string={
+        'since': first.replace('+00:00', 'Z'),
+    })
+    assert len(response.json['transactions']) == 4
+    response = client.get('/api/v1/account/transactions', headers=headers, query_string={
+        'since': first.replace('+00:00', ''),
+    })
+    assert len(response.json['transactions']) == 4
+
+
+def test_account_balance_at(client):
+    client.post('/api/v1/signup', json={
+        'full_name': 'Audit', 'email_address': 'audit@example.com', 'password': 'pw',
+    })
+    account_id = str(bank.get_account_id_by_email('audit@example.com'))
+    headers = {'Authorization': f"JWT {obtain_jwt_token(client, 'audit@example.com', 'pw')}"}
+    for amount in [100, 200]:
+        client.post('/api/v1/deposit', headers=headers, json={'account_id': account_id, 'amount': amount})
+    response = client.get('/api/v1/account/transactions', headers=headers)
+    first = response.json['transactions'][-1]['timestamp']
+
+    response = client.get('/api/v1/account/balance', headers=headers, query_string={'at': first})
+    assert response.status_code == 200
+    assert response.json == {'balance': '100', 'identity': account_id, 'at': first}
+    response = client.get('/api/v1/account/balance?version=3', headers=headers)
+    assert response.json == {'balance': '300', 'identity': account_id, 'version': 3}
+
+    response = client.get('/api/v1/account/balance', headers=headers, query_string={'at': '2000-01-01T00:00:00Z'})
+    assert response.status_code == 404
+    assert response.json['error'].startswith(f'Account {account_id} was not open at 2000-01-01')
+    for query in ['', 'version=x', 'at=yesterday', f'version=1&at={first}']:
+        response = client.get(f'/api/v1/account/balance?{query}', headers=headers)
+        assert response.status_code == 400
+        assert response.json['error'] == 'Give either at, an ISO 8601 timestamp, or version, an integer'
+
+    with patch('banking.api.bank_instance.get_balance_at', side_effect=Exception("Some generic error")):
+        response = client.get('/api/v1/account/balance?version=1', headers=headers)
+    assert (response.status_code, response.json) == (400, {'msg': 'Some generic error'})
+
+
+@pytest.mark.parametrize('query, error', [
+    ('limit=x', 'limit and cursor must be integers, since and until ISO 8601 timestamps'),
+    ('since=yesterday', 'limit and cursor must be integers, since and until ISO 8601 timestamps'),
+    ('limit=501', 'limit must be between 1 and 500'),
+    ('cursor=-1', 'Invalid cursor'),
+])
+def test_account_transactions_bad_query(client, query, error):
+    token = obtain_jwt_token(client, 'nomiikm@gmail.com', 'admin@123')
+
+    response = client.get(f'/api/v1/account/transactions?{query}', headers={'Authorization': f'JWT {token}'})
+
+    assert response.status_code == 400
+    assert response.json['error'] == error
+
+
+def test_account_transactions_generic_exception(client):
+    token = obtain_jwt_token(client, 'nomiikm@gmail.com', 'admin@123')
+
+    with patch('banking.api.bank_instance.get_transactions', side_effect=Exception("Some generic error")):
+        response = client.get('/api/v1/account/transactions', headers={"Authorization": f"JWT {token}"})
+
+    assert response.status_code == 400
+    assert response.json["msg"] == "Some generic error"
+
+
+def test_transfer_idempotency_key(client):
+    source_email, target_email = 'idem-alice@example.com', 'idem-bob@example.com'
+    for email in [source_email, target_email]:
+        client.post('/api/v1/signup', json={'full_name': 'Idem', 'email_address': email, 'password': 'pw'})
+    source = str(bank.get_account_id_by_email(source_email))
+    target = str(bank.get_account_id_by_email(target_email))
+    token = obtain_jwt_token(client, source_email, 'pw')
+    client.post('/api/v1/deposit', headers={'Authorization': f'JWT {token}'}, json={'account_id': source, 'amount': 500})
+    headers = {'Authorization': f'JWT {token}', 'Idempotency-Key': 'request-1'}
+    transfer = {'source_account_id': source, 'target_account_id': target, 'amount': 100}
+
+    first = client.post('/api/v1/transfer', headers=headers, json=transfer)
+    replay = client.post('/api/v1/transfer', headers=headers, json=transfer)
+
+    assert first.status_code == replay.status_code == 200
+    assert first.json == replay.json
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert bank.get_balance(bank.get_account_id_by_email(target_email)) == 100
+
+    response = client.post('/api/v1/transfer', headers=headers, json=dict(transfer, amount=200))
+    assert response.status_code == 409
+    assert response.json['error'] == "Idempotency-Key was already used with a different request"
+
+    # Once the key has been forgotten, the transfer id still makes it at most once.
+    idempotency_keys.entries.clear()
+    response = client.post('/api/v1/transfer', headers=headers, json=dict(transfer, amount=200))
+    assert response.status_code == 409
+    assert response.json['error'] == f"Transfer {first.json['transfer_id']} was already made with different details"
+    idempotency_keys.entries.clear()
+    response = client.post('/api/v1/transfer', headers=headers, json=transfer)
+    assert response.json == first.json
+    assert 'Idempotent-Replayed' not in response.headers
+    assert bank.get_balance(bank.get_account_id_by_email(target_email)) == 100
+
+    response = client.get('/api/v1/account/transactions?limit=1', headers=headers)
+    assert response.json['transactions'][0]['transfer_id'] == first.json['transfer_id']
+
+
+def test_deposit_and_withdraw_idempotency_keys(client):
+    email = 'idem-carol@example.com'
+    client.post('/api/v1/signup', json={'full_name': 'Carol', 'email_address': email, 'password': 'pw'})
+    account_id = bank.get_account_id_by_email(email)
+    token = obtain_jwt_token(client, email, 'pw')
+    deposit = {'account_id': str(account_id), 'amount': 500}
+
+    for _ in range(3):
+        response = client.post('/api/v1/deposit', json=deposit,
+                               headers={'Authorization': f'JWT {token}', 'Idempotency-Key': 'deposit-1'})
+        assert response.json == {"msg": "Amount deposited successfully", "data": 500}
+    # The same key means another request on another endpoint.
+    with patch('banking.api.bank_instance.withdraw') as withdraw:
+        for _ in range(2):
+            response = client.post('/api/v1/withdraw', json=deposit,
+                                   headers={'Authorization': f'JWT {token}', 'Idempotency-Key': 'deposit-1'})
+            assert response.json == {"msg": "Amount withdrawn successfully"}
+    assert withdraw.call_count == 1
+    assert bank.get_balance(account_id) == 500
+
+
+def test_idempotency_key_in_progress_and_failed(client):
+    email = 'idem-dave@example.com'
+    client.post('/api/v1/signup', json={'full_name': 'Dave', 'email_address': email, 'password': 'pw'})
+    account_id = bank.get_account_id_by_email(email)
+    token = obtain_jwt_token(client, email, 'pw')
+    headers = {'Authorization': f'JWT {token}', 'Idempotency-Key': 'deposit-2'}
+    deposit = {'account_id': str(account_id), 'amount': 100}
+    body = json.dumps(deposit)
+
+    # The client retries while the first request is still being served.
+    scope = _idempotency_scope(str(account_id), '/api/v1/deposit', 'deposit-2')
+    assert idempotency_keys.begin(scope, digest(body.encode())) is None
+    response = client.post('/api/v1/deposit', data=body, content_type='application/json', headers=headers)
+    assert response.status_code == 409
+    assert response.json['error'] == "A request with this Idempotency-Key is still in progress"
+    assert bank.get_balance(account_id) == 0
+
+    # A request that fails before answering releases its key.
+    idempotency_keys.pending.clear()
+    with pytest.raises(ValueError):
+        client.post('/api/v1/deposit', json={'account_id': 'not-a-uuid'}, headers=headers)
+    response = client.post('/api/v1/deposit', json=deposit, headers=headers)
+    assert response.status_code == 200
+    assert bank.get_balance(account_id) == 100
+
+
+def test_idempotency_key_keeps_only_final_outcomes(client):
+    email = 'idem-erin@example.com'
+    client.post('/api/v1/signup', json={'full_name': 'Erin', 'email_address': email, 'password': 'pw'})
+    account_id = bank.get_account_id_by_email(email)
+    token = obtain_jwt_token(client, email, 'pw')
+    deposit = {'account_id': str(account_id), 'amount': 100}
+
+    # A conflict that outlasted the retries releases the key, so the retry runs.
+    headers = {'Authorization': f'JWT {token}', 'Idempotency-Key': 'deposit-3'}
+    with patch('banking.api.bank_instance.deposit', side_effect=IntegrityError("conflict")):
+        response = client.post('/api/v1/deposit', json=deposit, headers=headers)
+    assert (response.status_code, response.json) == (400, {"msg": "conflict"})
+    response = client.post('/api/v1/deposit', json=deposit, headers=headers)
+    assert response.status_code == 200
+    assert 'Idempotent-Replayed' not in response.headers
+    assert bank.get_balance(account_id) == 100
+
+    # A rejection is kept, and replayed even once the request would succeed.
+    headers = {'Authorization': f'JWT {token}', 'Idempotency-Key': 'withdraw-1'}
+    withdraw = dict(deposit, amount=500)
+    response = client.post('/api/v1/withdraw', json=withdraw, headers=headers)
+    assert (response.status_code, response.json) == (400, {"msg": "Insufficient funds"})
+    client.post('/api/v1/deposit', json=dict(deposit, amount=1000), headers={'Authorization': f'JWT {token}'})
+    response = client.post('/api/v1/withdraw', json=withdraw, headers=headers)
+    assert (response.status_code, response.json) == (400, {"msg": "Insufficient funds"})
+    assert response.headers['Idempotent-Replayed'] == 'true'
+    assert bank.get_balance(account_id) == 1100
+
+
+def test_metrics_and_server_timing(client):
+    client.post('/api/v1/signup', json={
+        'full_name': 'Timed', 'email_address': 'timed@example.com', 'password': 'timed@123'
+    })
+    token = obtain_jwt_token(client, 'timed@example.com', 'timed@123')
+    account_id = client.get('/api/v1/account', headers={'Authorization': f'JWT {token}'}).json['identity']
+
+    with patch.dict(app.config, {"SERVER_TIMING": True}):
+        response = client.post('/api/v1/deposit', headers={'Authorization': f'JWT {token}'}, json={
+            'account_id': account_id, 'amount': 100
+        })
+    assert response.status_code == 200
+    phases = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    assert phases == ['jwt', 'json', 'store', 'bank', 'total']
+    assert 'Server-Timing' not in client.get('/api/v1/account', headers={'Authorization': f'JWT {token}'}).headers
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_request_duration_seconds_count{method="POST",route="/api/v1/deposit",status="200"}' in text
+    assert 'http_request_phase_seconds_total{phase="jwt",route="/api/v1/deposit"}' in text
+    assert 'bank_call_duration_seconds_bucket{call="deposit",le="+Inf"}' in text
+    assert 'bank_store_round_trips_total{call="deposit"}' in text
+    client.get('/nowhere')
+    assert 'route="unmatched",status="404"' in client.get('/metrics').get_data(as_text=True)
@@ -1,15 +1,19 @@
 # coding=utf-8
 
 import typing
+from pathlib import Path
+from unittest.mock import patch
 from uuid import UUID
 
 import pytest
+from eventsourcing.persistence import IntegrityError, OperationalError
 
 from banking.applicationmodel import Bank, AccountNotFoundError
 from banking.domainmodel import (
     AccountClosedError,
     InsufficientFundsError,
     BadCredentials,
+    TransactionError,
 )
 
 
@@ -380,3 +384,299 @@ def test_close_already_closed_account() -> None:
         alice_account.close()
 
     assert str(exception_info.value) == "Account is already closed."
+
+
+def test_snapshotting_interval() -> None:
+    app = Bank(env={"SNAPSHOTTING_INTERVAL": "3"})
+    assert app.snapshots is not None
+
+    # Opened plus two credits makes version 3, which gets a snapshot.
+    alice = _create_alice_with_200(app)
+    snapshots = list(app.snapshots.get(alice))
+    assertEqual([s.originator_version for s in snapshots], [3])
+
+    # Reconstruction starts from the snapshot.
+    app.withdraw(debit_account_id=alice, amount_in_cents=5000)
+    assertEqual(app.get_balance(alice), 15000)
+
+
+def test_snapshotting_disabled() -> None:
+    app = Bank(env={"SNAPSHOTTING_INTERVAL": "0"})
+    assert app.snapshots is not None
+
+    alice = _create_alice_with_200(app)
+    assertEqual(list(app.snapshots.get(alice)), [])
+    assertEqual(app.get_balance(alice), 20000)
+
+
+def test_compact_snapshots() -> None:
+    app = Bank(env={"SNAPSHOTTING_INTERVAL": "0"})
+    assert app.snapshots is not None
+
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+
+    # Both accounts have new events, so both get snapshots.
+    assertEqual(app.compact_snapshots(), 2)
+    assertEqual([s.originator_version for s in app.snapshots.get(alice)], [3])
+
+    # Nothing has happened since the last pass.
+    assertEqual(app.compact_snapshots(), 0)
+
+    # Only bob has moved, and only by one event.
+    app.deposit(credit_account_id=bob, amount_in_cents=100)
+    assertEqual(app.compact_snapshots(min_events=2), 0)
+    app.deposit(credit_account_id=bob, amount_in_cents=100)
+    assertEqual(app.compact_snapshots(min_events=2), 1)
+    assertEqual(app.get_balance(bob), 400)
+    assertEqual(app.get_balance(alice), 20000)
+
+    # Transfer records are never snapshotted, only the accounts.
+    app.transfer(debit_account_id=alice, credit_account_id=bob, amount_in_cents=100)
+    assertEqual(app.compact_snapshots(), 2)
+
+
+def test_run_snapshot_compaction() -> None:
+    app = Bank(env={"SNAPSHOTTING_INTERVAL": "0"})
+    assert app.snapshots is not None
+
+    alice = _create_alice_with_200(app)
+    thread = app.run_snapshot_compaction(period=0.01)
+    for _ in range(100):
+        if list(app.snapshots.get(alice)):
+            break
+        thread.join(0.01)
+    app.close()
+    thread.join(1)
+
+    assert not thread.is_alive()
+    assertEqual([s.originator_version for s in app.snapshots.get(alice)], [3])
+
+
+def test_snapshot_compaction_races_and_failures(caplog: pytest.LogCaptureFixture) -> None:
+    app = Bank(env={"SNAPSHOTTING_INTERVAL": "0"})
+    assert app.snapshots is not None
+    alice = _create_alice_with_200(app)
+
+    # Another worker takes the snapshot between our look and our take.
+    app.take_snapshot(alice, version=3)
+    with patch.object(app.snapshots, "get", return_value=iter([])):
+        assertEqual(app.compact_snapshots(), 1)
+    assertEqual([s.originator_version for s in app.snapshots.get(alice)], [3])
+
+    # A pass that fails is logged, and done again next period.
+    app.deposit(credit_account_id=alice, amount_in_cents=100)
+    select_notifications = app.recorder.select_notifications
+    failures = [OperationalError("database is locked")]
+
+    def fail_once(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        if failures:
+            raise failures.pop()
+        return select_notifications(*args, **kwargs)
+
+    with patch.object(app.recorder, "select_notifications", side_effect=fail_once):
+        thread = app.run_snapshot_compaction(period=0.01)
+        for _ in range(100):
+            if len(list(app.snapshots.get(alice))) == 2:
+                break
+            thread.join(0.01)
+        app.close()
+        thread.join(1)
+
+    assertEqual([s.originator_version for s in app.snapshots.get(alice)], [3, 4])
+    assert "Snapshot compaction failed" in caplog.text
+
+
+def test_apply_batch() -> None:
+    app = Bank()
+
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    sue = _create_sue(app)
+    app.close_account(sue)
+    nobody = app.get_account_id_by_email("nobody@example.com")
+
+    results = app.apply_batch([
+        {"type": "deposit", "account_id": alice, "amount": 500},
+        {"type": "withdraw", "account_id": str(bob), "amount": 50},
+        {"type": "transfer", "source_account_id": alice, "target_account_id": bob, "amount": 1000},
+        {"type": "transfer", "source_account_id": bob, "target_account_id": alice, "amount": 100000},
+        {"type": "deposit", "account_id": alice, "amount": -1},
+        {"type": "withdraw", "account_id": alice, "amount": 0},
+        {"type": "deposit", "account_id": sue, "amount": 100},
+        {"type": "withdraw", "account_id": sue, "amount": 100},
+        {"type": "transfer", "source_account_id": alice, "target_account_id": sue, "amount": 100},
+        {"type": "deposit", "account_id": nobody, "amount": 100},
+        {"type": "refund", "account_id": alice, "amount": 100},
+    ])
+
+    assertEqual(results, [
+        {"status": "ok"},
+        {"status": "ok"},
+        {"status": "ok"},
+        {"status": "error", "error": "Insufficient funds"},
+        {"status": "error", "error": "Invalid deposit amount"},
+        {"status": "error", "error": "Invalid withdraw amount"},
+        {"status": "error", "error": "AccountClosedError"},
+        {"status": "error", "error": "AccountClosedError"},
+        {"status": "error", "error": "AccountClosedError"},
+        {"status": "error", "error": f"No account found with ID: {nobody}"},
+        {"status": "error", "error": "Unknown posting type: refund"},
+    ])
+
+    # Check balances.
+    assertEqual(app.get_balance(alice), 19500)
+    assertEqual(app.get_balance(bob), 1150)
+    assertEqual(app.get_balance(sue), 100)
+
+
+def test_apply_batch_saves_once() -> None:
+    app = Bank()
+
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    max_notification_id = app.recorder.max_notification_id()
+
+    postings = [{"type": "deposit", "account_id": alice, "amount": 1}] * 50
+    postings += [{"type": "transfer", "source_account_id": alice, "target_account_id": bob, "amount": 1}] * 50
+    with patch.object(app, "save", wraps=app.save) as save:
+        results = app.apply_batch(postings)
+    assertEqual(save.call_count, 1)
+
+    assert all(result == {"status": "ok"} for result in results)
+    # One event per deposit, and a debit, a credit and a Transfer record per transfer.
+    assertEqual(app.recorder.max_notification_id(), max_notification_id + 200)
+    assertEqual(app.get_balance(alice), 20000)
+    assertEqual(app.get_balance(bob), 250)
+
+
+def _conflicting_banks(tmp_path: Path, **env: str) -> typing.Tuple[Bank, Bank]:
+    env.update({
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    })
+    return Bank(env=env), Bank(env=env)
+
+
+def test_retry_on_conflict(tmp_path: Path) -> None:
+    app, other = _conflicting_banks(tmp_path)
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+
+    # Another process deposits into alice between our load and our save.
+    save = app.save
+    interleaved: typing.List[None] = []
+
+    def save_after_other_process(*objs: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        if not interleaved:
+            interleaved.append(other.deposit(alice, 1))
+        return save(*objs, **kwargs)
+
+    with patch.object(app, "save", side_effect=save_after_other_process) as patched:
+        app.transfer(debit_account_id=alice, credit_account_id=bob, amount_in_cents=5000)
+    assertEqual(patched.call_count, 2)
+
+    assertEqual(app.get_balance(alice), 15001)
+    assertEqual(app.get_balance(bob), 5200)
+
+
+def test_retry_on_conflict_gives_up(tmp_path: Path) -> None:
+    app, other = _conflicting_banks(tmp_path, COMMAND_MAX_ATTEMPTS="3")
+    alice = _create_alice_with_200(app)
+    save = app.save
+
+    def save_after_other_process(*objs: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        other.deposit(alice, 1)
+        return save(*objs, **kwargs)
+
+    with patch.object(app, "save", side_effect=save_after_other_process) as patched:
+        with pytest.raises(IntegrityError):
+            app.withdraw(debit_account_id=alice, amount_in_cents=100)
+    assertEqual(patched.call_count, 3)
+    assertEqual(app.get_balance(alice), 20003)
+
+
+def test_transfer_ids() -> None:
+    app = Bank()
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+
+    transfer_id = app.transfer(debit_account_id=alice, credit_account_id=bob, amount_in_cents=500)
+    transfer = app.repository.get(transfer_id)
+    assertEqual((transfer.debit_account_id, transfer.credit_account_id, transfer.amount_in_cents), (alice, bob, 500))
+
+    # Both postings carry the transfer id.
+    debit, credit = app.get_transactions(alice, limit=1)[0][0], app.get_transactions(bob, limit=1)[0][0]
+    assertEqual((debit.transfer_id, credit.transfer_id), (transfer_id, transfer_id))
+
+
+def test_transfer_is_idempotent() -> None:
+    app = Bank()
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    transfer_id = app.get_transfer_id_by_key(alice, "client-request-1")
+    assertEqual(transfer_id, app.get_transfer_id_by_key(alice, "client-request-1"))
+    assert transfer_id != app.get_transfer_id_by_key(bob, "client-request-1")
+
+    assertEqual(app.transfer(alice, bob, 500, transfer_id), transfer_id)
+    max_notification_id = app.recorder.max_notification_id()
+    assertEqual(app.transfer(alice, bob, 500, transfer_id), transfer_id)
+    assertEqual(app.recorder.max_notification_id(), max_notification_id)
+    assertEqual(app.get_balance(alice), 19500)
+
+    with pytest.raises(TransactionError, match="already made with different details"):
+        app.transfer(alice, bob, 600, transfer_id)
+    # An id that isn't a transfer can't be reused as one either.
+    with pytest.raises(TransactionError):
+        app.transfer(alice, bob, 500, alice)
+    assertEqual(app.get_balance(bob), 700)
+
+
+def test_batch_transfer_ids() -> None:
+    app = Bank()
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    transfer_id = app.transfer(alice, bob, 100)
+    new_id = str(app.get_transfer_id_by_key(alice, "batch"))
+    transfer = {"type": "transfer", "source_account_id": alice, "target_account_id": bob, "amount": 100}
+
+    results = app.apply_batch([
+        dict(transfer, transfer_id=str(transfer_id)),
+        dict(transfer, transfer_id=new_id),
+        dict(transfer, transfer_id=new_id),
+        dict(transfer, transfer_id=new_id, amount=200),
+    ])
+
+    assertEqual([result["status"] for result in results], ["ok", "ok", "ok", "error"])
+    assertEqual(app.get_balance(bob), 400)
+    assertEqual(app.repository.get(UUID(new_id)).amount_in_cents, 100)
+
+
+def test_snapshot_taken_first_elsewhere_is_not_retried() -> None:
+    app = Bank(env={"SNAPSHOTTING_INTERVAL": "5"})
+    assert app.snapshots is not None
+    alice = _create_alice_with_200(app)
+    bob = _create_bob(app)
+    record = app._record
+
+    def record_then_snapshot(processing_event: typing.Any) -> typing.Any:
+        # A concurrent snapshot writer, such as the compaction pass, takes
+        # the snapshot of a version just recorded before save() does.
+        recordings = record(processing_event)
+        for recording in recordings:
+            if recording.domain_event.originator_version == 5:
+                app.take_snapshot(recording.domain_event.originator_id, version=5)
+        return recordings
+
+    with patch.object(app, "_record", side_effect=record_then_snapshot):
+        app.deposit(credit_account_id=alice, amount_in_cents=1000)
+        app.deposit(credit_account_id=alice, amount_in_cents=1000)
+        app.deposit(credit_account_id=bob, amount_in_cents=100)
+        app.transfer(debit_account_id=bob, credit_account_id=alice, amount_in_cents=100)
+
+    # Each command ran once, though save() found its snapshot already taken.
+    assertEqual(app.get_balance(alice), 22100)
+    assertEqual(app.get_balance(bob), 200)
+    assertEqual([s.originator_version for s in app.snapshots.get(alice)], [5])
+    assertEqual([s.originator_version for s in app.snapshots.get(bob)], [5])
+    assertEqual(app.command_retry_stats()["retries"], 0)
@@ -0,0 +1,362 @@
+# coding=utf-8
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from unittest.mock import patch
+from uuid import UUID
+
+from eventsourcing.persistence import IntegrityError
+
+from banking import api, asgi
+from banking.api import bank_instance as bank, idempotency_keys
+
+
+def call(method: str, path: str, body: Any = None, token: Optional[str] = None,
+         headers: Optional[Dict[str, str]] = None, chunks: Optional[List[bytes]] = None) -> Tuple[int, Dict[str, str], bytes]:
+    """Drive the ASGI app the way a server would, returning status, headers and body."""
+    if chunks is None:
+        chunks = [b"" if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())]
+    headers = dict(headers or {})
+    if token:
+        headers["Authorization"] = f"JWT {token}"
+    path, _, query_string = path.partition("?")
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent: List[Dict[str, Any]] = []
+
+    async def receive() -> Dict[str, Any]:
+        return messages.pop(0)
+
+    async def send(message: Dict[str, Any]) -> None:
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    response_headers = {k.decode(): v.decode() for k, v in sent[0]["headers"]}
+    return sent[0]["status"], response_headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def post(path: str, body: Any = None, token: Optional[str] = None) -> Tuple[int, Any]:
+    status, _, data = call("POST", path, body, token)
+    return status, json.loads(data)
+
+
+def get(path: str, token: Optional[str] = None) -> Tuple[int, Any]:
+    status, _, data = call("GET", path, token=token)
+    return status, json.loads(data)
+
+
+def signup_and_login(email: str, password: str = "asgi@123") -> Tuple[str, str]:
+    status, data = post("/api/v1/signup", {"full_name": "Async User", "email_address": email, "password": password})
+    assert status == 200
+    status, login = post("/api/v1/login", {"email_address": email, "password": password})
+    assert status == 200
+    return data["account_id"], login["access_token"]
+
+
+def test_signup_login_and_account() -> None:
+    account_id, token = signup_and_login("asgi-alice@example.com")
+
+    status, data = get("/api/v1/account", token)
+    assert status == 200
+    assert data == {"balance": "0", "identity": account_id}
+
+    status, data = post("/api/v1/login", {"email_address": "asgi-alice@example.com", "password": "wrong"})
+    assert (status, data["msg"]) == (401, "Bad username or password")
+    status, data = post("/api/v1/login", {"email_address": "asgi-nobody@example.com", "password": "wrong"})
+    assert (status, data["error"]) == (401, "Invalid credentials")
+
+
+def test_tokens_are_interchangeable_with_flask_app() -> None:
+    account_id, _ = signup_and_login("asgi-flask@example.com")
+    client = api.app.test_client()
+    flask_token = client.post("/api/v1/login", json={
+        "email_address": "asgi-flask@example.com", "password": "asgi@123"
+    }).json["access_token"]
+
+    status, data = get("/api/v1/account", flask_token)
+    assert (status, data["identity"]) == (200, account_id)
+
+
+def test_deposit_withdraw_transfer() -> None:
+    alice, token = signup_and_login("asgi-bob@example.com")
+    bob, _ = signup_and_login("asgi-bob2@example.com")
+
+    status, data = post("/api/v1/deposit", {"account_id": alice, "amount": 1000}, token)
+    assert (status, data) == (200, {"msg": "Amount deposited successfully", "data": 1000})
+    status, data = post("/api/v1/deposit", {"account_id": alice, "amount": -1}, token)
+    assert (status, data) == (400, {"error": "Invalid deposit amount"})
+
+    status, data = post("/api/v1/withdraw", {"account_id": alice, "amount": 100}, token)
+    assert (status, data) == (200, {"msg": "Amount withdrawn successfully"})
+    status, data = post("/api/v1/withdraw", {"account_id": alice, "amount": 100000}, token)
+    assert (status, data) == (400, {"msg": "Insufficient funds"})
+
+    transfer = {"source_account_id": alice, "target_account_id": bob, "amount": 100}
+    status, data = post("/api/v1/transfer", transfer, token)
+    assert (status, data["msg"]) == (200, "Amount transferred successfully")
+    status, data = post("/api/v1/transfer", dict(transfer, amount=100000), token)
+    assert (status, data) == (400, {"error": "Insufficient funds"})
+    missing = "0db7b668-2856-4c86-83cf-a0b42c80d935"
+    status, data = post("/api/v1/transfer", dict(transfer, target_account_id=missing), token)
+    assert (status, data) == (404, {"error": f"Account not found: {missing}"})
+
+    assert bank.get_balance(bank.get_account_id_by_email("asgi-bob@example.com")) == 800
+    assert bank.get_balance(bank.get_account_id_by_email("asgi-bob2@example.com")) == 100
+
+
+def test_generic_exceptions() -> None:
+    alice, token = signup_and_login("asgi-sue@example.com")
+
+    with patch("banking.api.bank_instance.open_account", return_value=None):
+        assert post("/api/v1/signup", {"email_address": "x"}) == (400, {"msg": "Account creation failed"})
+    with patch("banking.api.bank_instance.authenticate", side_effect=Exception("boom")):
+        assert post("/api/v1/login", {"email_address": "x"}) == (400, {"error": "An error occurred: boom"})
+    with patch("banking.api.bank_instance.deposit", side_effect=Exception("boom")):
+        assert post("/api/v1/deposit", {"account_id": alice, "amount": 1}, token) == (400, {"msg": "boom"})
+    with patch("banking.api.bank_instance.transfer", side_effect=Exception("boom")):
+        transfer = {"source_account_id": alice, "target_account_id": alice, "amount": 1}
+        assert post("/api/v1/transfer", transfer, token) == (400, {"msg": "boom"})
+    with patch("banking.api.bank_instance.get_balance", side_effect=Exception("boom")):
+        assert get("/api/v1/account", token) == (400, {"msg": "boom"})
+    with patch("banking.api.bank_instance.get_transactions", side_effect=Exception("boom")):
+        assert get("/api/v1/account/transactions", token) == (400, {"msg": "boom"})
+    with patch("banking.api.bank_instance.apply_batch", side_effect=Exception("boom")):
+        assert post("/api/v1/batch", {"postings": []}, token) == (400, {"msg": "boom"})
+
+
+def test_jwt_errors() -> None:
+    status, headers, body = call("GET", "/api/v1/account")
+    assert status == 401
+    assert json.loads(body)["description"] == "Request does not contain an access token"
+    assert headers["www-authenticate"] == 'JWT realm="Login Required"'
+
+    for authorization, description in [
+        ("Bearer abc", "Unsupported authorization type"),
+        ("JWT", "Token missing"),
+        ("JWT a b", "Token contains spaces"),
+    ]:
+        status, _, body = call("GET", "/api/v1/account", headers={"Authorization": authorization})
+        assert (status, json.loads(body)["description"]) == (401, description)
+
+    status, data = get("/api/v1/account", "not-a-token")
+    assert (status, data["error"]) == (401, "Invalid token")
+
+    account_id, token = signup_and_login("asgi-closing@example.com")
+    assert get("/api/v1/account", token)[0] == 200
+    bank.close_account(UUID(account_id))
+    status, data = get("/api/v1/account", token)
+    assert (status, data["description"]) == (401, "Account is closed")
+
+
+def test_bad_requests() -> None:
+    _, token = signup_and_login("asgi-tom@example.com")
+
+    assert post("/api/v1/login", b"{not json") == (400, {"msg": "Failed to decode JSON object"})
+    assert post("/api/v1/login", [1]) == (400, {"msg": "Failed to decode JSON object"})
+    assert post("/api/v1/deposit", {"account_id": "nope", "amount": 1}, token) == (
+        500, {"msg": "Internal Server Error"})
+    assert post("/api/v1/nowhere") == (404, {"msg": "Not Found"})
+    assert get("/api/v1/login") == (405, {"msg": "Method Not Allowed"})
+
+
+def test_batch() -> None:
+    alice, token = signup_and_login("asgi-eve@example.com")
+
+    status, data = post("/api/v1/batch", {"postings": [
+        {"type": "deposit", "account_id": alice, "amount": 300},
+        {"type": "withdraw", "account_id": alice, "amount": 1000},
+    ]}, token)
+    assert status == 200
+    assert data["results"] == [{"status": "ok"}, {"status": "error", "error": "Insufficient funds"}]
+    assert post("/api/v1/batch", {"postings": "x"}, token) == (400, {"error": "postings must be a list of objects"})
+
+
+def test_batch_stream() -> None:
+    alice, token = signup_and_login("asgi-ann@example.com")
+    line = json.dumps({"type": "deposit", "account_id": alice, "amount": 10}).encode()
+    body = b"\n".join([line] * 3 + [b"{bad"] + [line] * 2) + b"\n"
+
+    # Split the body awkwardly across messages, mid-line.
+    with patch.dict(api.app.config, {"BATCH_STREAM_CHUNK_SIZE": 4}):
+        status, headers, data = call("POST", "/api/v1/batch/stream", token=token,
+                                     chunks=[body[:7], body[7:100], body[100:]])
+    results = [json.loads(result) for result in data.decode().splitlines()]
+
+    assert status == 200
+    assert headers["content-type"] == "application/x-ndjson"
+    assert [result["line"] for result in results] == [1, 2, 3, 4, 5, 6]
+    assert [result["status"] for result in results] == ["ok", "ok", "ok", "error", "ok", "ok"]
+    assert bank.get_balance(bank.get_account_id_by_email("asgi-ann@example.com")) == 50
+
+    # Lines that fill the last chunk exactly, the last without a newline.
+    with patch.dict(api.app.config, {"BATCH_STREAM_CHUNK_SIZE": 2}):
+        status, _, data = call("POST", "/api/v1/batch/stream", token=token, chunks=[line + b"\n" + line])
+    assert (status, [json.loads(result)["line"] for result in data.decode().splitlines()]) == (200, [1, 2])
+    assert bank.get_balance(bank.get_account_id_by_email("asgi-ann@example.com")) == 70
+
+
+def test_streaming_response_without_chunks() -> None:
+    async def chunks() -> AsyncIterator[str]:
+        no_chunks: List[str] = []
+        for chunk in no_chunks:
+            yield chunk
+
+    sent: List[Dict[str, Any]] = []
+
+    async def send(message: Dict[str, Any]) -> None:
+        sent.append(message)
+
+    response = asgi.StreamingResponse(chunks(), "application/x-ndjson")
+    response.headers["x-request"] = "1"
+    asyncio.run(response(send))
+    assert sent == [
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/x-ndjson"), (b"x-request", b"1")],
+        },
+        {"type": "http.response.body", "body": b""},
+    ]
+
+
+def test_lifespan() -> None:
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent: List[Dict[str, Any]] = []
+
+    async def receive() -> Dict[str, Any]:
+        return messages.pop(0)
+
+    async def send(message: Dict[str, Any]) -> None:
+        sent.append(message)
+
+    asyncio.run(asgi.app({"type": "lifespan"}, receive, send))
+    assert sent == [{"type": "lifespan.startup.complete"}, {"type": "lifespan.shutdown.complete"}]
+
+
+def test_transactions() -> None:
+    alice, token = signup_and_login("asgi-tx-alice@example.com")
+    bob, _ = signup_and_login("asgi-tx-bob@example.com")
+    post("/api/v1/deposit", {"account_id": alice, "amount": 500}, token)
+    post("/api/v1/transfer", {"source_account_id": alice, "target_account_id": bob, "amount": 200}, token)
+
+    status, data = get("/api/v1/account/transactions?limit=1", token)
+    assert status == 200
+    assert [(t["type"], t["amount"], t["balance"], t["counterparty_id"]) for t in data["transactions"]] == [
+        ("debit", 200, 300, bob),
+    ]
+    status, data = get(f"/api/v1/account/transactions?limit=1&cursor={data['next_cursor']}", token)
+    assert [(t["type"], t["counterparty_id"]) for t in data["transactions"]] == [("credit", None)]
+    assert data["next_cursor"] is None
+
+    assert get("/api/v1/account/transactions?limit=0", token)[0] == 400
+
+
+def test_balance_at() -> None:
+    alice, token = signup_and_login("asgi-audit@example.com")
+    post("/api/v1/deposit", {"account_id": alice, "amount": 500}, token)
+    post("/api/v1/deposit", {"account_id": alice, "amount": 200}, token)
+
+    assert get("/api/v1/account/balance?version=2", token) == (
+        200, {"balance": "500", "identity": alice, "version": 2})
+    assert get("/api/v1/account/balance?version=0", token)[0] == 404
+    assert get("/api/v1/account/balance", token)[0] == 400
+    with patch("banking.api.bank_instance.get_balance_at", side_effect=Exception("boom")):
+        assert get("/api/v1/account/balance?version=2", token) == (400, {"msg": "boom"})
+
+
+def test_transfer_idempotency_key() -> None:
+    alice, token = signup_and_login("asgi-idem-alice@example.com")
+    bob, _ = signup_and_login("asgi-idem-bob@example.com")
+    post("/api/v1/deposit", {"account_id": alice, "amount": 500}, token)
+    transfer = {"source_account_id": alice, "target_account_id": bob, "amount": 100}
+    headers = {"Idempotency-Key": "request-1"}
+
+    first = call("POST", "/api/v1/transfer", transfer, token, headers)
+    replay = call("POST", "/api/v1/transfer", transfer, token, headers)
+    assert first[0] == replay[0] == 200
+    assert first[2] == replay[2]
+    assert bank.get_balance(UUID(bob)) == 100
+
+    assert replay[1]["idempotent-replayed"] == "true"
+    assert bank.get_balance(UUID(bob)) == 100
+
+    status, _, data = call("POST", "/api/v1/transfer", dict(transfer, amount=200), token, headers)
+    assert status == 409
+    assert json.loads(data)["error"] == "Idempotency-Key was already used with a different request"
+
+    # The key is only forgotten by the store; the transfer id still makes it at most once.
+    idempotency_keys.entries.clear()
+    status, _, data = call("POST", "/api/v1/transfer", dict(transfer, amount=200), token, headers)
+    assert status == 409
+    assert "already made with different details" in json.loads(data)["error"]
+
+
+def test_deposit_idempotency_key() -> None:
+    alice, token = signup_and_login("asgi-idem-carol@example.com")
+    deposit = {"account_id": alice, "amount": 500}
+    headers = {"Idempotency-Key": "deposit-1"}
+
+    for _ in range(2):
+        status, _, data = call("POST", "/api/v1/deposit", deposit, token, headers)
+        assert (status, json.loads(data)) == (200, {"msg": "Amount deposited successfully", "data": 500})
+    # Requests that fail release the key.
+    status, _, _ = call("POST", "/api/v1/withdraw", b"[]", token, headers)
+    assert status == 400
+    with patch("banking.api.bank_instance.withdraw", side_effect=[None]) as withdraw:
+        for _ in range(2):
+            status, _, data = call("POST", "/api/v1/withdraw", deposit, token, headers)
+            assert (status, json.loads(data)) == (200, {"msg": "Amount withdrawn successfully"})
+    assert withdraw.call_count == 1
+    assert bank.get_balance(UUID(alice)) == 500
+
+
+def test_idempotency_key_keeps_only_final_outcomes() -> None:
+    alice, token = signup_and_login("asgi-idem-erin@example.com")
+    deposit = {"account_id": alice, "amount": 100}
+
+    # A conflict that outlasted the retries releases the key, so the retry runs.
+    headers = {"Idempotency-Key": "deposit-2"}
+    with patch("banking.api.bank_instance.deposit", side_effect=IntegrityError("conflict")):
+        status, _, data = call("POST", "/api/v1/deposit", deposit, token, headers)
+    assert (status, json.loads(data)) == (400, {"msg": "conflict"})
+    status, response_headers, _ = call("POST", "/api/v1/deposit", deposit, token, headers)
+    assert status == 200
+    assert "idempotent-replayed" not in response_headers
+    assert bank.get_balance(UUID(alice)) == 100
+
+    # A rejection is kept, and replayed even once the request would succeed.
+    headers = {"Idempotency-Key": "withdraw-1"}
+    withdraw = dict(deposit, amount=500)
+    status, _, data = call("POST", "/api/v1/withdraw", withdraw, token, headers)
+    assert (status, json.loads(data)) == (400, {"msg": "Insufficient funds"})
+    post("/api/v1/deposit", dict(deposit, amount=1000), token)
+    status, response_headers, data = call("POST", "/api/v1/withdraw", withdraw, token, headers)
+    assert (status, json.loads(data)) == (400, {"msg": "Insufficient funds"})
+    assert response_headers["idempotent-replayed"] == "true"
+    assert bank.get_balance(UUID(alice)) == 1100
+
+
+def test_metrics_and_server_timing() -> None:
+    alice, token = signup_and_login("asgi-timed@example.com")
+    with patch.dict(api.app.config, {"SERVER_TIMING": True}):
+        status, headers, _ = call("POST", "/api/v1/deposit", {"account_id": alice, "amount": 100}, token)
+        assert status == 200
+        phases = [entry.split(";")[0] for entry in headers["server-timing"].split(", ")]
+        assert phases == ["jwt", "json", "store", "bank", "total"]
+        status, headers, _ = call("POST", "/api/v1/batch/stream", b"", token)
+        assert "server-timing" in headers
+
+    status, headers, data = call("GET", "/metrics")
+    assert status == 200
+    assert headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = data.decode()
+    assert 'http_request_duration_seconds_count{method="POST",route="/api/v1/deposit",status="200"}' in text
+    assert 'bank_call_duration_seconds_count{call="deposit"}' in text
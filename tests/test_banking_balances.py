@@ -0,0 +1,151 @@
+# coding=utf-8
+
+import typing
+from pathlib import Path
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+from eventsourcing.persistence import IntegrityError
+
+from banking.applicationmodel import Bank
+from banking.balances import Balances
+from banking.domainmodel import AccountNotFoundError
+
+
+def _sqlite_env(tmp_path: Path) -> typing.Dict[str, str]:
+    return {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+    }
+
+
+def test_projection() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit(alice, 1000)
+    app.set_overdraft_limit(alice, 500)
+    app.transfer(alice, bob, 1200)
+    app.change_password(bob, "bob", "bob2")
+    app.close_account(bob)
+
+    balance = app.balances.get(alice)
+    assert (balance.balance, balance.overdraft_limit, balance.closed) == (-200, 500, False)
+    assert app.get_balance(alice) == -200
+    assert app.get_overdraft_limit(alice) == 500
+    assert app.balances.get(bob).closed
+    with pytest.raises(AccountNotFoundError):
+        app.get_balance(uuid4())
+
+    # Everything was tracked, but the password change and the Transfer record weren't projected.
+    assert app.balances.recorder.max_tracking_id(app.name) == app.recorder.max_notification_id()
+    assert app.balances.recorder.max_notification_id() == app.recorder.max_notification_id() - 2
+
+
+def test_projection_does_not_load_accounts() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit(alice, 100)
+
+    with patch.object(app.repository, "get", side_effect=AssertionError) as get:
+        assert app.get_balance(alice) == 100
+    assert get.call_count == 0
+
+
+def test_projection_resumes_after_restart(tmp_path: Path) -> None:
+    env = _sqlite_env(tmp_path)
+    app = Bank(env=env)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit(alice, 100)
+    assert app.get_balance(alice) == 100
+    app.close()
+    assert (tmp_path / "bank-balances.db").exists()
+
+    app = Bank(env=env)
+    app.deposit(alice, 50)
+    with patch.object(Balances, "policy", wraps=app.balances.policy) as policy:
+        assert app.get_balance(alice) == 150
+    # Only the deposit made since the restart was processed.
+    assert policy.call_count == 1
+
+
+def test_projection_database_can_be_named(tmp_path: Path) -> None:
+    env = dict(_sqlite_env(tmp_path), BALANCES_SQLITE_DBNAME=str(tmp_path / "read.db"))
+    app = Bank(env=env)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    assert app.get_balance(alice) == 0
+    assert (tmp_path / "read.db").exists()
+    assert not (tmp_path / "bank-balances.db").exists()
+
+
+def test_projection_shared_by_processes(tmp_path: Path) -> None:
+    env = _sqlite_env(tmp_path)
+    first = Bank(env=env)
+    second = Bank(env=env)
+    alice = first.open_account("Alice", "alice@example.com", "alice")
+
+    assert second.get_balance(alice) == 0
+    first.deposit(alice, 100)
+    second.deposit(alice, 100)
+    # Whichever follower gets there first records an event, the other skips it.
+    assert first.get_balance(alice) == 200
+    assert second.get_balance(alice) == 200
+
+
+def test_projection_pages(tmp_path: Path) -> None:
+    app = Bank(env=_sqlite_env(tmp_path))
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.apply_batch([{"type": "deposit", "account_id": alice, "amount": 1}] * 2500)
+    app.balances.pull_section_size = 1000
+    app.balances.follow(app.name, app.notification_log)
+
+    with patch.object(app.balances, "_record", wraps=app.balances._record) as record:
+        app.balances.pull_and_process(app.name)
+    # One recording per page of the log, and a snapshot every 100 events.
+    assert record.call_count == 3
+    assert app.get_balance(alice) == 2500
+    assert len(list(app.balances.snapshots.get(alice))) == 25
+
+
+def test_projection_race_with_other_process(tmp_path: Path) -> None:
+    env = _sqlite_env(tmp_path)
+    first = Bank(env=env)
+    second = Bank(env=env)
+    alice = first.open_account("Alice", "alice@example.com", "alice")
+    assert second.get_balance(alice) == 0
+    first.deposit(alice, 100)
+    pull_and_process = second.balances.pull_and_process
+
+    def pull_after_other_process(*args: typing.Any, **kwargs: typing.Any) -> None:
+        first.balances.catch_up()
+        pull_and_process(*args, **kwargs)
+
+    # The other process projects the deposit after we read the tracking position.
+    with patch.object(second.balances, "pull_and_process", side_effect=pull_after_other_process) as patched:
+        assert second.get_balance(alice) == 100
+    assert patched.call_count == 2
+
+    # A conflict that isn't explained by another process is raised.
+    first.deposit(alice, 100)
+    with patch.object(second.balances, "_record", side_effect=IntegrityError):
+        with pytest.raises(IntegrityError):
+            second.get_balance(alice)
+
+
+def test_projection_skips_events_already_projected(tmp_path: Path) -> None:
+    env = _sqlite_env(tmp_path)
+    first = Bank(env=env)
+    second = Bank(env=env)
+    alice = first.open_account("Alice", "alice@example.com", "alice")
+    first.deposit(alice, 100)
+    assert first.get_balance(alice) == 100
+    first_deposit = first.recorder.max_notification_id()
+    first.deposit(alice, 100)
+
+    # A page that overlaps what the other process projected only applies what's new.
+    second.balances.pull_and_process(second.name, start=first_deposit)
+    assert second.get_balance(alice) == 200
+    assert first.get_balance(alice) == 200
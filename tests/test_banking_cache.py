@@ -0,0 +1,103 @@
+# coding=utf-8
+
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.cache import AccountCache
+
+
+def test_cache_hits_and_misses() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    # Opening the account puts it in the cache.
+    assert app.aggregate_cache_stats()["size"] == 1
+
+    app.deposit(credit_account_id=alice, amount_in_cents=100)
+    app.deposit(credit_account_id=alice, amount_in_cents=100)
+    assert app.get_account(alice).balance == 200
+
+    stats = app.aggregate_cache_stats()
+    assert stats["hits"] == 3
+    assert stats["evictions"] == 0
+    assert stats["maxsize"] == 10000
+
+
+def test_cache_evictions() -> None:
+    app = Bank(env={"AGGREGATE_CACHE_MAXSIZE": "1"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+
+    assert app.get_account(bob).balance == 0
+    assert app.get_account(alice).balance == 0
+
+    stats = app.aggregate_cache_stats()
+    assert stats["size"] == 1
+    assert stats["evictions"] == 2
+    # Both existence checks in open_account() and the reload of alice.
+    assert stats["misses"] == 3
+
+
+def test_cached_account_is_not_shared_with_callers() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    # Unsaved changes to a loaded account must not leak into the cache.
+    account = app.get_account(alice)
+    account.credit(100)
+    assert app.get_account(alice).balance == 0
+
+
+def test_saving_events_refreshes_cache_on_next_get() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    # Saving bare events leaves the cache to be fast-forwarded on get().
+    account = app.get_account(alice)
+    account.credit(100)
+    app.save(*account.collect_events())
+    assert app.get_balance(alice) == 100
+
+
+def test_cache_sees_writes_from_other_processes(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    }
+    first = Bank(env=env)
+    second = Bank(env=env)
+
+    alice = first.open_account("Alice", "alice@example.com", "alice")
+    assert first.get_balance(alice) == 0
+    assert second.get_balance(alice) == 0
+
+    # Each bank has alice cached, the other bank's deposit is still seen.
+    second.deposit(credit_account_id=alice, amount_in_cents=500)
+    assert first.get_balance(alice) == 500
+    first.withdraw(debit_account_id=alice, amount_in_cents=200)
+    assert second.get_balance(alice) == 300
+
+
+def test_cache_disabled() -> None:
+    app = Bank(env={"AGGREGATE_CACHE_MAXSIZE": ""})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit(credit_account_id=alice, amount_in_cents=100)
+
+    assert app.repository.cache is None
+    assert app.aggregate_cache_stats() == {}
+    assert app.get_balance(alice) == 100
+
+
+def test_cache_evict_on_get() -> None:
+    cache = AccountCache(maxsize=2)
+    key = uuid4()
+    cache.put(key, "value")
+
+    assert cache.get(key, evict=True) == "value"
+    with pytest.raises(KeyError):
+        cache.get(key)
+    assert cache.stats()["hits"] == 0
+    assert cache.stats()["misses"] == 1
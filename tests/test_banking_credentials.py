@@ -0,0 +1,124 @@
+# coding=utf-8
+
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.credentials import CredentialsIndex
+from banking.domainmodel import AccountNotFoundError, BadCredentials
+
+
+def test_authenticate() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    assert app.authenticate("alice@example.com", "alice") == alice
+    with pytest.raises(BadCredentials):
+        app.authenticate("alice@example.com", "bob")
+    with pytest.raises(AccountNotFoundError):
+        app.authenticate("bob@example.com", "bob")
+
+
+def test_authenticate_does_not_load_account() -> None:
+    app = Bank(env={"AGGREGATE_CACHE_MAXSIZE": ""})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    app.get_account = None  # type: ignore
+    assert app.authenticate("alice@example.com", "alice") == alice
+
+
+def test_is_account_closed() -> None:
+    app = Bank(env={"AGGREGATE_CACHE_MAXSIZE": ""})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    app.get_account = None  # type: ignore
+    assert not app.is_account_closed(alice)
+    del app.get_account
+    app.close_account(alice)
+    assert app.is_account_closed(alice)
+    with pytest.raises(AccountNotFoundError):
+        app.is_account_closed(app.get_account_id_by_email("bob@example.com"))
+
+
+def test_credentials_follow_password_changes_and_closing() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit(credit_account_id=alice, amount_in_cents=100)
+
+    app.change_password(alice, "alice", "alice2")
+    credentials = app.credentials.get(alice)
+    assert credentials.email_address == "alice@example.com"
+    assert app.passwords.verify("alice2", credentials.password)
+    assert credentials.version == 3
+    assert not credentials.closed
+    with pytest.raises(BadCredentials):
+        app.authenticate("alice@example.com", "alice")
+    assert app.authenticate("alice@example.com", "alice2") == alice
+
+    app.close_account(alice)
+    assert app.credentials.get(alice).closed
+    assert app.credentials.get(alice).version == 4
+    with pytest.raises(BadCredentials):
+        app.authenticate("alice@example.com", "alice2")
+
+
+def test_credentials_catch_up_in_pages() -> None:
+    app = Bank()
+    app.credentials.page_size = 2
+    for name in ["alice", "bob", "sue", "tom", "eve"]:
+        app.open_account(name, f"{name}@example.com", name)
+
+    for name in ["alice", "bob", "sue", "tom", "eve"]:
+        app.authenticate(f"{name}@example.com", name)
+    assert app.credentials.position == app.recorder.max_notification_id()
+
+
+def test_credentials_see_other_processes(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+    }
+    first = Bank(env=env)
+    second = Bank(env=env)
+
+    alice = first.open_account("Alice", "alice@example.com", "alice")
+    assert second.authenticate("alice@example.com", "alice") == alice
+
+    first.change_password(alice, "alice", "alice2")
+    assert second.authenticate("alice@example.com", "alice2") == alice
+
+
+def test_credentials_resume_from_saved_position(tmp_path: Path) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    dbname = str(tmp_path / "credentials.db")
+    index = CredentialsIndex(app, dbname=dbname)
+    index.catch_up()
+    index.close()
+
+    app.change_password(alice, "alice", "alice2")
+    resumed = CredentialsIndex(app, dbname=dbname)
+    with patch.object(app.recorder, "select_notifications", wraps=app.recorder.select_notifications) as select:
+        credentials = resumed.get(alice)
+    assert select.call_args.kwargs["start"] == index.position + 1
+    assert app.passwords.verify("alice2", credentials.password)
+    assert credentials.version == 2
+    # Another process sharing the database carries on from there, and
+    # events it projects again don't undo later ones.
+    shared = CredentialsIndex(app, dbname=dbname)
+    shared.project(app.mapper.to_domain_event(app.recorder.select_notifications(1, 1)[0]))
+    assert shared.get(alice) == credentials
+    assert shared.position == resumed.position
+    resumed.close()
+    shared.close()
+
+
+def test_credentials_from_env(tmp_path: Path) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    assert CredentialsIndex.from_env(app, {}).dbname is None
+    env = {"PERSISTENCE_MODULE": "eventsourcing.sqlite", "SQLITE_DBNAME": str(tmp_path / "bank.db")}
+    assert CredentialsIndex.from_env(app, env).dbname == str(tmp_path / "bank-credentials.db")
+    env["CREDENTIALS_SQLITE_DBNAME"] = str(tmp_path / "credentials.db")
+    assert CredentialsIndex.from_env(app, env).dbname == str(tmp_path / "credentials.db")
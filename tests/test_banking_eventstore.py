@@ -0,0 +1,76 @@
+# coding=utf-8
+
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import AccountNotFoundError
+from banking.eventstore import PagedEventStore
+
+
+def _bank(**env: str) -> Bank:
+    return Bank(env=dict(
+        {"SNAPSHOTTING_INTERVAL": "0", "AGGREGATE_CACHE_MAXSIZE": "", "PASSWORD_SCRYPT_N": "1024"}, **env
+    ))
+
+
+def test_reconstruct_in_pages() -> None:
+    app = _bank(EVENTS_PAGE_SIZE="10")
+    assert isinstance(app.events, PagedEventStore)
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.apply_batch([{"type": "deposit", "account_id": alice, "amount": 1}] * 24)
+
+    with patch.object(app.recorder, "select_events", wraps=app.recorder.select_events) as select_events:
+        account = app.get_account(alice)
+    assert (account.balance, account.version) == (24, 25)
+    assert [(call.kwargs["gt"], call.kwargs["limit"]) for call in select_events.call_args_list] == [
+        (None, 10), (10, 10), (20, 10),
+    ]
+
+    # Exactly a page at the end takes one more read to find there is no more.
+    app.apply_batch([{"type": "deposit", "account_id": alice, "amount": 1}] * 5)
+    with patch.object(app.recorder, "select_events", wraps=app.recorder.select_events) as select_events:
+        assert app.get_account(alice).balance == 29
+    assert [call.kwargs["gt"] for call in select_events.call_args_list] == [None, 10, 20, 30]
+
+    # Historical versions only read up to the version.
+    assert app.repository.get(alice, version=12).balance == 11
+    with pytest.raises(AccountNotFoundError):
+        app.get_account(uuid4())
+
+
+def test_fast_forward_in_pages() -> None:
+    app = _bank(EVENTS_PAGE_SIZE="10", AGGREGATE_CACHE_MAXSIZE="10")
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    assert app.get_account(alice).balance == 0
+    # Events stored without updating the cache, as another process would.
+    account = app.get_account(alice)
+    for _ in range(15):
+        account.credit(1)
+    app.events.put(account.collect_events())
+
+    with patch.object(app.recorder, "select_events", wraps=app.recorder.select_events) as select_events:
+        assert app.get_account(alice).balance == 15
+    assert [call.kwargs["gt"] for call in select_events.call_args_list] == [1, 11]
+
+
+def test_unpaged() -> None:
+    app = _bank(EVENTS_PAGE_SIZE="0")
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.apply_batch([{"type": "deposit", "account_id": alice, "amount": 1}] * 24)
+
+    with patch.object(app.recorder, "select_events", wraps=app.recorder.select_events) as select_events:
+        assert app.get_account(alice).balance == 24
+    assert select_events.call_count == 1
+    assert select_events.call_args.kwargs["limit"] is None
+
+
+def test_descending_and_limited_reads() -> None:
+    app = _bank(EVENTS_PAGE_SIZE="10")
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.apply_batch([{"type": "deposit", "account_id": alice, "amount": 1}] * 24)
+
+    assert [e.originator_version for e in app.events.get(alice, desc=True, limit=3)] == [25, 24, 23]
+    assert len(list(app.events.get(alice, limit=15))) == 15
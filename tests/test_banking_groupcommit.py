@@ -0,0 +1,156 @@
+# coding=utf-8
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, List, Sequence
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+from eventsourcing.persistence import IntegrityError, OperationalError, StoredEvent
+from eventsourcing.sqlite import SQLiteApplicationRecorder, SQLiteDatastore
+
+from banking.applicationmodel import Bank
+from banking.groupcommit import GroupCommitRecorder
+
+
+def stored_event(originator_id: Any, version: int = 1) -> StoredEvent:
+    return StoredEvent(originator_id=originator_id, originator_version=version, topic="topic", state=b"{}")
+
+
+def make_recorder(tmp_path: Path, **kwargs: Any) -> GroupCommitRecorder:
+    recorder = GroupCommitRecorder(SQLiteDatastore(str(tmp_path / "events.db")), **kwargs)
+    recorder.create_table()
+    return recorder
+
+
+def insert(recorder: GroupCommitRecorder, stored_events: List[StoredEvent]) -> Sequence[int]:
+    notification_ids = recorder.insert_events(stored_events)
+    assert notification_ids is not None
+    return notification_ids
+
+
+class CountingCommits:
+    def __init__(self, recorder: GroupCommitRecorder):
+        self.batches: List[int] = []
+        self.commit = recorder.commit
+
+    def __call__(self, batch: List[Any]) -> None:
+        self.batches.append(len(batch))
+        self.commit(batch)
+
+
+def test_concurrent_saves_share_a_transaction(tmp_path: Path) -> None:
+    recorder = make_recorder(tmp_path, window=0.2)
+    commits = CountingCommits(recorder)
+    recorder.commit = commits  # type: ignore
+    originator_ids = [uuid4() for _ in range(4)]
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda i: insert(recorder, [stored_event(i)]), originator_ids))
+    assert sorted(n for ids in results for n in ids) == [1, 2, 3, 4]
+    assert sum(commits.batches) == 4 and len(commits.batches) < 4
+    notifications = recorder.select_notifications(1, 10)
+    assert {n.id: n.originator_id for n in notifications} == {
+        ids[0]: originator_id for originator_id, ids in zip(originator_ids, results)
+    }
+    recorder.close()
+    recorder.close()
+    assert not recorder.thread.is_alive()
+
+
+def test_conflicting_save_fails_alone(tmp_path: Path) -> None:
+    recorder = make_recorder(tmp_path, window=0.2)
+    originator_id = uuid4()
+
+    with ThreadPoolExecutor(3) as executor:
+        futures = [
+            executor.submit(recorder.insert_events, [stored_event(originator_id)]),
+            executor.submit(recorder.insert_events, [stored_event(originator_id)]),
+            executor.submit(recorder.insert_events, [stored_event(uuid4())]),
+        ]
+        errors = [future.exception() for future in futures]
+    assert [type(e) for e in errors].count(IntegrityError) == 1
+    assert errors[2] is None
+    assert len(recorder.select_notifications(1, 10)) == 2
+    recorder.close()
+
+
+def test_batch_is_committed_at_max_events(tmp_path: Path) -> None:
+    recorder = make_recorder(tmp_path, window=60, max_events=3)
+
+    with ThreadPoolExecutor(2) as executor:
+        results = list(executor.map(
+            lambda stored_events: insert(recorder, stored_events),
+            [[stored_event(uuid4()), stored_event(uuid4())], [stored_event(uuid4())]],
+        ))
+    assert sorted(len(ids) for ids in results) == [1, 2]
+    recorder.close()
+
+
+def test_close_commits_pending_saves(tmp_path: Path) -> None:
+    recorder = make_recorder(tmp_path, window=60)
+
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(recorder.insert_events, [stored_event(uuid4())])
+        while recorder.queue.qsize():
+            time.sleep(0.001)
+        recorder.close()
+        assert future.result() == [1]
+
+
+def test_failed_commit_fails_every_save(tmp_path: Path) -> None:
+    recorder = make_recorder(tmp_path, window=0)
+
+    error = OperationalError("disk I/O error")
+    with patch.object(recorder.datastore, "get_connection", side_effect=error):
+        with pytest.raises(OperationalError):
+            recorder.insert_events([stored_event(uuid4())])
+    assert recorder.insert_events([stored_event(uuid4())]) == [1]
+    recorder.close()
+
+
+def test_writer_connections_are_configured_once(tmp_path: Path) -> None:
+    recorder = make_recorder(tmp_path, window=0)
+
+    recorder.insert_events([stored_event(uuid4())])
+    recorder.insert_events([stored_event(uuid4())])
+    assert len(recorder.configured) == 1
+    with recorder.datastore.get_connection(commit=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA synchronous")
+        assert cursor.fetchone()[0] == 2  # FULL
+    recorder.close()
+
+
+def test_bank_group_commit(tmp_path: Path) -> None:
+    env = {
+        "PERSISTENCE_MODULE": "eventsourcing.sqlite",
+        "SQLITE_DBNAME": str(tmp_path / "bank.db"),
+        "PASSWORD_SCRYPT_N": "1024",
+    }
+    app = Bank(env=env)
+    assert type(app.recorder) is SQLiteApplicationRecorder
+    app.close()
+    assert type(Bank(env={"SQLITE_GROUP_COMMIT_WINDOW": "0.001"}).recorder) is not GroupCommitRecorder
+
+    app = Bank(env=dict(env, SQLITE_GROUP_COMMIT_WINDOW="0.001", SQLITE_GROUP_COMMIT_MAX_EVENTS="100"))
+    assert isinstance(app.recorder, GroupCommitRecorder)
+    assert (app.recorder.window, app.recorder.max_events) == (0.001, 100)
+    accounts = [app.open_account("Alice", f"alice{n}@example.com", "alice") for n in range(4)]
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda n: app.deposit(accounts[n % 4], 100), range(40)))
+    assert [app.get_balance(account_id) for account_id in accounts] == [1000] * 4
+    app.close()
+    assert not app.recorder.thread.is_alive()
+
+    app = Bank(env=dict(env, SQLITE_GROUP_COMMIT_WINDOW="0.001", CREATE_TABLE="no"))
+    assert app.get_balance(accounts[0]) == 1000
+    app.close()
+
+
+def test_from_env_defaults(tmp_path: Path) -> None:
+    recorder = GroupCommitRecorder.from_env(SQLiteDatastore(str(tmp_path / "events.db")), {})
+    assert (recorder.window, recorder.max_events) == (0.002, 500)
+    recorder.close()
@@ -0,0 +1,164 @@
+# coding=utf-8
+
+from datetime import timedelta
+from pathlib import Path
+from typing import Tuple
+from unittest.mock import patch
+from uuid import UUID, uuid4
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account, AccountNotFoundError
+from banking.history import TransactionHistory
+
+
+def _bank_with_alice_and_bob() -> Tuple[Bank, UUID, UUID]:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    return app, alice, bob
+
+
+def test_movements() -> None:
+    app, alice, bob = _bank_with_alice_and_bob()
+    app.deposit(alice, 1000)
+    app.transfer(alice, bob, 300)
+    app.apply_batch([{"type": "transfer", "source_account_id": bob, "target_account_id": alice, "amount": 100}])
+    app.withdraw(bob, 50)
+
+    movements, cursor = app.get_transactions(alice)
+    assert [(m.type, m.amount, m.balance, m.counterparty_id) for m in movements] == [
+        ("credit", 100, 800, bob),
+        ("debit", 300, 700, bob),
+        ("credit", 1000, 1000, None),
+    ]
+    assert cursor is None
+    movements, _ = app.get_transactions(bob)
+    assert [(m.type, m.balance, m.counterparty_id) for m in movements] == [
+        ("debit", 150, None),
+        ("debit", 200, alice),
+        ("credit", 300, alice),
+    ]
+    assert app.get_transactions(uuid4()) == ([], None)
+
+
+def test_pages() -> None:
+    app, alice, _ = _bank_with_alice_and_bob()
+    app.apply_batch([{"type": "deposit", "account_id": alice, "amount": n} for n in range(1, 26)])
+
+    amounts = []
+    cursor = None
+    while True:
+        movements, cursor = app.get_transactions(alice, limit=10, before=cursor)
+        amounts.append([m.amount for m in movements])
+        if cursor is None:
+            break
+    assert amounts == [list(range(25, 15, -1)), list(range(15, 5, -1)), list(range(5, 0, -1))]
+
+
+def test_date_range() -> None:
+    app, alice, _ = _bank_with_alice_and_bob()
+    for amount in range(1, 6):
+        app.deposit(alice, amount)
+    movements, _ = app.get_transactions(alice)
+    timestamps = [m.timestamp for m in reversed(movements)]
+
+    movements, cursor = app.get_transactions(alice, since=timestamps[1], until=timestamps[4])
+    assert [m.amount for m in movements] == [4, 3, 2]
+    movements, cursor = app.get_transactions(alice, limit=2, since=timestamps[1], until=timestamps[4])
+    assert [m.amount for m in movements] == [4, 3]
+    movements, cursor = app.get_transactions(alice, limit=2, before=cursor, since=timestamps[1])
+    assert ([m.amount for m in movements], cursor) == ([2], None)
+    assert app.get_transactions(alice, since=timestamps[-1] + timedelta(seconds=1)) == ([], None)
+
+
+def test_catch_up_in_pages() -> None:
+    app, alice, _ = _bank_with_alice_and_bob()
+    app.apply_batch([{"type": "deposit", "account_id": alice, "amount": 1}] * 25)
+
+    with patch.object(TransactionHistory, "page_size", 10):
+        movements, _ = app.get_transactions(alice, limit=100)
+    assert len(movements) == 25
+    assert movements[0].balance == 25
+    assert app.history.position == app.recorder.max_notification_id()
+
+
+def test_movements_from_before_counterparties() -> None:
+    app, alice, _ = _bank_with_alice_and_bob()
+    # An event recorded before transfers named their counterparty, as the mapper would load it.
+    event = object.__new__(Account.Credited)  # type: ignore
+    event.__dict__.update(
+        originator_id=alice, originator_version=2, timestamp=Account.Event.create_timestamp(), amount_in_cents=10,
+    )
+
+    app.history.project(event)
+    movements, _ = app.get_transactions(alice)
+    assert [(m.amount, m.counterparty_id, m.transfer_id) for m in movements] == [(10, None, None)]
+
+
+def test_resumes_from_saved_position(tmp_path: Path) -> None:
+    app, alice, bob = _bank_with_alice_and_bob()
+    app.deposit(alice, 1000)
+    app.transfer(alice, bob, 300)
+    dbname = str(tmp_path / "history.db")
+    history = TransactionHistory(app, dbname=dbname)
+    history.catch_up()
+    history.close()
+
+    app.withdraw(alice, 200)
+    resumed = TransactionHistory(app, dbname=dbname)
+    with patch.object(app.recorder, "select_notifications", wraps=app.recorder.select_notifications) as select:
+        movements, _ = resumed.page(alice, limit=10)
+    assert select.call_args.kwargs["start"] == history.position + 1
+    assert [(m.type, m.amount, m.balance) for m in movements] == [
+        ("debit", 200, 500), ("debit", 300, 700), ("credit", 1000, 1000),
+    ]
+    # Another process sharing the database carries on from there, without projecting anything twice.
+    shared = TransactionHistory(app, dbname=dbname)
+    assert shared.page(alice, limit=10) == (movements, None)
+    assert shared.position == resumed.position
+    resumed.close()
+    shared.close()
+
+
+def test_from_env(tmp_path: Path) -> None:
+    app, _, _ = _bank_with_alice_and_bob()
+    assert TransactionHistory.from_env(app, {}).dbname is None
+    env = {"PERSISTENCE_MODULE": "eventsourcing.sqlite", "SQLITE_DBNAME": str(tmp_path / "bank.db")}
+    assert TransactionHistory.from_env(app, env).dbname == str(tmp_path / "bank-history.db")
+    env["HISTORY_SQLITE_DBNAME"] = str(tmp_path / "history.db")
+    assert TransactionHistory.from_env(app, env).dbname == str(tmp_path / "history.db")
+
+
+def test_balance_at() -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024", "SNAPSHOTTING_INTERVAL": "10", "AGGREGATE_CACHE_MAXSIZE": ""})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    opened_on = app.get_account(alice).created_on
+    for amount in range(1, 31):
+        app.deposit(alice, amount)
+    app.set_overdraft_limit(alice, 500)
+    movements, _ = app.get_transactions(alice, limit=100)
+    timestamps = [m.timestamp for m in reversed(movements)]
+
+    # As of a time: after the last movement at or before it.
+    assert app.get_balance_at(alice, timestamps[24]) == sum(range(1, 26))
+    assert app.get_balance_at(alice, timestamps[24] + timedelta(microseconds=1)) == sum(range(1, 26))
+    assert app.get_balance_at(alice, timestamps[-1] + timedelta(days=1)) == sum(range(1, 31))
+    assert app.get_balance_at(alice, opened_on) == 0
+    with pytest.raises(AccountNotFoundError):
+        app.get_balance_at(alice, opened_on - timedelta(microseconds=1))
+
+    # As of a version.
+    assert app.get_balance_at(alice, 26) == sum(range(1, 26))
+    assert app.get_balance_at(alice, 1) == 0
+    assert app.get_balance_at(alice, 100) == sum(range(1, 31))
+    with pytest.raises(AccountNotFoundError):
+        app.get_balance_at(alice, 0)
+    with pytest.raises(AccountNotFoundError):
+        app.get_balance_at(uuid4(), timestamps[0])
+
+    # Loaded from the snapshot at version 20, not replayed from when it was opened.
+    with patch.object(app.events, "get", wraps=app.events.get) as get:
+        app.get_balance_at(alice, timestamps[24])
+    assert (get.call_args.kwargs["gt"], get.call_args.kwargs["lte"]) == (20, 26)
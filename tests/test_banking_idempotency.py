@@ -0,0 +1,129 @@
+# coding=utf-8
+
+from pathlib import Path
+from threading import Thread
+from unittest.mock import patch
+
+from banking.idempotency import IdempotencyStore, StoredResponse, digest
+
+FINGERPRINT = digest(b'{"amount": 100}')
+
+
+def test_reserve_finish_and_replay() -> None:
+    store = IdempotencyStore()
+    assert store.begin("alice deposit 1", FINGERPRINT) is None
+    assert store.begin("alice deposit 1", FINGERPRINT) == StoredResponse(FINGERPRINT, 0, "")
+
+    store.finish("alice deposit 1", FINGERPRINT, 200, '{"msg": "ok"}')
+    assert store.begin("alice deposit 1", FINGERPRINT) == StoredResponse(FINGERPRINT, 200, '{"msg": "ok"}')
+    assert store.begin("bob deposit 1", FINGERPRINT) is None
+
+    store.cancel("bob deposit 1")
+    assert store.begin("bob deposit 1", FINGERPRINT) is None
+
+
+def test_keys_expire_and_are_bounded() -> None:
+    store = IdempotencyStore(ttl=10, maxsize=3)
+    with patch("banking.idempotency.time.time", return_value=1000.0):
+        for n in range(5):
+            store.begin(str(n), FINGERPRINT)
+            store.finish(str(n), FINGERPRINT, 200, "{}")
+        # Only the most recent keys are kept.
+        assert len(store.entries) == 3
+        assert store.begin("0", FINGERPRINT) is None
+        assert store.begin("4", FINGERPRINT) == StoredResponse(FINGERPRINT, 200, "{}")
+
+    with patch("banking.idempotency.time.time", return_value=1011.0):
+        # Expired keys are forgotten, and evicted as new keys come in.
+        assert store.begin("4", FINGERPRINT) is None
+        assert list(store.pending) == [digest(b"0"), digest(b"4")]
+        assert not store.entries
+
+    store = IdempotencyStore(maxsize=0)
+    assert store.begin("0", FINGERPRINT) is None
+    store.finish("0", FINGERPRINT, 200, "{}")
+    assert not store.pending and not store.entries
+
+
+def test_requests_in_progress_are_not_evicted() -> None:
+    store = IdempotencyStore(maxsize=1)
+    assert store.begin("slow", FINGERPRINT) is None
+    for n in range(3):
+        store.begin(str(n), FINGERPRINT)
+        store.finish(str(n), FINGERPRINT, 200, "{}")
+
+    # A duplicate of the slow request still finds it in progress.
+    assert store.begin("slow", FINGERPRINT) == StoredResponse(FINGERPRINT, 0, "")
+    assert list(store.entries) == [digest(b"2")]
+    store.finish("slow", FINGERPRINT, 200, "{}")
+    assert list(store.entries) == [digest(b"slow")]
+    assert not store.pending
+
+
+def test_keys_shared_through_sqlite(tmp_path: Path) -> None:
+    dbname = str(tmp_path / "keys.db")
+    first = IdempotencyStore(dbname=dbname)
+    second = IdempotencyStore(dbname=dbname)
+
+    assert first.begin("alice deposit 1", FINGERPRINT) is None
+    assert second.begin("alice deposit 1", FINGERPRINT) == StoredResponse(FINGERPRINT, 0, "")
+    first.finish("alice deposit 1", FINGERPRINT, 200, '{"msg": "ok"}')
+    assert second.begin("alice deposit 1", FINGERPRINT) == StoredResponse(FINGERPRINT, 200, '{"msg": "ok"}')
+    # Now it's answered from memory.
+    with patch.object(second, "_begin_shared", side_effect=AssertionError):
+        assert second.begin("alice deposit 1", FINGERPRINT) == StoredResponse(FINGERPRINT, 200, '{"msg": "ok"}')
+
+    assert first.begin("bob deposit 1", FINGERPRINT) is None
+    first.cancel("bob deposit 1")
+    assert second.begin("bob deposit 1", FINGERPRINT) is None
+
+    # Each thread has its own connection.
+    results = []
+    thread = Thread(target=lambda: results.append(second.begin("carol deposit 1", FINGERPRINT)))
+    thread.start()
+    thread.join()
+    assert results == [None]
+    assert first.begin("carol deposit 1", FINGERPRINT) == StoredResponse(FINGERPRINT, 0, "")
+
+
+def test_expired_keys_are_purged_from_sqlite(tmp_path: Path) -> None:
+    store = IdempotencyStore(ttl=10, dbname=str(tmp_path / "keys.db"))
+    store.purge_interval = 4
+    with patch("banking.idempotency.time.time", return_value=1000.0):
+        store.begin("1", FINGERPRINT)
+        store.finish("1", FINGERPRINT, 200, "{}")
+    with patch("banking.idempotency.time.time", return_value=1011.0):
+        assert store.begin("1", FINGERPRINT) is None
+        store.begin("2", FINGERPRINT)
+    with patch("banking.idempotency.time.time", return_value=1100.0):
+        store.begin("3", FINGERPRINT)
+
+    count, = store.connection().execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()
+    assert count == 1
+
+
+def test_finish_after_the_reservation_was_purged(tmp_path: Path) -> None:
+    dbname = str(tmp_path / "keys.db")
+    first = IdempotencyStore(dbname=dbname)
+    second = IdempotencyStore(dbname=dbname)
+    with patch("banking.idempotency.time.time", return_value=1000.0):
+        assert first.begin("slow", FINGERPRINT) is None
+    with patch("banking.idempotency.time.time", return_value=1100.0):
+        # Its reservation expired while it ran, and is purged.
+        second.purge_interval = 1
+        assert second.begin("other", FINGERPRINT) is None
+        first.finish("slow", FINGERPRINT, 200, '{"msg": "ok"}')
+        assert second.begin("slow", FINGERPRINT) == StoredResponse(FINGERPRINT, 200, '{"msg": "ok"}')
+
+
+def test_from_env(tmp_path: Path) -> None:
+    store = IdempotencyStore.from_env({"IDEMPOTENCY_KEY_TTL": "60", "IDEMPOTENCY_CACHE_MAXSIZE": "100"})
+    assert (store.ttl, store.maxsize, store.dbname) == (60, 100, None)
+
+    env = {"PERSISTENCE_MODULE": "eventsourcing.sqlite", "SQLITE_DBNAME": str(tmp_path / "bank.db")}
+    assert IdempotencyStore.from_env(env).dbname == str(tmp_path / "bank-idempotency.db")
+    env["IDEMPOTENCY_SQLITE_DBNAME"] = str(tmp_path / "keys.db")
+    assert IdempotencyStore.from_env(env).dbname == str(tmp_path / "keys.db")
+    assert IdempotencyStore.from_env(dict(env, IDEMPOTENCY_SQLITE_DBNAME="")).dbname is None
+    del env["IDEMPOTENCY_SQLITE_DBNAME"]
+    assert IdempotencyStore.from_env(dict(env, SQLITE_DBNAME=":memory:")).dbname is None
@@ -0,0 +1,132 @@
+# coding=utf-8
+
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Transfer
+from banking.ledger import LedgerTotals, LedgerVerifier
+
+
+def make_bank(**env: str) -> Bank:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024", **env})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.set_overdraft_limit(alice, 500)
+    app.deposit(alice, 1000)
+    app.deposit(bob, 200)
+    app.transfer(alice, bob, 1300)
+    app.withdraw(bob, 100)
+    app.apply_batch([
+        {"type": "transfer", "source_account_id": bob, "target_account_id": alice, "amount": 50},
+        {"type": "deposit", "account_id": alice, "amount": 25},
+    ])
+    return app
+
+
+def test_incremental_verification() -> None:
+    app = make_bank()
+    verifier = LedgerVerifier(app)
+    assert verifier.catch_up() == []
+    assert verifier.totals == LedgerTotals(
+        credits=2575, debits=1450, deposits=1225, withdrawals=100, transfers=1350,
+    )
+    assert verifier.totals.balanced
+    assert verifier.state.accounts[app.get_account_id_by_email("alice@example.com")] == [-225, 500]
+    assert verifier.catch_up() == []  # nothing new
+
+    app.deposit(app.get_account_id_by_email("bob@example.com"), 5)
+    verifier.catch_up()
+    assert verifier.totals.deposits == 1230
+    assert verifier.totals.balanced
+
+
+def test_violations_are_flagged(caplog: pytest.LogCaptureFixture) -> None:
+    app = make_bank()
+    verifier = LedgerVerifier(app)
+    verifier.catch_up()
+    alice = app.get_account(app.get_account_id_by_email("alice@example.com"))
+    bob = app.get_account(app.get_account_id_by_email("bob@example.com"))
+
+    # Past the limit, by an account that doesn't check it.
+    alice.overdraft_limit = 10000
+    alice.debit(1000)
+    # A transfer whose parts don't agree, and one without a credit.
+    mismatched, incomplete = uuid4(), uuid4()
+    alice.debit(10, transfer_id=mismatched)
+    bob.credit(20, transfer_id=mismatched)
+    alice.debit(5, transfer_id=incomplete)
+    app.save(alice, bob, Transfer(mismatched, alice.id, bob.id, 10), Transfer(incomplete, alice.id, bob.id, 5))
+
+    violations = verifier.catch_up()
+    assert violations == [
+        (alice.id, "Overdrawn to -1225 with an overdraft limit of 500"),
+        (alice.id, "Overdrawn to -1235 with an overdraft limit of 500"),
+        (alice.id, "Overdrawn to -1240 with an overdraft limit of 500"),
+        (mismatched, "Transfer of 10 debited 10 and credited 20"),
+        (incomplete, "Transfer of 5 debited 5 and credited None"),
+    ]
+    assert list(verifier.violations) == violations
+    assert not verifier.totals.balanced
+    assert "Ledger violation: Transfer of 10 debited 10 and credited 20" in caplog.text
+    assert verifier.catch_up() == []
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_rescan(workers: int) -> None:
+    app = make_bank()
+    rescan = LedgerVerifier(app).rescan(workers)
+    assert rescan.totals == LedgerTotals(2575, 1450, 1225, 100, 1350)
+    assert rescan.violations == []
+    assert rescan.events == 11
+
+    bob = app.get_account(app.get_account_id_by_email("bob@example.com"))
+    transfer_id = uuid4()
+    bob.credit(20, transfer_id=transfer_id)
+    app.save(bob)
+    rescan = LedgerVerifier(app).rescan(workers)
+    assert rescan.violations == [(None, "Transfer debits, credits and amounts don't pair up")]
+    assert not rescan.totals.balanced
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_compressed_events(workers: int) -> None:
+    app = make_bank(COMPRESSOR_TOPIC="eventsourcing.compressor:ZlibCompressor")
+    verifier = LedgerVerifier(app)
+    assert verifier.catch_up() == []
+    assert verifier.totals == LedgerTotals(2575, 1450, 1225, 100, 1350)
+    rescan = verifier.rescan(workers)
+    assert (rescan.totals, rescan.violations, rescan.events) == (verifier.totals, [], 11)
+
+
+def test_resumes_from_checkpoint(tmp_path: Path) -> None:
+    app = make_bank()
+    dbname = str(tmp_path / "ledger.db")
+    verifier = LedgerVerifier(app, dbname=dbname)
+    verifier.page_size = 2
+    verifier.checkpoint_interval = 1
+    verifier.catch_up()
+    totals = verifier.totals
+    verifier.close()
+
+    resumed = LedgerVerifier(app, dbname=dbname)
+    assert (resumed.position, resumed.totals) == (verifier.position, totals)
+    assert resumed.state.accounts == verifier.state.accounts
+    alice = app.get_account_id_by_email("alice@example.com")
+    app.withdraw(alice, 275)
+    assert resumed.catch_up() == []
+    assert resumed.state.accounts[alice] == [-500, 500]
+    assert resumed.totals.withdrawals == totals.withdrawals + 275
+    resumed.close()
+
+
+def test_from_env(tmp_path: Path) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    assert LedgerVerifier.from_env(app, {}).dbname is None
+    env = {"PERSISTENCE_MODULE": "eventsourcing.sqlite", "SQLITE_DBNAME": str(tmp_path / "bank.db")}
+    assert LedgerVerifier.from_env(app, env).dbname == str(tmp_path / "bank-ledger.db")
+    env["LEDGER_SQLITE_DBNAME"] = str(tmp_path / "ledger.db")
+    assert LedgerVerifier.from_env(app, env).dbname == str(tmp_path / "ledger.db")
+    LedgerVerifier(app).close()  # nothing to close without a database
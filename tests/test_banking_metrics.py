@@ -0,0 +1,52 @@
+# coding=utf-8
+
+from banking import metrics
+from banking.applicationmodel import Bank
+from banking.metrics import Metrics
+
+
+def test_bank_calls_are_timed_and_counted() -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024", "AGGREGATE_CACHE_MAXSIZE": ""})
+    account_id = app.open_account("Alice", "alice@example.com", "alice")
+    sample = metrics.begin_request()
+    app.deposit(account_id, 100)
+    app.get_account(account_id, version=1)
+    assert metrics.end_request() is sample
+    assert set(sample.phases) == {"bank", "store"}
+    assert (sample.events_read, sample.round_trips) == (2, 3)  # deposit reads and writes, get_account reads
+
+    text = app.metrics.render()
+    assert 'bank_call_duration_seconds_count{call="deposit"} 1' in text
+    assert 'bank_call_duration_seconds_count{call="open_account"} 1' in text
+    # The get_account made by deposit is part of it, only the one made here is counted.
+    assert 'bank_call_duration_seconds_count{call="get_account"} 1' in text
+    assert 'bank_events_read_total{call="deposit"} 1' in text
+    assert 'bank_store_round_trips_total{call="deposit"} 2' in text
+    assert f'bank_bytes_written_total{{call="deposit"}} {sample.bytes_written}' in text
+    assert sample.bytes_written > 0
+
+
+def test_render() -> None:
+    registry = Metrics(buckets=(0.1, 1.0))
+    labels = (("route", '/a"b\\c\n'),)
+    registry.observe("http_request_duration_seconds", labels, 0.1)
+    registry.observe("http_request_duration_seconds", labels, 0.5)
+    registry.observe("http_request_duration_seconds", labels, 2)
+    registry.inc("http_request_phase_seconds_total", (("phase", "jwt"), ("route", "/a")), 0.25)
+    with metrics.phase("json"):  # outside a request, not timed
+        pass
+
+    assert registry.render().splitlines()[:12] == [
+        "# HELP http_request_duration_seconds Time to answer a request, by route, method and status.",
+        "# TYPE http_request_duration_seconds histogram",
+        'http_request_duration_seconds_bucket{route="/a\\"b\\\\c\\n",le="0.1"} 1',
+        'http_request_duration_seconds_bucket{route="/a\\"b\\\\c\\n",le="1.0"} 2',
+        'http_request_duration_seconds_bucket{route="/a\\"b\\\\c\\n",le="+Inf"} 3',
+        'http_request_duration_seconds_sum{route="/a\\"b\\\\c\\n"} 2.6',
+        'http_request_duration_seconds_count{route="/a\\"b\\\\c\\n"} 3',
+        "# HELP http_request_phase_seconds_total Time spent in each phase of answering requests, by route.",
+        "# TYPE http_request_phase_seconds_total counter",
+        'http_request_phase_seconds_total{phase="jwt",route="/a"} 0.25',
+        "# HELP bank_call_duration_seconds Time taken by each Bank command and query.",
+        "# TYPE bank_call_duration_seconds histogram",
+    ]
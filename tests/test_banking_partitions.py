@@ -0,0 +1,57 @@
+# coding=utf-8
+
+from uuid import uuid4
+
+from eventsourcing.compressor import ZlibCompressor
+from eventsourcing.persistence import Cipher, Mapper
+from eventsourcing.utils import get_topic
+
+from banking import partitions
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+from banking.transcoding import stored_topics
+
+
+class XorCipher(Cipher):
+    def __init__(self) -> None:
+        pass
+
+    def encrypt(self, plaintext: bytes) -> bytes:
+        return bytes(byte ^ 0x5A for byte in plaintext)
+
+    def decrypt(self, ciphertext: bytes) -> bytes:
+        return bytes(byte ^ 0x5A for byte in ciphertext)
+
+
+def test_state_decoder_decrypts_and_decompresses_like_the_mapper() -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    mapper = Mapper(app.mapper.transcoder, compressor=ZlibCompressor(), cipher=XorCipher())
+    event = Account.Credited(  # type: ignore
+        originator_id=uuid4(), originator_version=2, timestamp=Account.Event.create_timestamp(),
+        amount_in_cents=10, counterparty_id=None, transfer_id=None,
+    )
+    stored_event = mapper.to_stored_event(event)
+
+    decoded = partitions.StateDecoder.from_mapper(mapper).decode(stored_event.state)
+    assert decoded == {
+        key: value for key, value in event.__dict__.items() if key not in ("originator_id", "originator_version")
+    }
+    # Worker processes make theirs from the compressor and cipher.
+    decoder = partitions.StateDecoder(partitions.transcoder(), mapper.compressor, mapper.cipher)
+    assert decoder.decode(stored_event.state) == decoded
+
+
+def test_pages() -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    for amount in range(1, 6):
+        app.deposit(alice, amount)
+    app.close_account(alice)
+    topics = stored_topics(get_topic(Account.Credited))  # type: ignore
+
+    pages = partitions.pages(app, topics, page_size=2)
+    # The last page takes the reader past the Closed event, which it doesn't read.
+    assert [([n.id for n in notifications], position) for notifications, position in pages] == [
+        ([2, 3], 3), ([4, 5], 5), ([6], 7),
+    ]
+    assert list(partitions.pages(app, topics, 7)) == []
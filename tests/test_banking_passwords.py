@@ -0,0 +1,164 @@
+# coding=utf-8
+
+import time
+from typing import List
+from unittest.mock import patch
+from uuid import UUID
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account, BadCredentials
+from banking.passwords import PasswordHasher, legacy_hash, verify_password
+from banking.retries import RecordingConflict
+
+
+def test_hash_and_verify() -> None:
+    hasher = PasswordHasher(n=2 ** 10, verified_ttl=0)
+    password_hash = hasher.hash("alice")
+
+    assert password_hash.startswith("scrypt$1024$8$1$")
+    # Salted, so the same password hashes differently each time.
+    assert hasher.hash("alice") != password_hash
+    assert hasher.verify("alice", password_hash)
+    assert not hasher.verify("bob", password_hash)
+    assert not hasher.needs_rehash(password_hash)
+    assert PasswordHasher(n=2 ** 11).needs_rehash(password_hash)
+
+
+def test_verify_legacy_hash() -> None:
+    hasher = PasswordHasher(n=2 ** 10)
+
+    assert verify_password("alice", legacy_hash("alice"))
+    assert not verify_password("bob", legacy_hash("alice"))
+    assert hasher.needs_rehash(legacy_hash("alice"))
+
+
+def test_verified_cache() -> None:
+    hasher = PasswordHasher(n=2 ** 10, verified_ttl=0.05)
+    password_hash = hasher.hash("alice")
+    assert hasher.verify("alice", password_hash)
+    assert len(hasher.verified) == 1
+
+    # A repeat within the TTL doesn't run the KDF again.
+    hasher.executor.shutdown()
+    assert hasher.verify_async("alice", password_hash).result()
+
+    # Once the entry has expired it is dropped and verified again.
+    time.sleep(0.06)
+    with pytest.raises(RuntimeError):
+        hasher.verify("alice", password_hash)
+    assert len(hasher.verified) == 0
+
+
+def test_verified_cache_is_bounded() -> None:
+    hasher = PasswordHasher(n=2 ** 10)
+    hasher.verified_maxsize = 2
+    password_hash = hasher.hash("alice")
+    for password in ["alice", "alice", "bob", "alice"]:
+        hasher.verify(password, password_hash)
+    hasher.verify("alice", hasher.hash("alice"))
+    hasher.verify("alice", hasher.hash("alice"))
+
+    assert len(hasher.verified) == 2
+
+
+def test_from_env() -> None:
+    hasher = PasswordHasher.from_env({
+        "PASSWORD_SCRYPT_N": "2048",
+        "PASSWORD_SCRYPT_R": "4",
+        "PASSWORD_SCRYPT_P": "2",
+        "PASSWORD_HASH_WORKERS": "3",
+        "PASSWORD_VERIFIED_TTL": "0",
+    })
+
+    assert (hasher.n, hasher.r, hasher.p) == (2048, 4, 2)
+    assert hasher.executor._max_workers == 3
+    assert hasher.verified_ttl == 0
+    assert hasher.hash("alice").startswith("scrypt$2048$4$2$")
+
+
+def test_login_rehashes_legacy_password() -> None:
+    app = Bank()
+    account = Account(
+        app.get_account_id_by_email("alice@example.com"),
+        full_name="Alice",
+        email_address="alice@example.com",
+        password=legacy_hash("alice"),
+    )
+    app.save(account)
+
+    assert app.authenticate("alice@example.com", "alice") == account.id
+    password_hash = app.get_account(account.id).password
+    assert password_hash.startswith("scrypt$")
+    assert app.credentials.get(account.id).password == password_hash
+    with pytest.raises(BadCredentials):
+        app.authenticate("alice@example.com", "bob")
+    assert app.authenticate("alice@example.com", "alice") == account.id
+
+
+def test_concurrent_logins_rehash_a_legacy_password_once() -> None:
+    app = Bank()
+    account = Account(
+        app.get_account_id_by_email("alice@example.com"),
+        full_name="Alice",
+        email_address="alice@example.com",
+        password=legacy_hash("alice"),
+    )
+    app.save(account)
+    get_account = app.get_account
+    loads: List[UUID] = []
+
+    def get_account_then_another_login(account_id: UUID) -> Account:
+        loaded = get_account(account_id)
+        loads.append(account_id)
+        if len(loads) == 1:
+            # Rehashes it first, leaving this login with a stale account.
+            assert app.authenticate("alice@example.com", "alice") == account.id
+        return loaded
+
+    with patch.object(app, "get_account", get_account_then_another_login):
+        assert app.authenticate("alice@example.com", "alice") == account.id
+    assert len(loads) == 3
+    assert app.retry_policy.stats()["conflicts"] == 1
+    assert app.get_account(account.id).version == 2
+    assert app.get_account(account.id).password.startswith("scrypt$")
+
+
+def test_login_succeeds_when_the_rehash_keeps_conflicting(caplog: pytest.LogCaptureFixture) -> None:
+    app = Bank(env={"COMMAND_RETRY_BACKOFF": "0"})
+    account = Account(
+        app.get_account_id_by_email("alice@example.com"),
+        full_name="Alice",
+        email_address="alice@example.com",
+        password=legacy_hash("alice"),
+    )
+    app.save(account)
+
+    with patch.object(app, "save", side_effect=RecordingConflict("conflict")):
+        assert app.authenticate("alice@example.com", "alice") == account.id
+    assert app.retry_policy.stats()["exhausted"] == 1
+    assert "Couldn't rehash the password of account" in caplog.text
+    assert app.get_account(account.id).password == legacy_hash("alice")
+
+
+def test_legacy_password_changed_events_still_replay() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    account = app.get_account(alice)
+    account.change_password("alice", "alice2")
+    app.save(account)
+
+    assert app.get_account(alice).password == legacy_hash("alice2")
+    app.validate_password(alice, "alice2")
+    assert app.authenticate("alice@example.com", "alice2") == alice
+    assert app.get_account(alice).password.startswith("scrypt$")
+
+
+def test_change_password_with_wrong_password() -> None:
+    app = Bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+
+    with pytest.raises(BadCredentials):
+        app.change_password(alice, "bob", "alice2")
+    app.validate_password(alice, "alice")
@@ -0,0 +1,103 @@
+# coding=utf-8
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from typing import Iterator, List, Union
+from unittest.mock import patch
+from uuid import UUID
+
+import pytest
+from eventsourcing.persistence import IntegrityError
+
+from banking.applicationmodel import Bank
+from banking.retries import RecordingConflict, RetryPolicy
+
+
+@pytest.fixture
+def fast_thread_switching() -> Iterator[None]:
+    # Switch threads often, so that commands interleave between load and save.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_delay_is_jittered_and_capped() -> None:
+    policy = RetryPolicy(backoff=0.01, backoff_max=0.03)
+
+    assert all(0 <= policy.delay(1) <= 0.01 for _ in range(100))
+    assert all(0 <= policy.delay(2) <= 0.02 for _ in range(100))
+    assert all(0 <= policy.delay(10) <= 0.03 for _ in range(100))
+    assert len({policy.delay(3) for _ in range(100)}) > 1
+
+
+def test_policy_from_env() -> None:
+    policy = RetryPolicy.from_env({
+        "COMMAND_MAX_ATTEMPTS": "7",
+        "COMMAND_RETRY_BACKOFF": "0.5",
+        "COMMAND_RETRY_BACKOFF_MAX": "2",
+    })
+
+    assert (policy.max_attempts, policy.backoff, policy.backoff_max) == (7, 0.5, 2.0)
+
+
+def test_run_counts_conflicts_and_retries() -> None:
+    policy = RetryPolicy(max_attempts=3, backoff=0)
+    assert policy.stats()["conflict_rate"] == 0.0
+    outcomes: List[Union[Exception, str]] = [RecordingConflict(), "done"]
+
+    def command() -> str:
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert policy.run(command) == "done"
+
+    def always_conflicts() -> None:
+        raise RecordingConflict()
+
+    with patch("banking.retries.time.sleep") as sleep:
+        with pytest.raises(RecordingConflict):
+            policy.run(always_conflicts)
+    assert sleep.call_count == 2
+
+    # Other conflicts, as after the command's events were recorded, aren't retried.
+    def snapshot_conflicts() -> None:
+        raise IntegrityError()
+
+    with pytest.raises(IntegrityError):
+        policy.run(snapshot_conflicts)
+    assert policy.stats() == {
+        "commands": 3,
+        "conflicts": 4,
+        "retries": 3,
+        "exhausted": 1,
+        "conflict_rate": 4 / 3,
+    }
+
+
+def test_parallel_transfers_into_one_account(fast_thread_switching: None) -> None:
+    app = Bank(env={"COMMAND_MAX_ATTEMPTS": "100", "PASSWORD_SCRYPT_N": "1024"})
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+    customers = [app.open_account(f"Customer {n}", f"customer{n}@example.com", "pw") for n in range(8)]
+    for customer in customers:
+        app.deposit(customer, 10000)
+    transfers_each = 50
+    barrier = Barrier(len(customers))
+
+    def pay(customer_id: UUID) -> None:
+        barrier.wait()
+        for _ in range(transfers_each):
+            app.transfer(customer_id, merchant, 1)
+
+    with ThreadPoolExecutor(len(customers)) as pool:
+        list(pool.map(pay, customers))
+
+    assert app.get_balance(merchant) == len(customers) * transfers_each
+    assert all(app.get_balance(customer) == 10000 - transfers_each for customer in customers)
+    stats = app.command_retry_stats()
+    assert stats["exhausted"] == 0
+    assert stats["retries"] == stats["conflicts"]
+    assert stats["commands"] == len(customers) * (1 + transfers_each)
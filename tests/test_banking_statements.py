@@ -0,0 +1,130 @@
+# coding=utf-8
+
+import csv
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Tuple
+from unittest.mock import patch
+from uuid import UUID
+
+import pytest
+from eventsourcing.utils import get_topic
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+from banking.partitions import StateDecoder
+from banking.statements import Statement, StatementJob, StatementPartition
+from banking.transcoding import stored_topics
+
+
+def _bank_with_a_month(**env: str) -> Tuple[Bank, datetime, datetime, Dict[UUID, Statement]]:
+    """A bank with movements before, during and after a period, and the period."""
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024", **env})
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit(alice, 1000)
+    app.transfer(alice, bob, 100)
+    since = app.get_account(bob).modified_on + timedelta(microseconds=1)
+    app.deposit(alice, 50)
+    app.transfer(bob, alice, 30)
+    app.withdraw(bob, 20)
+    carol = app.open_account("Carol", "carol@example.com", "carol")
+    app.close_account(bob)
+    until = app.get_account(bob).modified_on + timedelta(microseconds=1)
+    app.deposit(alice, 7)
+    app.open_account("Dave", "dave@example.com", "dave")
+    # Ends with the Transfer aggregate's event, which isn't read.
+    app.transfer(alice, carol, 5)
+    return app, since, until, {
+        alice: Statement(alice, 900, 80, 0, 2, 0, 980, False),
+        bob: Statement(bob, 100, 0, 50, 0, 2, 50, True),
+        carol: Statement(carol, 0, 0, 0, 0, 0, 0, False),
+    }
+
+
+def test_statements_in_process(tmp_path: Path) -> None:
+    app, since, until, expected = _bank_with_a_month()
+
+    run = StatementJob(app).run(since, until, str(tmp_path))
+    assert (run.accounts, run.events) == (3, 15)
+    assert run.paths == [os.path.join(str(tmp_path), "statements-0.csv")]
+    assert run.accounts_per_second > 0
+    with open(run.paths[0], newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(Statement._fields)
+    assert sorted(rows[1:]) == sorted([str(value) for value in statement] for statement in expected.values())
+
+
+def test_statements_in_worker_processes(tmp_path: Path) -> None:
+    app, since, until, expected = _bank_with_a_month()
+    job = StatementJob(app, workers=2)
+    job.page_size = 1
+
+    run = job.run(since, until, str(tmp_path / "out"), format="jsonl")
+    assert (run.accounts, run.events) == (3, 15)
+    assert len(run.paths) == 2
+    statements = {}
+    for path in run.paths:
+        with open(path) as f:
+            for line in f:
+                statement = json.loads(line)
+                statements[statement["account_id"]] = statement
+    assert statements == {
+        str(account_id): {**statement._asdict(), "account_id": str(account_id)}
+        for account_id, statement in expected.items()
+    }
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_statements_of_compressed_events(tmp_path: Path, workers: int) -> None:
+    app, since, until, expected = _bank_with_a_month(COMPRESSOR_TOPIC="eventsourcing.compressor:ZlibCompressor")
+
+    run = StatementJob(app, workers=workers).run(since, until, str(tmp_path), format="jsonl")
+    assert (run.accounts, run.events) == (3, 15)
+    statements = [json.loads(line) for path in run.paths for line in open(path)]
+    assert sorted(statement["closing_balance"] for statement in statements) == [0, 50, 980]
+
+
+def test_worker_failure(tmp_path: Path) -> None:
+    app, since, until, _ = _bank_with_a_month()
+    job = StatementJob(app, workers=1)
+    job.poll_interval = 0.01
+    # Worker processes are forked with the patch in place.
+    with patch.object(StatementPartition, "add", side_effect=Exception("boom")):
+        with pytest.raises(RuntimeError, match="A worker process failed"):
+            job.run(since, until, str(tmp_path))
+
+
+def test_events_of_accounts_opened_after_the_period() -> None:
+    app, since, until, _ = _bank_with_a_month()
+    partition = StatementPartition(StateDecoder.from_mapper(app.mapper), since, until)
+    # As if the account's Opened event was stamped after the period, by a clock behind this one's.
+    notification = app.recorder.select_notifications(start=1, limit=1, topics=stored_topics(get_topic(Account.Credited)))[0]  # type: ignore
+    partition.add([(notification.originator_id, notification.topic, notification.state)])
+    assert (partition.totals, partition.events) == ({}, 1)
+
+
+def test_slow_worker(tmp_path: Path) -> None:
+    app, since, until, _ = _bank_with_a_month()
+    job = StatementJob(app, workers=1)
+    job.poll_interval = 0.01
+    write = StatementPartition.write
+
+    def slow_write(partition: StatementPartition, path: str, format: str) -> int:
+        time.sleep(0.1)
+        return write(partition, path, format)
+
+    with patch.object(StatementPartition, "write", slow_write):
+        assert job.run(since, until, str(tmp_path)).accounts == 3
+
+
+def test_no_accounts_bad_format_and_from_env(tmp_path: Path) -> None:
+    app = Bank(env={"PASSWORD_SCRYPT_N": "1024"})
+    assert StatementJob(app).run(None, None, str(tmp_path)).accounts == 0  # type: ignore
+    with pytest.raises(ValueError, match="Unknown statement format: xml"):
+        StatementJob(app).run(None, None, str(tmp_path), format="xml")  # type: ignore
+    assert StatementJob.from_env(app, {"STATEMENT_WORKERS": "0"}).workers == 0
+    assert StatementJob.from_env(app, {}).workers == (os.cpu_count() or 1)
@@ -0,0 +1,76 @@
+# coding=utf-8
+
+from typing import Any, Dict, List
+from unittest.mock import patch
+
+import jwt
+import pytest
+
+from banking.tokens import VerifiedTokens
+
+
+class Decoder:
+    def __init__(self, exp: Any = 1000.0):
+        self.exp = exp
+        self.decoded: List[str] = []
+
+    def __call__(self, token: str) -> Dict[str, Any]:
+        if token == "bad":
+            raise jwt.InvalidTokenError("Signature verification failed")
+        self.decoded.append(token)
+        payload: Dict[str, Any] = {"identity": token.upper()}
+        if self.exp is not None:
+            payload["exp"] = self.exp
+        return payload
+
+
+def identity(payload: Dict[str, Any]) -> str:
+    return payload["identity"]
+
+
+def test_verified_tokens_are_remembered_until_they_expire() -> None:
+    decode = Decoder(exp=1000.0)
+    tokens = VerifiedTokens(decode, identity)
+
+    with patch("banking.tokens.time.time", return_value=999.0):
+        assert tokens.identity("alice") == "ALICE"
+        assert tokens.identity("alice") == "ALICE"
+    assert decode.decoded == ["alice"]
+    assert list(tokens.entries) != [b"alice"]  # kept by digest
+
+    with patch("banking.tokens.time.time", return_value=1000.0):
+        assert tokens.identity("alice") == "ALICE"
+    assert decode.decoded == ["alice", "alice"]
+
+    with pytest.raises(jwt.InvalidTokenError):
+        tokens.identity("bad")
+    assert len(tokens.entries) == 1
+
+
+def test_verified_tokens_without_exp_are_not_remembered() -> None:
+    decode = Decoder(exp=None)
+    tokens = VerifiedTokens(decode, identity)
+
+    tokens.identity("alice")
+    tokens.identity("alice")
+    assert decode.decoded == ["alice", "alice"]
+    assert not tokens.entries
+
+
+def test_verified_tokens_evict_least_recently_used() -> None:
+    decode = Decoder(exp=float("inf"))
+    tokens = VerifiedTokens(decode, identity, maxsize=2)
+
+    for token in ["a", "b", "a", "c", "a", "b"]:
+        tokens.identity(token)
+    assert decode.decoded == ["a", "b", "c", "b"]
+    assert len(tokens.entries) == 2
+
+
+def test_verified_tokens_from_env() -> None:
+    decode = Decoder()
+    assert VerifiedTokens.from_env(decode, identity, {}).maxsize == 100000
+    tokens = VerifiedTokens.from_env(decode, identity, {"JWT_VERIFIED_CACHE_MAXSIZE": "0"})
+    assert tokens.maxsize == 0
+    tokens.identity("alice")
+    assert not tokens.entries
@@ -0,0 +1,144 @@
+# coding=utf-8
+
+import random
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict
+from uuid import uuid4
+
+import pytest
+from eventsourcing.persistence import JSONTranscoder
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import Account
+from banking.transcoding import CompactTranscoder, TOPIC_CODES, stored_topics
+
+STATE: Dict[str, Any] = {
+    "timestamp": datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+    "amount_in_cents": 12345,
+    "counterparty_id": uuid4(),
+    "transfer_id": None,
+    "unknown_field": "héllo",
+    "nested": {"negative": -70000, "flags": [True, False], "pair": (1.5, Decimal("0.10"))},
+    "before_epoch": datetime(1900, 1, 1, tzinfo=timezone.utc),
+    "naive": datetime(2024, 5, 1, 12, 30),
+    "offset": datetime(2024, 5, 1, 12, 30, tzinfo=timezone(timedelta(hours=2))),
+    "topic": "banking.domainmodel:Account",
+}
+
+
+def _sqlite_env(tmp_path: Path, **env: str) -> Dict[str, str]:
+    return dict(
+        {"EVENT_TRANSCODER": "json", "EVENT_COMPRESSION": ""},
+        PERSISTENCE_MODULE="eventsourcing.sqlite",
+        SQLITE_DBNAME=str(tmp_path / "bank.db"),
+        PASSWORD_SCRYPT_N="1024",
+        **env,
+    )
+
+
+def test_round_trip() -> None:
+    transcoder = CompactTranscoder()
+    data = transcoder.encode(STATE)
+    assert transcoder.decode(data) == dict(STATE, nested=dict(STATE["nested"], pair=[1.5, Decimal("0.10")]))
+
+    state = transcoder.decode(transcoder.encode({"timestamp": STATE["timestamp"]}))
+    assert state["timestamp"].tzinfo == timezone.utc
+    # Subclasses are encoded as their base type.
+    assert transcoder.decode(transcoder.encode(OrderedDict(closed=True))) == {"closed": True}
+
+
+def test_smaller_than_json() -> None:
+    state = {"timestamp": Account.Event.create_timestamp(), "amount_in_cents": 100,
+             "counterparty_id": uuid4(), "transfer_id": uuid4()}
+    json_transcoder = Bank(env={"EVENT_TRANSCODER": "json"}).mapper.transcoder
+    assert len(CompactTranscoder().encode(state)) < len(json_transcoder.encode(state)) / 3
+
+
+def test_compression() -> None:
+    state = {"full_name": "x" * 1000}
+    raw = CompactTranscoder().encode(state)
+    for compression in ["zlib", "lzma"]:
+        transcoder = CompactTranscoder(compression=compression)
+        data = transcoder.encode(state)
+        assert len(data) < len(raw) / 10
+        assert transcoder.decode(data) == state
+        # State is left uncompressed when that's smaller.
+        for incompressible in [{"closed": True}, {"values": [random.random() for _ in range(20)]}]:
+            assert transcoder.encode(incompressible) == CompactTranscoder().encode(incompressible)
+
+
+def test_reads_json() -> None:
+    json_transcoder = JSONTranscoder()
+    transcoder = CompactTranscoder()
+    assert transcoder.decode(json_transcoder.encode({"amount_in_cents": 1})) == {"amount_in_cents": 1}
+    # And writes it unless told to be compact.
+    assert CompactTranscoder(compact=False).encode({"amount_in_cents": 1}) == b'{"amount_in_cents":1}'
+
+
+def test_errors() -> None:
+    with pytest.raises(TypeError):
+        CompactTranscoder().encode({"bytes": b"abc"})
+    with pytest.raises(ValueError):
+        CompactTranscoder().decode(b"\x01\x7f")
+    with pytest.raises(ValueError):
+        CompactTranscoder(compression="bz2")
+    with pytest.raises(ValueError):
+        CompactTranscoder.from_env({"EVENT_TRANSCODER": "msgpack"})
+
+
+def test_from_env() -> None:
+    transcoder = CompactTranscoder.from_env({})
+    assert (transcoder.compact, transcoder.compression) == (False, None)
+    transcoder = CompactTranscoder.from_env({"EVENT_TRANSCODER": "compact", "EVENT_COMPRESSION": "zlib"})
+    assert (transcoder.compact, transcoder.compression) == (True, "zlib")
+
+
+def test_stored_topics() -> None:
+    topics = stored_topics("banking.domainmodel:Account.Credited", "some.module:Other")
+    assert topics == ["banking.domainmodel:Account.Credited", "some.module:Other", "AC"]
+
+
+def test_bank_stores_compact_events(tmp_path: Path) -> None:
+    app = Bank(env=_sqlite_env(tmp_path, EVENT_TRANSCODER="compact"))
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+    app.deposit(alice, 1000)
+    app.transfer(alice, bob, 300)
+
+    notifications = app.recorder.select_notifications(1, 10)
+    assert [n.topic for n in notifications] == ["AO", "AO", "AC", "AD", "AC", "TM"]
+    assert all(n.state[0] == 1 for n in notifications)
+    assert set(TOPIC_CODES.values()) >= {n.topic for n in notifications}
+    assert app.get_account(alice).balance == 700
+    assert app.get_balance(bob) == 300
+    assert app.authenticate("bob@example.com", "bob") == bob
+    assert [m.amount for m in app.get_transactions(alice)[0]] == [300, 1000]
+    assert app.compact_snapshots() == 2
+
+
+def test_switching_encoding(tmp_path: Path) -> None:
+    app = Bank(env=_sqlite_env(tmp_path))
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    app.deposit(alice, 100)
+    app.close()
+
+    # Events written before and after switching are read alike, whichever way.
+    app = Bank(env=_sqlite_env(tmp_path, EVENT_TRANSCODER="compact", EVENT_COMPRESSION="lzma"))
+    app.deposit(alice, 100)
+    assert app.get_account(alice).balance == 200
+    assert app.get_balance(alice) == 200
+    app.close()
+
+    app = Bank(env=_sqlite_env(tmp_path, BALANCES_SQLITE_DBNAME=str(tmp_path / "rebuilt.db")))
+    app.withdraw(alice, 50)
+    assert app.get_account(alice).balance == 150
+    assert app.get_balance(alice) == 150
+    assert app.authenticate("alice@example.com", "alice") == alice
+    assert [m.balance for m in app.get_transactions(alice)[0]] == [150, 200, 100]
+    assert [n.topic for n in app.recorder.select_notifications(1, 10)] == [
+        "banking.domainmodel:Account.Opened", "banking.domainmodel:Account.Credited", "AC",
+        "banking.domainmodel:Account.Debited",
+    ]
@@ -0,0 +1,151 @@
+# coding=utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, current_thread
+from typing import Any, Dict, List, Optional, Sequence
+from unittest.mock import patch
+from uuid import UUID, uuid4
+
+import pytest
+
+from banking.applicationmodel import Bank
+from banking.domainmodel import AccountClosedError, AccountNotFoundError, InsufficientFundsError
+from banking.retries import RecordingConflict
+from banking.writers import AccountWriter
+
+
+class BlockingApply:
+    """Holds up the first batch, so that later postings queue up behind it."""
+
+    def __init__(self) -> None:
+        self.batches: List[List[Dict[str, Any]]] = []
+        self.started = Event()
+        self.release = Event()
+
+    def __call__(self, postings: Sequence[Dict[str, Any]]) -> List[Optional[Exception]]:
+        self.started.set()
+        self.release.wait()
+        self.batches.append(list(postings))
+        return [None if posting["ok"] else ValueError(posting["n"]) for posting in postings]
+
+
+def test_writer_coalesces_pending_postings() -> None:
+    apply = BlockingApply()
+    writer = AccountWriter(apply, shards=1)
+    account_id = uuid4()
+
+    first = writer.submit(account_id, {"n": 0, "ok": True})
+    apply.started.wait()
+    futures = [writer.submit(account_id, {"n": n, "ok": n % 2 == 0}) for n in range(1, 6)]
+    apply.release.set()
+
+    assert first.result() is None
+    assert [future.exception() is None for future in futures] == [False, True, False, True, False]
+    assert str(futures[0].exception()) == "1"
+    assert [len(batch) for batch in apply.batches] == [1, 5]
+    writer.close()
+    assert not any(thread.is_alive() for thread in writer.threads)
+
+
+def test_writer_batches_are_bounded() -> None:
+    apply = BlockingApply()
+    writer = AccountWriter(apply, shards=1)
+    writer.max_batch = 2
+    account_id = uuid4()
+
+    writer.submit(account_id, {"n": 0, "ok": True})
+    apply.started.wait()
+    futures = [writer.submit(account_id, {"n": n, "ok": True}) for n in range(1, 6)]
+    apply.release.set()
+
+    for future in futures:
+        future.result()
+    assert [len(batch) for batch in apply.batches] == [1, 2, 2, 1]
+    writer.close()
+
+
+def test_writer_shards_by_account() -> None:
+    threads: Dict[int, str] = {}
+
+    def apply(postings: Sequence[Dict[str, Any]]) -> List[Optional[Exception]]:
+        for posting in postings:
+            threads[posting["n"]] = current_thread().name
+        return [None] * len(postings)
+
+    writer = AccountWriter(apply, shards=4)
+    for n in range(8):
+        writer.submit(UUID(int=n), {"n": n}).result()
+    writer.close()
+
+    assert threads == {n: f"account-writer-{n % 4}" for n in range(8)}
+
+
+def _single_writer_bank() -> Bank:
+    return Bank(env={"SINGLE_WRITER_SHARDS": "4", "PASSWORD_SCRYPT_N": "1024"})
+
+
+def test_single_writer_commands() -> None:
+    app = _single_writer_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    bob = app.open_account("Bob", "bob@example.com", "bob")
+
+    app.deposit(alice, 10000)
+    app.withdraw(alice, 2000)
+    transfer_id = app.transfer(alice, bob, 2000)
+    assert app.transfer(alice, bob, 1000, uuid4()) != transfer_id
+    # Making the same transfer again does nothing.
+    assert app.transfer(alice, bob, 2000, transfer_id) == transfer_id
+    assert app.get_balance(alice) == 5000
+    assert app.get_balance(bob) == 3000
+
+    with pytest.raises(ValueError, match="Invalid deposit amount"):
+        app.deposit(alice, 0)
+    with pytest.raises(ValueError, match="Invalid withdraw amount"):
+        app.withdraw(alice, -1)
+    with pytest.raises(InsufficientFundsError):
+        app.withdraw(alice, 6000)
+    with pytest.raises(InsufficientFundsError):
+        app.transfer(bob, alice, 3001)
+    with pytest.raises(AccountNotFoundError):
+        app.deposit(uuid4(), 100)
+    app.close_account(bob)
+    with pytest.raises(AccountClosedError):
+        app.transfer(alice, bob, 100)
+
+    assert app.get_balance(alice) == 5000
+    app.close()
+    assert app.writer is not None
+    assert not any(thread.is_alive() for thread in app.writer.threads)
+
+
+def test_single_writer_retries_conflicting_batches() -> None:
+    app = _single_writer_bank()
+    alice = app.open_account("Alice", "alice@example.com", "alice")
+    apply_postings = app._apply_postings
+    conflicts = [RecordingConflict()]
+
+    def conflict_once(postings: Sequence[Dict[str, Any]]) -> List[Optional[Exception]]:
+        if conflicts:
+            raise conflicts.pop()
+        return apply_postings(postings)
+
+    with patch.object(app.writer, "apply_postings", conflict_once):
+        app.deposit(alice, 100)
+
+    assert app.get_balance(alice) == 100
+    assert app.command_retry_stats()["retries"] == 1
+
+
+def test_single_writer_hot_account() -> None:
+    app = _single_writer_bank()
+    merchant = app.open_account("Merchant", "merchant@example.com", "merchant")
+    deposits = 400
+
+    with patch.object(app, "save", wraps=app.save) as save:
+        with ThreadPoolExecutor(16) as pool:
+            list(pool.map(lambda _: app.deposit(merchant, 1), range(deposits)))
+
+    assert app.get_balance(merchant) == deposits
+    assert app.command_retry_stats()["conflicts"] == 0
+    # Concurrent deposits were coalesced into fewer saves.
+    assert save.call_count < deposits